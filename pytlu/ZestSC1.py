@@ -1,8 +1,16 @@
 import logging
 import struct
 import array
+import errno
+from time import time
+from contextlib import contextmanager
 from threading import RLock as Lock
 
+try:
+    from time import perf_counter
+except ImportError:  # Python2
+    from time import clock as perf_counter
+
 import numpy as np
 import usb.core
 
@@ -106,10 +114,110 @@ def modify_bitfile_image(bitfile):
     return ret
 
 
+class TransferStats(object):
+    '''Statistics of the USB transfers of a TLU device.
+
+    Keeps for every request type (e.g. read_register, read_data) the number of calls,
+    transferred bytes, errors, timeouts and a latency histogram with logarithmic bins.
+    Bin i counts calls with a latency of [2^(i-1), 2^i) us, bin 0 calls below 1 us.
+    A register access is one call with the number of register bytes, although the device
+    needs one control transfer per byte (read_register, write_register). The transfers to
+    configure the device (open_card, load_bitarray_to_board, close_board) are not counted.
+    '''
+    N_LATENCY_BINS = 24  # up to 8.4 s
+
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+            self._start_time = time()
+
+    def add(self, request, duration, n_bytes=0, error=False, timeout=False):
+        bin_index = min(int(duration * 1e6).bit_length(), self.N_LATENCY_BINS - 1)
+        with self._lock:
+            try:
+                stat = self._stats[request]
+            except KeyError:
+                stat = self._stats[request] = {'calls': 0, 'bytes': 0, 'errors': 0, 'timeouts': 0,
+                                               'total_time': 0.0, 'max_time': 0.0,
+                                               'latency_hist': [0] * self.N_LATENCY_BINS}
+            stat['calls'] += 1
+            stat['bytes'] += n_bytes
+            stat['errors'] += error
+            stat['timeouts'] += timeout
+            stat['total_time'] += duration
+            if duration > stat['max_time']:
+                stat['max_time'] = duration
+            stat['latency_hist'][bin_index] += 1
+
+    @contextmanager
+    def measure(self, request, n_bytes=0):
+        '''Measure the duration of the enclosed transfer.
+        The yielded dict can be used to set the number of transferred bytes after the transfer.
+        '''
+        transfer = {'n_bytes': n_bytes}
+        start = perf_counter()
+        try:
+            yield transfer
+        except usb.core.USBError as e:
+            self.add(request, perf_counter() - start, error=True, timeout=(e.errno == errno.ETIMEDOUT))
+            raise
+        except Exception:
+            self.add(request, perf_counter() - start, error=True)
+            raise
+        else:
+            self.add(request, perf_counter() - start, n_bytes=transfer['n_bytes'])
+
+    def get_stats(self):
+        '''Returns a copy of the statistics including derived quantities (rates in 1/s and B/s, latencies in s).
+        '''
+        with self._lock:
+            elapsed = time() - self._start_time
+            stats = {}
+            for request, stat in self._stats.items():
+                stat = dict(stat, latency_hist=list(stat['latency_hist']))
+                stat['mean_time'] = stat['total_time'] / stat['calls']
+                stat['p99_time'] = self.percentile_time(stat['latency_hist'], 0.99)
+                stat['call_rate'] = stat['calls'] / elapsed if elapsed > 0 else 0.0
+                stat['throughput'] = stat['bytes'] / elapsed if elapsed > 0 else 0.0
+                stats[request] = stat
+        return {'elapsed': elapsed, 'requests': stats}
+
+    @staticmethod
+    def percentile_time(latency_hist, fraction):
+        '''Upper bin edge (in s) of the latency histogram below which the given fraction of calls is.
+        '''
+        total = sum(latency_hist)
+        counts = 0
+        for bin_index, n in enumerate(latency_hist):
+            counts += n
+            if total and counts >= fraction * total:
+                return 2**bin_index * 1e-6
+        return 0.0
+
+    def log(self, log=logger.info):
+        stats = self.get_stats()
+        for request in sorted(stats['requests']):
+            stat = stats['requests'][request]
+            log('%-15s calls: %8d | bytes: %10d (%.1f kB/s) | errors: %3d | timeouts: %3d | latency: mean %.3f ms, p99 < %.3f ms, max %.3f ms',
+                request, stat['calls'], stat['bytes'], stat['throughput'] / 1e3, stat['errors'], stat['timeouts'],
+                stat['mean_time'] * 1e3, stat['p99_time'] * 1e3, stat['max_time'] * 1e3)
+
+
 class TluDevice:
     # device is not None if usb.core.find() does not find any boards
     def __init__(self, device=None):
-        self._lock = Lock()
+        # One lock per endpoint. Transfers on different endpoints are handled
+        # concurrently by libusb, thus a long bulk read (e.g. with timeout)
+        # does not block register access and vice versa.
+        self._ctrl_lock = Lock()
+        self._bulk_in_lock = Lock()
+        self._bulk_out_lock = Lock()
+        self._int_lock = Lock()
+        self.stats = TransferStats()
         self.dev = device
         self.dev.set_configuration()
 
@@ -162,8 +270,10 @@ class TluDevice:
         return self.get_firmware_version()
 
     def read_eeprom(self, address):
-        return self.dev.ctrl_transfer(ENDPOINT['read_ctrl'],
-                                      REQUEST['read_eeprom'], address, 0, 3, timeout=1000)
+        with self._ctrl_lock:
+            with self.stats.measure('read_eeprom', 3):
+                return self.dev.ctrl_transfer(ENDPOINT['read_ctrl'],
+                                              REQUEST['read_eeprom'], address, 0, 3, timeout=1000)
 
     def get_fpga_type(self):
         return self.read_eeprom(EEPROM['fpga_type'])[2]
@@ -178,8 +288,10 @@ class TluDevice:
         return struct.unpack('>I', bytearray(''.join([chr(self.read_eeprom(EEPROM['memory_size'] + i)[2]) for i in range(4)]), 'utf-8'))[0]
 
     def get_firmware_version(self):
-        return np.array(self.dev.ctrl_transfer(ENDPOINT['read_ctrl'],
-                                               REQUEST['firmware'], 0, 0, 3)[0:3:], timeout=1000)
+        with self._ctrl_lock:
+            with self.stats.measure('get_firmware_version', 3):
+                return np.array(self.dev.ctrl_transfer(ENDPOINT['read_ctrl'],
+                                                       REQUEST['firmware'], 0, 0, 3, timeout=1000)[0:3:])
 
     def __str__(self):
         return str({'card_id': '{}'.format(self.get_card_id()),
@@ -189,71 +301,99 @@ class TluDevice:
                     # 'firmware_version': '{}?'.format(self.get_firmware_version())
                     })
 
+    def get_transfer_stats(self):
+        return self.stats.get_stats()
+
+    def reset_transfer_stats(self):
+        self.stats.reset()
+
     def _reset_8051(self):
         ret = np.array([0, 0])
-        ret[0] = self.dev.ctrl_transfer(ENDPOINT['write_ctrl'],
-                                        REQUEST['reset_8051'], VALUE_8051, 0, [1], timeout=1000)
-        ret[1] = self.dev.ctrl_transfer(ENDPOINT['write_ctrl'],
-                                        REQUEST['reset_8051'], VALUE_8051, 0, [0], timeout=1000)
+        with self._ctrl_lock:
+            ret[0] = self.dev.ctrl_transfer(ENDPOINT['write_ctrl'],
+                                            REQUEST['reset_8051'], VALUE_8051, 0, [1], timeout=1000)
+            ret[1] = self.dev.ctrl_transfer(ENDPOINT['write_ctrl'],
+                                            REQUEST['reset_8051'], VALUE_8051, 0, [0], timeout=1000)
+
+    @contextmanager
+    def _all_locks(self):
+        '''Acquire the locks of all endpoints (always in the same order).
+        Needed when (re-)configuring the board.
+        '''
+        with self._ctrl_lock:
+            with self._bulk_in_lock:
+                with self._bulk_out_lock:
+                    with self._int_lock:
+                        yield
 
 # Not sure why endpoint is 'read_ctrl' and not 'write_ctrl'
     def write_register(self, index, data):
-        with self._lock:
-            for i, d in enumerate(data):
-                ret = self.dev.ctrl_transfer(ENDPOINT['read_ctrl'],
-                                             REQUEST['write_register'], wValue=index + i, wIndex=d,
-                                             data_or_wLength=1, timeout=1000)
-                logger.debug('write_register: {}'.format(ret))
+        with self._ctrl_lock:
+            with self.stats.measure('write_register', len(data)):
+                for i, d in enumerate(data):
+                    ret = self.dev.ctrl_transfer(ENDPOINT['read_ctrl'],
+                                                 REQUEST['write_register'], wValue=index + i, wIndex=d,
+                                                 data_or_wLength=1, timeout=1000)
+                    logger.debug('write_register: {}'.format(ret))
 
     def read_register(self, index, length):
         ret = array.array('B',  ('\x00' * length).encode('utf-8'))
-        with self._lock:
-            for i in range(length):
-                ctrl_ret = self.dev.ctrl_transfer(ENDPOINT['read_ctrl'],
-                                                  REQUEST['read_register'], wValue=index + i, wIndex=0,
-                                                  data_or_wLength=2, timeout=1000)
-                ret[i] = ctrl_ret[1]
+        with self._ctrl_lock:
+            with self.stats.measure('read_register', length):
+                for i in range(length):
+                    ctrl_ret = self.dev.ctrl_transfer(ENDPOINT['read_ctrl'],
+                                                      REQUEST['read_register'], wValue=index + i, wIndex=0,
+                                                      data_or_wLength=2, timeout=1000)
+                    ret[i] = ctrl_ret[1]
 
         logger.debug('read_register: {}'.format(ret))
         return ret
 
 # Not sure if timeout=1000 is necessary
     def write_data(self, data):
-        with self._lock:
-            assert self.dev.write(ENDPOINT['write_data'], data) == len(data)
+        with self._bulk_out_lock:
+            with self.stats.measure('write_data', len(data)):
+                assert self.dev.write(ENDPOINT['write_data'], data) == len(data)
 
     def read_data(self, length):
-        with self._lock:
-            ret = self.dev.read(ENDPOINT['read_data'], length, timeout=1000)
+        with self._bulk_in_lock:
+            with self.stats.measure('read_data') as transfer:
+                ret = self.dev.read(ENDPOINT['read_data'], length, timeout=1000)
+                transfer['n_bytes'] = len(ret)
 
         logger.debug('read_data: {}'.format(ret))
         return ret
 
     def set_signal_direction(self, direction):
-        with self._lock:
-            ret = self.dev.ctrl_transfer(ENDPOINT['read_ctrl'],
-                                         REQUEST['signal_direction'], wValue=direction, wIndex=0,
-                                         data_or_wLength=1, timeout=1000)
+        with self._ctrl_lock:
+            with self.stats.measure('set_signal_direction', 1):
+                ret = self.dev.ctrl_transfer(ENDPOINT['read_ctrl'],
+                                             REQUEST['signal_direction'], wValue=direction, wIndex=0,
+                                             data_or_wLength=1, timeout=1000)
         logger.debug('set_signal_direction: {}'.format(ret))
 
     def set_signal(self, signal):
-        with self._lock:
-            ret = self.dev.ctrl_transfer(ENDPOINT['read_ctrl'],
-                                         REQUEST['set_signal'], wValue=signal, wIndex=0,
-                                         data_or_wLength=1, timeout=1000)
+        with self._ctrl_lock:
+            with self.stats.measure('set_signal', 1):
+                ret = self.dev.ctrl_transfer(ENDPOINT['read_ctrl'],
+                                             REQUEST['set_signal'], wValue=signal, wIndex=0,
+                                             data_or_wLength=1, timeout=1000)
         logger.debug('set_signal: {}'.format(ret))
 
     def get_signal(self):
-        with self._lock:
-            ret = self.dev.ctrl_transfer(ENDPOINT['read_ctrl'],
-                                         REQUEST['get_signal'], wValue=0, wIndex=0,
-                                         data_or_wLength=2, timeout=1000)
+        with self._ctrl_lock:
+            with self.stats.measure('get_signal', 2):
+                ret = self.dev.ctrl_transfer(ENDPOINT['read_ctrl'],
+                                             REQUEST['get_signal'], wValue=0, wIndex=0,
+                                             data_or_wLength=2, timeout=1000)
         logger.debug('get_signal: {}'.format(ret))
         return ret
 
     def read_int(self, length):
-        with self._lock:
-            ret = self.dev.read(ENDPOINT['read_int'], length, timeout=1000)
+        with self._int_lock:
+            with self.stats.measure('read_int') as transfer:
+                ret = self.dev.read(ENDPOINT['read_int'], length, timeout=1000)
+                transfer['n_bytes'] = len(ret)
         logger.debug('read_int: {}'.format(ret))
         return ret
 
@@ -261,7 +401,7 @@ class TluDevice:
 # One should send a 4096 byte dummy configuration if the first configuration
 # fails? Default should be to use reset_8051() instead of open_card().
     def open_card(self):
-        with self._lock:
+        with self._all_locks():
             self._reset_8051()
 
             ret = self.dev.ctrl_transfer(ENDPOINT['read_ctrl'],
@@ -278,7 +418,7 @@ class TluDevice:
             self._reset_8051()
 
     def load_bitarray_to_board(self, bitarray):
-        with self._lock:
+        with self._all_locks():
             self._reset_8051()
 
             length = len(bitarray)
@@ -298,7 +438,7 @@ class TluDevice:
             logger.debug('ctrl_transfer: {}'.format(ret))
 
     def close_board(self):
-        with self._lock:
+        with self._all_locks():
             ret = self.dev.ctrl_transfer(ENDPOINT['read_ctrl'],
                                          REQUEST['write_config'], wValue=4096, wIndex=4096,
                                          data_or_wLength=array.array('B', [0, 0]), timeout=1000)
@@ -70,5 +70,14 @@ class ZestSC1Usb(SiTransferLayer):
         elif(addr >= self.BASE_ADDRESS_BLOCK and addr < self.HIGH_ADDRESS_BLOCK):
             return self._dev.read_data(size)
 
+    def get_transfer_stats(self):
+        return self._dev.get_transfer_stats()
+
+    def reset_transfer_stats(self):
+        self._dev.reset_transfer_stats()
+
+    def log_transfer_stats(self):
+        self._dev.stats.log()  # logger of pytlu.ZestSC1
+
     def close(self):
         self._dev.close_board()
@@ -0,0 +1,321 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Data quality analysis of recorded runs.
+
+    The raw data is processed in chunks of complete readouts, every chunk gives an AnalysisResult,
+    the results of consecutive chunks are merged exactly (including the trigger ID and time stamp
+    continuity at the chunk boundary):
+        trigger_id continuity: gaps (missing trigger IDs) and steps back, modulo 2^n_bits_trig_id
+        time_stamp monotonicity
+        trigger interval histograms (log2 bins and 1 clock cycle bins up to max_interval)
+        trigger rate per second (TLU time)
+        le0..le3 leading edge distributions, pair time differences and coincidence window occupancy (see fine_time)
+        skipped triggers per second (host time, from meta_data)
+
+    Large runs are split into ranges of complete readouts (and rotated runs into their segments),
+    the ranges are analyzed by a pool of --jobs processes and the results are merged in order.
+
+    Usage: pytlu analyze run.h5 [-o run_analysis.h5] [--jobs 4]
+    Writes the histograms and the summary (attribute summary) into <name>_analysis.h5.
+'''
+
+import argparse
+import logging
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import tables as tb
+import yaml
+
+from pytlu.data_reader import ChunkedReader, get_readout_chunks
+from pytlu.file_rotation import get_segment_files
+from pytlu.fine_time import FineTimeHistograms
+from pytlu.time_sync import FPGA_CLOCK
+
+gap_dtype = np.dtype([('index', 'u8'), ('previous_trigger_id', 'u4'), ('trigger_id', 'u4')])
+
+
+def _add_aligned(offset_a, values_a, offset_b, values_b, operation=np.add, fill=0):
+    ''' Combine two arrays that start at different offsets (e.g. seconds). Returns (offset, values). '''
+    if values_a.shape[0] == 0:
+        return offset_b, values_b.copy()
+    if values_b.shape[0] == 0:
+        return offset_a, values_a.copy()
+    offset = min(offset_a, offset_b)
+    values = np.full(max(offset_a + values_a.shape[0], offset_b + values_b.shape[0]) - offset, fill, dtype=values_a.dtype)
+    values[offset_a - offset:offset_a - offset + values_a.shape[0]] = values_a
+    operation.at(values, np.arange(offset_b - offset, offset_b - offset + values_b.shape[0]), values_b)
+    return offset, values
+
+
+class AnalysisResult(object):
+    ''' Results of the analysis of consecutive raw data records, see analyze_chunk() and merge().
+    '''
+
+    def __init__(self, n_bits_trig_id=32, max_interval=4000, max_gaps=10000):
+        self.n_bits_trig_id = n_bits_trig_id
+        self.max_interval = max_interval
+        self.max_gaps = max_gaps
+        self.n_records = 0
+        self.n_readouts = 0
+        self.n_error_readouts = 0
+        self.first = None  # (index, trigger_id, time_stamp) of the first record
+        self.last = None  # (index, trigger_id, time_stamp) of the last record
+        self.n_gaps = 0  # trigger ID steps != +1
+        self.n_missing_triggers = 0  # trigger IDs skipped by forward steps
+        self.n_steps_back = 0  # trigger ID steps <= 0
+        self.gaps = np.zeros(0, dtype=gap_dtype)  # first max_gaps gaps
+        self.n_time_stamp_not_increasing = 0
+        self.min_interval = None  # shortest trigger interval (clock cycles)
+        self.interval_histogram_log2 = np.zeros(65, dtype=np.int64)  # bin i: 2^(i-1) <= interval < 2^i
+        self.interval_histogram = np.zeros(max_interval, dtype=np.int64)  # 1 clock cycle bins
+        self.fine_time = FineTimeHistograms()
+        self.rate_offset = 0  # second of the first rate bin (TLU time since time_stamp_start)
+        self.rate = np.zeros(0, dtype=np.int64)  # triggers per second
+        self.skipped_triggers_offset = 0  # second of the first bin (host time since timestamp_start)
+        self.skipped_triggers = np.zeros(0, dtype=np.int64)  # skipped trigger counter at the end of every second, -1: no readout
+
+    @property
+    def le_histograms(self):
+        return self.fine_time.le_histograms
+
+    def _add_steps(self, index, previous_trigger_id, trigger_id):
+        ''' Trigger ID continuity of the steps previous_trigger_id -> trigger_id at the record indices index. '''
+        steps = (trigger_id.astype(np.int64) - previous_trigger_id.astype(np.int64)) % 2 ** self.n_bits_trig_id
+        selection = steps != 1
+        self.n_gaps += int(np.count_nonzero(selection))
+        self.n_steps_back += int(np.count_nonzero(steps == 0)) + int(np.count_nonzero(steps >= 2 ** (self.n_bits_trig_id - 1)))
+        forward = selection & (steps > 1) & (steps < 2 ** (self.n_bits_trig_id - 1))
+        self.n_missing_triggers += int(np.sum(steps[forward] - 1))
+        n_add = min(int(np.count_nonzero(selection)), self.max_gaps - self.gaps.shape[0])
+        if n_add > 0:
+            gaps = np.zeros(n_add, dtype=gap_dtype)
+            gaps['index'] = index[selection][:n_add]
+            gaps['previous_trigger_id'] = previous_trigger_id[selection][:n_add]
+            gaps['trigger_id'] = trigger_id[selection][:n_add]
+            self.gaps = np.concatenate((self.gaps, gaps))
+
+    def _add_intervals(self, intervals):
+        ''' Time stamp monotonicity and trigger intervals (clock cycles, int64). '''
+        self.n_time_stamp_not_increasing += int(np.count_nonzero(intervals <= 0))
+        intervals = intervals[intervals > 0]
+        if intervals.shape[0]:
+            self.min_interval = int(intervals.min()) if self.min_interval is None else min(self.min_interval, int(intervals.min()))
+        self.interval_histogram_log2 += np.bincount(np.frexp(intervals.astype(np.float64))[1], minlength=65)
+        self.interval_histogram += np.bincount(intervals[intervals < self.max_interval], minlength=self.max_interval)
+
+    def add_chunk(self, meta_data, raw_data, time_stamp_start, timestamp_start, index_offset=0):
+        ''' Analyze the readouts of a chunk (the records of raw_data start at meta_data['index_start'][0])
+            and add them. Chunks have to be added in order, time_stamp_start / timestamp_start are the
+            first TLU / host time of the run (rate and skipped trigger bins).
+        '''
+        self.merge(analyze_chunk(meta_data, raw_data, time_stamp_start, timestamp_start, n_bits_trig_id=self.n_bits_trig_id,
+                                 max_interval=self.max_interval, max_gaps=self.max_gaps, index_offset=index_offset))
+
+    def merge(self, other):
+        ''' Add the results of the following records. Exact: the result equals the result of all records at once.
+        '''
+        if self.last is not None and other.first is not None:  # continuity at the boundary
+            self._add_steps(np.array([other.first[0]]), np.array([self.last[1]]), np.array([other.first[1]]))
+            self._add_intervals(np.array([int(other.first[2]) - int(self.last[2])], dtype=np.int64))
+        self.n_gaps += other.n_gaps
+        self.n_missing_triggers += other.n_missing_triggers
+        self.n_steps_back += other.n_steps_back
+        if self.gaps.shape[0] < self.max_gaps:
+            self.gaps = np.concatenate((self.gaps, other.gaps[:self.max_gaps - self.gaps.shape[0]]))
+        self.n_time_stamp_not_increasing += other.n_time_stamp_not_increasing
+        if other.min_interval is not None:
+            self.min_interval = other.min_interval if self.min_interval is None else min(self.min_interval, other.min_interval)
+        self.interval_histogram_log2 += other.interval_histogram_log2
+        self.interval_histogram += other.interval_histogram
+        self.fine_time.merge(other.fine_time)
+        self.rate_offset, self.rate = _add_aligned(self.rate_offset, self.rate, other.rate_offset, other.rate)
+        self.skipped_triggers_offset, self.skipped_triggers = _add_aligned(self.skipped_triggers_offset, self.skipped_triggers,
+                                                                           other.skipped_triggers_offset, other.skipped_triggers, operation=np.maximum, fill=-1)
+        self.n_records += other.n_records
+        self.n_readouts += other.n_readouts
+        self.n_error_readouts += other.n_error_readouts
+        if self.first is None:
+            self.first = other.first
+        if other.last is not None:
+            self.last = other.last
+        return self
+
+    def get_summary(self):
+        ''' Returns the summary (dict of numbers) of the analysis.
+        '''
+        n_intervals = int(self.interval_histogram_log2.sum())
+        summary = {'n_records': self.n_records,
+                   'n_readouts': self.n_readouts,
+                   'n_error_readouts': self.n_error_readouts,
+                   'n_bits_trig_id': self.n_bits_trig_id,
+                   'trigger_id_first': int(self.first[1]) if self.first is not None else None,
+                   'trigger_id_last': int(self.last[1]) if self.last is not None else None,
+                   'n_trigger_id_gaps': self.n_gaps,
+                   'n_missing_triggers': self.n_missing_triggers,
+                   'n_trigger_id_steps_back': self.n_steps_back,
+                   'n_time_stamp_not_increasing': self.n_time_stamp_not_increasing,
+                   'duration': float(self.rate.shape[0]),
+                   'mean_rate': float(self.n_records / self.rate.shape[0]) if self.rate.shape[0] else 0.0,
+                   'max_rate': int(self.rate.max()) if self.rate.shape[0] else 0,
+                   'min_interval': self.min_interval,
+                   'max_interval': self.max_interval,
+                   'n_intervals_below_max_interval': int(self.interval_histogram.sum()),
+                   'n_intervals': n_intervals,
+                   'skipped_triggers': int(self.skipped_triggers.max()) if self.skipped_triggers.shape[0] else 0,
+                   'fine_time': self.fine_time.get_summary()}
+        return summary
+
+    def write(self, filename):
+        ''' Store histograms, gaps and summary in an HDF5 file.
+        '''
+        filters = tb.Filters(complib='blosc', complevel=5)
+        with tb.open_file(filename, mode='w', title='pytlu data quality analysis') as out_file:
+            out_file.create_carray(out_file.root, 'interval_histogram_log2', obj=self.interval_histogram_log2, filters=filters,
+                                   title='Trigger intervals, bin i: 2^(i-1) <= interval < 2^i clock cycles')
+            out_file.create_carray(out_file.root, 'interval_histogram', obj=self.interval_histogram, filters=filters,
+                                   title='Trigger intervals in clock cycles')
+            out_file.create_carray(out_file.root, 'le_histograms', obj=self.le_histograms, filters=filters, title='le0..le3 distributions')
+            out_file.create_carray(out_file.root, 'le_difference_histograms', obj=self.fine_time.difference_histograms, filters=filters,
+                                   title='le_i - le_j of the input pairs (i, j), bin 255: no difference')
+            out_file.create_carray(out_file.root, 'le_spread_histogram', obj=self.fine_time.spread_histogram, filters=filters,
+                                   title='max(le) - min(le) of the enabled inputs')
+            rate = out_file.create_carray(out_file.root, 'rate', obj=self.rate if self.rate.shape[0] else np.zeros(1, dtype=np.int64),
+                                          filters=filters, title='Triggers per second (TLU time)')
+            rate.attrs.offset = self.rate_offset
+            skipped_triggers = out_file.create_carray(out_file.root, 'skipped_triggers', filters=filters,
+                                                      obj=self.skipped_triggers if self.skipped_triggers.shape[0] else np.zeros(1, dtype=np.int64),
+                                                      title='Skipped trigger counter at the end of every second (host time), -1: no readout')
+            skipped_triggers.attrs.offset = self.skipped_triggers_offset
+            out_file.create_table(out_file.root, 'trigger_id_gaps', obj=self.gaps, filters=filters, title='Trigger ID steps != +1')
+            out_file.root._v_attrs.summary = yaml.safe_dump(self.get_summary(), default_flow_style=False)
+
+
+def analyze_chunk(meta_data, raw_data, time_stamp_start, timestamp_start, n_bits_trig_id=32, max_interval=4000, max_gaps=10000, index_offset=0):
+    ''' Returns the AnalysisResult of the readouts of one chunk. index_offset is added to the record indices (segments of rotated runs).
+    '''
+    result = AnalysisResult(n_bits_trig_id=n_bits_trig_id, max_interval=max_interval, max_gaps=max_gaps)
+    result.n_readouts = int(meta_data.shape[0])
+    result.n_error_readouts = int(np.count_nonzero(meta_data['error']))
+    result.n_records = int(raw_data.shape[0])
+
+    if meta_data.shape[0]:
+        seconds = np.floor(meta_data['timestamp_stop'] - timestamp_start).astype(np.int64)
+        seconds = np.maximum(seconds, 0)
+        result.skipped_triggers_offset = int(seconds.min())
+        result.skipped_triggers = np.full(int(seconds.max()) - result.skipped_triggers_offset + 1, -1, dtype=np.int64)
+        np.maximum.at(result.skipped_triggers, seconds - result.skipped_triggers_offset, meta_data['skipped_triggers'].astype(np.int64))
+    if raw_data.shape[0] == 0:
+        return result
+
+    index = index_offset + int(meta_data['index_start'][0]) + np.arange(raw_data.shape[0], dtype=np.int64)
+    trigger_id, time_stamp = raw_data['trigger_id'], raw_data['time_stamp']
+    result.first = (int(index[0]), int(trigger_id[0]), int(time_stamp[0]))
+    result.last = (int(index[-1]), int(trigger_id[-1]), int(time_stamp[-1]))
+    result._add_steps(index[1:], trigger_id[:-1], trigger_id[1:])
+    result._add_intervals(np.diff(time_stamp.astype(np.int64)))
+    result.fine_time.add(raw_data)
+
+    seconds = (time_stamp.astype(np.int64) - np.int64(time_stamp_start)) // int(FPGA_CLOCK)
+    seconds = seconds[seconds >= 0]  # time stamp reset, counted as not increasing
+    if seconds.shape[0]:
+        result.rate_offset = int(seconds.min())
+        result.rate = np.bincount(seconds - result.rate_offset)
+    return result
+
+
+def get_run_start(h5_file):
+    ''' Returns the first TLU time stamp and the first host time of a raw data file.
+    '''
+    reader = ChunkedReader(h5_file, read_ahead=0)
+    meta_data, raw_data = reader.read_readouts(0, 1)
+    time_stamp_start = int(raw_data['time_stamp'][0]) if raw_data.shape[0] else 0
+    timestamp_start = float(meta_data['timestamp_start'][0]) if meta_data.shape[0] else 0.0
+    return time_stamp_start, timestamp_start
+
+
+def get_analysis_tasks(filename, range_size=10000000):
+    ''' Split a run (raw data file or all segments of a rotated run) into independent ranges of complete readouts
+        with about range_size records. Returns list of (file name, first readout, last readout + 1, index offset).
+    '''
+    tasks = []
+    for path in get_segment_files(filename):
+        with tb.open_file(path, mode='r') as h5_file:
+            meta_data_table = h5_file.root.meta_data
+            index_offset = int(meta_data_table.attrs.index_offset) if 'index_offset' in meta_data_table.attrs._v_attrnames else 0
+            index_ranges = np.zeros(meta_data_table.nrows, dtype=[('index_start', 'u4'), ('index_stop', 'u4')])  # not all of meta_data
+            index_ranges['index_start'] = meta_data_table.col('index_start')
+            index_ranges['index_stop'] = meta_data_table.col('index_stop')
+        tasks.extend((path, first, last, index_offset) for first, last in get_readout_chunks(index_ranges, chunk_size=range_size))
+    return tasks
+
+
+def _analyze_task(args):
+    ''' Analysis of the readouts [readout_start, readout_stop) of a file (runs in a worker process).
+    '''
+    (filename, readout_start, readout_stop, index_offset), run_start, chunk_size, settings = args
+    result = AnalysisResult(**settings)
+    with ChunkedReader(filename, chunk_size=chunk_size) as reader:
+        for meta_data, raw_data in reader.chunks(readout_start, readout_stop):
+            result.add_chunk(meta_data, raw_data, run_start[0], run_start[1], index_offset=index_offset)
+    return result
+
+
+def analyze(filename, output_file=None, chunk_size=1000000, n_bits_trig_id=32, max_interval=4000, max_gaps=10000, jobs=1, range_size=10000000):
+    ''' Analyze a raw data file or a rotated run, write the results to output_file (None: <name>_analysis.h5). Returns the AnalysisResult.
+
+        jobs: number of processes, every process analyzes ranges of range_size records (rounded to complete readouts)
+    '''
+    if output_file is None:
+        output_file = os.path.splitext(filename)[0] + '_analysis.h5'
+    settings = {'n_bits_trig_id': n_bits_trig_id, 'max_interval': max_interval, 'max_gaps': max_gaps}
+    tasks = get_analysis_tasks(filename, range_size=range_size)
+    with tb.open_file(tasks[0][0] if tasks else get_segment_files(filename)[0], mode='r') as h5_file:
+        run_start = get_run_start(h5_file)
+    task_args = [(task, run_start, chunk_size, settings) for task in tasks]
+
+    result = AnalysisResult(**settings)
+    if jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(tasks)), initializer=tb.set_blosc_max_threads, initargs=(1,))
+        try:
+            for partial_result in pool.imap(_analyze_task, task_args):  # in order, merge of consecutive ranges
+                result.merge(partial_result)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for args in task_args:
+            result.merge(_analyze_task(args))
+    result.write(output_file)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pytlu analyze', description='Data quality analysis of a raw data file')
+    parser.add_argument('input_file', type=str, help='Raw data file (or data file name of a rotated run)')
+    parser.add_argument('-o', '--output_file', type=str, default=None, help='Output file. Default=<input>_analysis.h5')
+    parser.add_argument('--n_bits_trig_id', type=int, default=32, help='Number of bits of the trigger ID (continuity modulo 2^n). Default=32')
+    parser.add_argument('--max_interval', type=int, default=4000, help='Range of the trigger interval histogram in clock cycles. Default=4000')
+    parser.add_argument('--max_gaps', type=int, default=10000, help='Maximum number of trigger ID gaps stored. Default=10000')
+    parser.add_argument('--chunk_size', type=int, default=1000000, help='Number of records processed at once. Default=1000000')
+    parser.add_argument('--range_size', type=int, default=10000000, help='Number of records analyzed by one process at once. Default=10000000')
+    parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(), help='Number of processes. Default=number of CPUs')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    result = analyze(args.input_file, output_file=args.output_file, chunk_size=args.chunk_size, n_bits_trig_id=args.n_bits_trig_id,
+                     max_interval=args.max_interval, max_gaps=args.max_gaps, jobs=args.jobs, range_size=args.range_size)
+    print(yaml.safe_dump(result.get_summary(), default_flow_style=False))
+    logging.info('Analyzed %d records in %0.1f s', result.n_records, time.time() - start)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    asyncio consumer API for the readout data (Python 3 only, imported by Tlu.astream()).
+'''
+
+import logging
+import asyncio
+
+from pytlu.data_stream import DataStream
+
+
+class AsyncDataStream(DataStream):
+    ''' asyncio iterator over the readout data tuples (async for).
+
+        Has to be created from within the event loop that consumes the data.
+    '''
+
+    def __init__(self, maxsize=1000, timeout=None, on_close=None, loop=None):
+        super(AsyncDataStream, self).__init__(maxsize=maxsize, timeout=timeout, on_close=on_close)
+        if loop is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = asyncio.get_event_loop()
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=maxsize)
+        self._stopped = False
+
+    def put(self, data_tuple):
+        if self._closed or self._stopped:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._put, data_tuple)
+        except RuntimeError:  # event loop closed
+            self._closed = True
+
+    def _put(self, data_tuple):
+        if self._stopped:
+            return
+        try:
+            self._queue.put_nowait(data_tuple)
+        except asyncio.QueueFull:
+            if not self.dropped:
+                logging.warning('Data stream buffer full (%d readouts), dropping data', self.maxsize)
+            self.dropped += 1
+
+    def stop(self):
+        try:
+            self._loop.call_soon_threadsafe(self._stop)
+        except RuntimeError:  # event loop closed
+            pass
+
+    def _stop(self):
+        if self._stopped:
+            return
+        self._stopped = True
+        while True:
+            try:
+                self._queue.put_nowait(None)
+            except asyncio.QueueFull:  # make room for end marker
+                self._queue.get_nowait()
+                self.dropped += 1
+            else:
+                break
+
+    async def get(self, timeout=None):
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def __iter__(self):
+        raise TypeError('Use "async for" to iterate over an AsyncDataStream')
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._closed:
+            raise StopAsyncIteration
+        data_tuple = await self.get(timeout=self.timeout)
+        if data_tuple is None or self._closed:
+            self.close()
+            raise StopAsyncIteration
+        return data_tuple
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,142 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Benchmark of the raw data storage settings (layout, compression library, level, shuffle, chunkshape).
+
+    The readouts of a reference raw data file are replayed through the data writer once per
+    setting. Write and read speed (MB/s of uncompressed raw data) and compression ratio are reported.
+
+    Usage: pytlu benchmark reference.h5 --layout table delta --complib blosc:lz4 zlib --complevel 1 5 --shuffle byte bit
+'''
+
+import argparse
+import itertools
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import tables as tb
+import yaml
+
+from pytlu.data_writer import create_file_writer, create_filters, writer_classes
+from pytlu.data_reader import RawDataReader, get_data_dtype
+
+
+def load_readouts(filename, max_rows=None):
+    ''' Returns the readouts of a raw data file as list of data tuples
+        (raw_data, timestamp_start, timestamp_stop, error, skipped_triggers).
+    '''
+    readouts = []
+    with tb.open_file(filename, mode='r') as in_file:
+        reader = RawDataReader(in_file)
+        meta_data = in_file.root.meta_data[:]
+        n_rows = len(reader) if max_rows is None else min(max_rows, len(reader))
+        raw_data = reader.read(0, n_rows)
+        for meta in meta_data:
+            if meta['index_start'] >= n_rows:
+                break
+            readouts.append((raw_data[meta['index_start']:min(meta['index_stop'], n_rows)], meta['timestamp_start'],
+                             meta['timestamp_stop'], meta['error'], meta['skipped_triggers']))
+        return readouts, get_data_dtype(in_file), meta_data.dtype
+
+
+def run_setting(readouts, data_dtype, meta_data_dtype, filename, layout, complib, complevel, shuffle, chunkshape, read_size=1000000):
+    ''' Write and read back the readouts with one storage setting. Returns dict with the results.
+    '''
+    n_bytes = sum(readout[0].nbytes for readout in readouts)
+    start = time.time()
+    writer = create_file_writer(filename, data_dtype, meta_data_dtype, layout=layout,
+                                filter_data=create_filters(complib=complib, complevel=complevel, shuffle=shuffle),
+                                chunkshape=chunkshape)
+    for readout in readouts:
+        writer.append(readout)
+    data_node = writer.data_table
+    if isinstance(data_node, tb.Group):  # column layout
+        data_node = data_node._f_list_nodes()[0]
+    chunkshape = data_node.chunkshape[0]
+    writer.close()
+    write_time = time.time() - start
+
+    start = time.time()
+    with tb.open_file(filename, mode='r') as in_file:
+        reader = RawDataReader(in_file)
+        for index in range(0, len(reader), read_size):
+            reader.read(index, index + read_size)
+    read_time = time.time() - start
+    size_on_disk = os.path.getsize(filename)
+
+    return {'layout': layout,
+            'complib': complib,
+            'complevel': complevel,
+            'shuffle': shuffle,
+            'chunkshape': int(chunkshape),
+            'write_speed': n_bytes / write_time / 1e6,
+            'read_speed': n_bytes / read_time / 1e6,
+            'compression_ratio': float(n_bytes) / size_on_disk if size_on_disk else float('nan')}
+
+
+def benchmark(filename, layouts, complibs, complevels, shuffles, chunkshapes, max_rows=None, tmp_dir=None):
+    ''' Run the benchmark for all combinations of the settings. Returns list of result dicts.
+    '''
+    readouts, data_dtype, meta_data_dtype = load_readouts(filename, max_rows=max_rows)
+    n_bytes = sum(readout[0].nbytes for readout in readouts)
+    logging.info('Replaying %d readouts (%0.1f MB raw data) of %s', len(readouts), n_bytes / 1e6, filename)
+    results = []
+    tmp_dir = tempfile.mkdtemp(dir=tmp_dir)
+    try:
+        for layout, complib, complevel, shuffle, chunkshape in itertools.product(layouts, complibs, complevels, shuffles, chunkshapes):
+            try:
+                create_filters(complib=complib, complevel=complevel, shuffle=shuffle)
+            except ValueError as e:
+                logging.warning('Skipping %s, level %d, %s shuffle: %s', complib, complevel, shuffle, e)
+                continue
+            out_file = os.path.join(tmp_dir, 'benchmark.h5')
+            results.append(run_setting(readouts, data_dtype, meta_data_dtype, out_file, layout, complib, complevel, shuffle, chunkshape))
+            os.remove(out_file)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return results
+
+
+def print_results(results):
+    print('%-7s %-14s %5s %7s %10s %13s %12s %9s' % ('layout', 'complib', 'level', 'shuffle', 'chunkshape', 'write [MB/s]', 'read [MB/s]', 'ratio'))
+    for result in results:
+        print('%-7s %-14s %5d %7s %10d %13.1f %12.1f %9.2f' % (result['layout'], result['complib'], result['complevel'], result['shuffle'], result['chunkshape'],
+                                                               result['write_speed'], result['read_speed'], result['compression_ratio']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pytlu benchmark', description='Benchmark of raw data compression settings using a reference raw data file')
+    parser.add_argument('input_file', type=str, help='Reference raw data file (HDF5)')
+    parser.add_argument('--layout', type=str, nargs='+', default=['table'], choices=list(writer_classes), help='Raw data layouts. Default=table')
+    parser.add_argument('--complib', type=str, nargs='+', default=['blosc:lz4', 'blosc:zstd', 'blosc', 'zlib'],
+                        help='Compression libraries. Default=blosc:lz4 blosc:zstd blosc zlib')
+    parser.add_argument('--complevel', type=int, nargs='+', default=[1, 5, 9], help='Compression levels. Default=1 5 9')
+    parser.add_argument('--shuffle', type=str, nargs='+', default=['byte', 'bit'], choices=['none', 'byte', 'bit'], help='Shuffle filters. Default=byte bit')
+    parser.add_argument('--chunkshape', type=int, nargs='+', default=[None], help='Chunk sizes in rows. Default=chosen by PyTables')
+    parser.add_argument('--max_rows', type=int, default=None, help='Use only the first rows of the reference file')
+    parser.add_argument('--tmp_dir', type=str, default=None, help='Directory of the temporary files (should be on the disk used for data taking)')
+    parser.add_argument('-o', '--output', type=str, default=None, help='Store results as YAML file')
+    args = parser.parse_args(argv)
+
+    for complib in args.complib:
+        if complib not in tb.filters.all_complibs:
+            parser.error('Unknown compression library %s. Allowed values are %s' % (complib, ', '.join(tb.filters.all_complibs)))
+
+    results = benchmark(args.input_file, layouts=args.layout, complibs=args.complib, complevels=args.complevel, shuffles=args.shuffle,
+                        chunkshapes=args.chunkshape, max_rows=args.max_rows, tmp_dir=args.tmp_dir)
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            yaml.safe_dump(results, f, default_flow_style=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,391 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Catalogue of the runs in an output folder (SQLite file run_catalogue.sqlite) for queries without opening the data files.
+
+    One row per run (data file, rotated run or raw capture) with the file location, the TLU configuration
+    (enabled inputs, coincidence window, threshold, ... from the config attribute), the number of
+    readouts and triggers, duration, trigger rate, skipped triggers and readout errors. The catalogue
+    is updated at the end of every run and can be rebuilt by scanning the folder.
+
+    pytlu catalogue output_data --scan: rebuild
+    pytlu catalogue output_data --inputs CH0 CH1 --min_triggers 1000000: runs with coincidence of CH0 and CH1 and more than 1M triggers
+'''
+
+import argparse
+import fnmatch
+import logging
+import os
+import re
+import sqlite3
+import time
+
+import numpy as np
+import tables as tb
+import yaml
+
+from pytlu.data_reader import RawDataReader, get_layout
+from pytlu.file_rotation import MANIFEST_SUFFIX, get_manifest_name, get_segment_files
+from pytlu.raw_capture import RawCaptureReader, get_capture_name
+from pytlu.recover import load_journal
+
+CATALOGUE_NAME = 'run_catalogue.sqlite'
+input_ch = ['CH0', 'CH1', 'CH2', 'CH3']
+output_ch = ['CH0', 'CH1', 'CH2', 'CH3', 'CH4', 'CH5']
+
+# Column name, SQL type
+columns = [('path', 'TEXT PRIMARY KEY'),  # data file name (rotated runs: name without segment number)
+           ('run_name', 'TEXT'),
+           ('folder', 'TEXT'),
+           ('layout', 'TEXT'),
+           ('n_segments', 'INTEGER'),
+           ('size', 'INTEGER'),  # bytes
+           ('finished', 'INTEGER'),  # 0: run did not end properly (see pytlu recover), NULL: unknown
+           ('start_time', 'REAL'),  # host time of the first readout
+           ('stop_time', 'REAL'),
+           ('duration', 'REAL'),  # s
+           ('n_readouts', 'INTEGER'),
+           ('n_triggers', 'INTEGER'),  # recorded triggers (raw data records)
+           ('first_trigger_id', 'INTEGER'),
+           ('last_trigger_id', 'INTEGER'),
+           ('skipped_triggers', 'INTEGER'),
+           ('n_errors', 'INTEGER'),  # readouts with error
+           ('trigger_rate', 'REAL'),  # recorded triggers / duration (Hz)
+           ('input_enable', 'TEXT'),  # e.g. CH0,CH1
+           ('en_input', 'INTEGER'),  # bit mask
+           ('output_enable', 'TEXT'),
+           ('coincidence_window', 'INTEGER'),
+           ('threshold', 'INTEGER'),
+           ('n_bits_trig_id', 'INTEGER'),
+           ('timeout', 'INTEGER'),
+           ('config', 'TEXT'),  # YAML
+           ('kwargs', 'TEXT'),  # YAML
+           ('updated', 'REAL')]
+column_names = [name for name, _ in columns]
+
+
+def get_catalogue_name(folder):
+    return os.path.join(folder, CATALOGUE_NAME)
+
+
+def _to_str(value):
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
+def _get_channels(mask, channels):
+    return ','.join(channel for i, channel in enumerate(channels) if mask is not None and int(mask) >> i & 1)
+
+
+def get_config_info(config):
+    ''' Returns the catalogue columns of the TLU configuration (YAML string of Tlu.get_configuration()).
+    '''
+    try:
+        registers = (yaml.safe_load(config) or {}).get('tlu_master', {}) if config else {}
+    except yaml.YAMLError:
+        registers = {}
+    return {'en_input': registers.get('EN_INPUT'),
+            'input_enable': _get_channels(registers.get('EN_INPUT'), input_ch) if 'EN_INPUT' in registers else None,
+            'output_enable': _get_channels(registers.get('EN_OUTPUT'), output_ch) if 'EN_OUTPUT' in registers else None,
+            'coincidence_window': registers.get('MAX_DISTANCE'),
+            'threshold': registers.get('THRESHOLD'),
+            'n_bits_trig_id': registers.get('N_BITS_TRIGGER_ID'),
+            'timeout': registers.get('TIMEOUT')}
+
+
+def _get_meta_info(meta_data):
+    if meta_data.shape[0] == 0:
+        return {'n_readouts': 0, 'n_triggers': 0, 'skipped_triggers': 0, 'n_errors': 0, 'start_time': None, 'stop_time': None}
+    return {'n_readouts': int(meta_data.shape[0]),
+            'n_triggers': int(meta_data['data_length'].sum(dtype=np.uint64)),
+            'skipped_triggers': int(meta_data['skipped_triggers'][-1]),  # counter of the TLU since the run start
+            'n_errors': int(np.count_nonzero(meta_data['error'])),
+            'start_time': float(meta_data['timestamp_start'][0]),
+            'stop_time': float(meta_data['timestamp_stop'][-1])}
+
+
+def _merge_meta_info(info, other):
+    for name in ('n_readouts', 'n_triggers', 'n_errors'):
+        info[name] += other[name]
+    info['skipped_triggers'] = max(info['skipped_triggers'], other['skipped_triggers'])  # cumulative counter
+    if info['start_time'] is None:
+        info['start_time'] = other['start_time']
+    if other['stop_time'] is not None:
+        info['stop_time'] = other['stop_time']
+    return info
+
+
+def _read_trigger_id(h5_file, index):
+    raw_data = RawDataReader(h5_file).read(index, index + 1)
+    return int(raw_data['trigger_id'][0]) if raw_data.shape[0] else None
+
+
+def _get_h5_info(segment_files):
+    info, attrs = None, {}
+    first_trigger_id = last_trigger_id = None
+    for segment_file in segment_files:
+        with tb.open_file(segment_file, mode='r') as h5_file:
+            meta_data = h5_file.root.meta_data[:]
+            segment_info = _get_meta_info(meta_data)
+            info = segment_info if info is None else _merge_meta_info(info, segment_info)
+            if segment_info['n_triggers']:
+                if first_trigger_id is None:
+                    first_trigger_id = _read_trigger_id(h5_file, int(meta_data['index_start'][0]))
+                last_trigger_id = _read_trigger_id(h5_file, int(meta_data['index_stop'][-1]) - 1)
+            if not attrs:
+                meta_attrs = h5_file.root.meta_data.attrs
+                attrs = dict((name, _to_str(meta_attrs[name])) for name in ('config', 'kwargs') if name in meta_attrs)
+                attrs['layout'] = str(get_layout(h5_file))
+    info.update({'first_trigger_id': first_trigger_id, 'last_trigger_id': last_trigger_id})
+    return info, attrs
+
+
+def _get_capture_info(name):
+    capture = RawCaptureReader(name)
+    info = _get_meta_info(capture.meta_data)
+    info['first_trigger_id'] = int(capture.raw_data['trigger_id'][0]) if capture.n_words else None
+    info['last_trigger_id'] = int(capture.raw_data['trigger_id'][-1]) if capture.n_words else None
+    attrs = dict((name, _to_str(capture.attrs[name])) for name in ('config', 'kwargs') if name in capture.attrs)
+    attrs['layout'] = 'raw'
+    return info, attrs
+
+
+def get_run_info(data_file):
+    ''' Returns the catalogue row (dict) of a run. data_file is the HDF5 file name of the run (also of rotated runs and raw captures).
+    '''
+    data_file = os.path.abspath(data_file)
+    capture_name = get_capture_name(data_file)
+    if os.path.exists(data_file) or os.path.exists(get_manifest_name(data_file)):
+        files = get_segment_files(data_file)
+        info, attrs = _get_h5_info(files)
+    elif os.path.exists(capture_name + '.raw'):
+        files = [capture_name + ext for ext in ('.raw', '.idx', '.yaml')]
+        info, attrs = _get_capture_info(capture_name)
+    else:
+        raise IOError('No data of run %s' % data_file)
+    journal = load_journal(data_file)
+    info.update({'path': data_file,
+                 'run_name': os.path.splitext(os.path.basename(data_file))[0],
+                 'folder': os.path.dirname(data_file),
+                 'layout': attrs['layout'],
+                 'n_segments': len(files) if attrs['layout'] != 'raw' else 1,
+                 'size': sum(os.path.getsize(name) for name in files if os.path.exists(name)),
+                 'finished': int(journal['finished']) if journal and 'finished' in journal else None,
+                 'config': attrs.get('config'),
+                 'kwargs': attrs.get('kwargs'),
+                 'updated': time.time()})
+    info['duration'] = info['stop_time'] - info['start_time'] if info['start_time'] is not None else 0.0
+    info['trigger_rate'] = info['n_triggers'] / info['duration'] if info['duration'] > 0 else None
+    info.update(get_config_info(info['config']))
+    return info
+
+
+def find_runs(folder):
+    ''' Returns the HDF5 file names of the runs in folder and its sub folders (segments are part of their run).
+    '''
+    runs = set()
+    for root, _, filenames in os.walk(folder):
+        segments = set()
+        for filename in fnmatch.filter(filenames, '*' + MANIFEST_SUFFIX):
+            data_file = os.path.join(root, filename[:-len(MANIFEST_SUFFIX)] + '.h5')
+            runs.add(data_file)
+            segments.update(os.path.basename(name) for name in get_segment_files(data_file))
+        for filename in filenames:
+            if filename in segments:
+                continue
+            if filename.endswith('.h5') or filename.endswith('.raw'):
+                runs.add(os.path.join(root, get_capture_name(filename) + '.h5'))
+    return sorted(runs)
+
+
+class RunCatalogue(object):
+    ''' Catalogue of runs (SQLite file), see query().
+
+        Example:
+            with RunCatalogue('output_data/run_catalogue.sqlite') as catalogue:
+                runs = catalogue.query(inputs=['CH0', 'CH1'], min_triggers=1000000)
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename, timeout=30.0)  # several runs can end at the same time
+        self.connection.row_factory = sqlite3.Row
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS runs (%s)' % ', '.join('%s %s' % column for column in columns))
+            for name in ('start_time', 'n_triggers', 'en_input'):
+                self.connection.execute('CREATE INDEX IF NOT EXISTS runs_%s ON runs (%s)' % (name, name))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM runs').fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+    def add_run(self, data_file):
+        ''' Add or update a run. Returns the catalogue row (dict).
+        '''
+        info = get_run_info(data_file)
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO runs (%s) VALUES (%s)' % (', '.join(column_names), ', '.join('?' * len(column_names))),
+                                    [info[name] for name in column_names])
+        return info
+
+    def remove_run(self, data_file):
+        with self.connection:
+            self.connection.execute('DELETE FROM runs WHERE path = ?', (os.path.abspath(data_file),))
+
+    def scan(self, folder, rebuild=True):
+        ''' Add the runs in folder. rebuild: remove runs whose data is gone. Returns the number of runs added.
+        '''
+        folder = os.path.abspath(folder)
+        runs = find_runs(folder)
+        n_added = 0
+        for data_file in runs:
+            try:
+                self.add_run(data_file)
+                n_added += 1
+            except (IOError, OSError, tb.NoSuchNodeError, tb.HDF5ExtError, KeyError, ValueError) as e:  # no raw data file (e.g. analysis output) or damaged
+                logging.debug('Skipping %s: %s', data_file, e)
+        if rebuild:
+            with self.connection:
+                for row in self.connection.execute('SELECT path FROM runs WHERE folder = ? OR folder LIKE ?', (folder, folder + os.sep + '%')).fetchall():
+                    if row['path'] not in runs:
+                        self.connection.execute('DELETE FROM runs WHERE path = ?', (row['path'],))
+        return n_added
+
+    def query(self, inputs=None, min_triggers=None, max_triggers=None, min_duration=None, max_duration=None, min_rate=None, max_rate=None,
+              since=None, until=None, name=None, finished=None, config=None, order_by='start_time'):
+        ''' Returns the runs (list of dict) matching all given conditions.
+
+            inputs: enabled trigger inputs (exactly), e.g. ['CH0', 'CH1']
+            min_triggers, max_triggers: number of recorded triggers
+            min_duration, max_duration: duration in s
+            min_rate, max_rate: trigger rate in Hz
+            since, until: run start (host time in s)
+            name: run name pattern (glob, e.g. '2024*')
+            finished: True/False: run ended properly
+            config: dict of catalogue column -> value (e.g. {'coincidence_window': 10}) or
+                    tlu_master register -> value (e.g. {'THRESHOLD': 2}, compared with the stored configuration)
+        '''
+        conditions, parameters, registers = [], [], {}
+        if inputs is not None:
+            conditions.append('en_input = ?')
+            parameters.append(sum(1 << input_ch.index(channel) for channel in set(inputs)))
+        for column, operator, value in (('n_triggers', '>=', min_triggers), ('n_triggers', '<=', max_triggers),
+                                        ('duration', '>=', min_duration), ('duration', '<=', max_duration),
+                                        ('trigger_rate', '>=', min_rate), ('trigger_rate', '<=', max_rate),
+                                        ('start_time', '>=', since), ('start_time', '<', until)):
+            if value is not None:
+                conditions.append('%s %s ?' % (column, operator))
+                parameters.append(value)
+        if name is not None:
+            conditions.append('run_name GLOB ?')
+            parameters.append(name)
+        if finished is not None:
+            conditions.append('finished = ?')
+            parameters.append(int(finished))
+        for key, value in (config or {}).items():
+            if key in column_names:
+                conditions.append('%s = ?' % key)
+                parameters.append(value)
+            else:
+                registers[key] = value
+        if order_by not in column_names:
+            raise ValueError('Unknown column %s' % order_by)
+        sql = 'SELECT * FROM runs' + (' WHERE ' + ' AND '.join(conditions) if conditions else '') + ' ORDER BY %s, path' % order_by
+        runs = [dict(row) for row in self.connection.execute(sql, parameters)]
+        if registers:
+            runs = [run for run in runs if _match_registers(run['config'], registers)]
+        return runs
+
+
+def _match_registers(config, registers):
+    try:
+        tlu_master = (yaml.safe_load(config) or {}).get('tlu_master', {}) if config else {}
+    except yaml.YAMLError:
+        return False
+    return all(tlu_master.get(key) == value for key, value in registers.items())
+
+
+def update_catalogue(data_file, catalogue_file=None):
+    ''' Add a run to the catalogue of its folder (called at the end of a run). Errors are logged, not raised.
+    '''
+    catalogue_file = catalogue_file or get_catalogue_name(os.path.dirname(os.path.abspath(data_file)))
+    try:
+        with RunCatalogue(catalogue_file) as catalogue:
+            catalogue.add_run(data_file)
+    except Exception as e:
+        logging.warning('Cannot add %s to the run catalogue %s: %s', data_file, catalogue_file, e)
+
+
+def _format_time(timestamp):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp)) if timestamp is not None else '-'
+
+
+def print_runs(runs):
+    print('%-32s %-19s %10s %12s %10s %-16s %4s' % ('run', 'start', 'duration/s', 'triggers', 'rate/Hz', 'inputs', 'cw'))
+    for run in runs:
+        trigger_rate = '%0.1f' % run['trigger_rate'] if run['trigger_rate'] is not None else '-'
+        coincidence_window = '-' if run['coincidence_window'] is None else run['coincidence_window']
+        print('%-32s %-19s %10.1f %12d %10s %-16s %4s' % (run['run_name'], _format_time(run['start_time']), run['duration'] or 0.0, run['n_triggers'],
+                                                          trigger_rate, run['input_enable'] or '-', coincidence_window))
+
+
+def _parse_config(values):
+    config = {}
+    for value in values:
+        match = re.match(r'^(\w+)=(.*)$', value)
+        if not match:
+            raise argparse.ArgumentTypeError('Use name=value: %s' % value)
+        config[match.group(1)] = yaml.safe_load(match.group(2))
+    return config
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pytlu catalogue', description='Query (and build) the catalogue of the runs in an output folder')
+    parser.add_argument('folder', type=str, nargs='?', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'output_data'),
+                        help='Output folder with the catalogue. Default: /pytlu/output_data')
+    parser.add_argument('--catalogue', type=str, default=None, help='Catalogue file. Default=<folder>/%s' % CATALOGUE_NAME)
+    parser.add_argument('--scan', action='store_true', help='Rebuild the catalogue by scanning the folder')
+    parser.add_argument('--add', type=str, nargs='+', default=[], help='Add or update runs (data file names)')
+    parser.add_argument('-ie', '--inputs', nargs='+', type=str, choices=input_ch, default=None, help='Enabled inputs (exactly)', metavar='CHx')
+    parser.add_argument('--min_triggers', type=int, default=None)
+    parser.add_argument('--max_triggers', type=int, default=None)
+    parser.add_argument('--min_duration', type=float, default=None, help='Minimum duration in s')
+    parser.add_argument('--max_duration', type=float, default=None, help='Maximum duration in s')
+    parser.add_argument('--min_rate', type=float, default=None, help='Minimum trigger rate in Hz')
+    parser.add_argument('--max_rate', type=float, default=None, help='Maximum trigger rate in Hz')
+    parser.add_argument('--name', type=str, default=None, help='Run name pattern, e.g. 2024*')
+    parser.add_argument('--config', type=str, nargs='+', default=[], help='Configuration, e.g. coincidence_window=10 THRESHOLD=2', metavar='name=value')
+    parser.add_argument('--yaml', action='store_true', help='Print the runs as YAML (all columns)')
+    args = parser.parse_args(argv)
+
+    with RunCatalogue(args.catalogue or get_catalogue_name(args.folder)) as catalogue:
+        if args.scan:
+            start = time.time()
+            n_runs = catalogue.scan(args.folder)
+            logging.info('Scanned %d runs in %0.1f s', n_runs, time.time() - start)
+        for data_file in args.add:
+            catalogue.add_run(data_file)
+        runs = catalogue.query(inputs=args.inputs, min_triggers=args.min_triggers, max_triggers=args.max_triggers, min_duration=args.min_duration,
+                               max_duration=args.max_duration, min_rate=args.min_rate, max_rate=args.max_rate, name=args.name,
+                               config=_parse_config(args.config))
+    if args.yaml:
+        print(yaml.safe_dump(runs, default_flow_style=False))
+    else:
+        print_runs(runs)
+    logging.info('%d runs', len(runs))
+
+
+if __name__ == '__main__':
+    main()
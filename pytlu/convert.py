@@ -0,0 +1,96 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Conversion of a raw capture (see raw_capture) into the HDF5 raw data file.
+
+    The capture is processed in chunks of complete readouts. The HDF5 file is written by one
+    process; the compression uses --jobs threads (blosc) and the delta encoding of the delta
+    layout runs in --jobs processes.
+
+    Usage: pytlu convert capture.raw [-o output.h5] [--layout delta] [--complib blosc:zstd] [--jobs 4]
+'''
+
+import argparse
+import logging
+import multiprocessing
+import os
+
+import tables as tb
+from tqdm import tqdm
+
+from pytlu import delta_codec
+from pytlu.data_writer import create_file_writer, create_filters, add_storage_arguments, check_storage_arguments, writer_classes
+from pytlu.data_reader import get_readout_chunks
+from pytlu.raw_capture import RawCaptureReader, get_capture_name
+
+
+def _encode_chunk(args):
+    ''' Delta encoding of the records [start, stop) of a capture (runs in a worker process).
+    '''
+    filename, start, stop, block_size = args
+    reader = RawCaptureReader(filename)
+    return delta_codec.encode(reader.raw_data[start:stop], block_size=block_size)
+
+
+def convert(filename, output_file=None, layout='table', filter_data=None, chunkshape=None, jobs=1, chunk_size=1000000):
+    ''' Convert a raw capture into an HDF5 raw data file. Returns the name of the HDF5 file.
+    '''
+    reader = RawCaptureReader(filename)
+    if output_file is None:
+        output_file = reader.name + '.h5'
+    logging.info('Converting %s (%d readouts, %d records) to %s', reader.name, reader.meta_data.shape[0], reader.n_words, output_file)
+    tb.set_blosc_max_threads(jobs)
+
+    writer = create_file_writer(output_file, reader.data_dtype, reader.meta_data_dtype, layout=layout, filter_data=filter_data, chunkshape=chunkshape)
+    pool = multiprocessing.Pool(jobs) if layout == 'delta' and jobs > 1 else None
+    try:
+        chunks = get_readout_chunks(reader.meta_data, chunk_size=chunk_size)
+        ranges = [(int(reader.meta_data['index_start'][first]), int(reader.meta_data['index_stop'][last - 1])) for first, last in chunks]
+        if pool is not None:
+            encoded_chunks = pool.imap(_encode_chunk, [(reader.name, start, stop, writer.block_size) for start, stop in ranges])
+        with tqdm(total=reader.n_words, unit='records') as progress:
+            for (first, last), (start, stop) in zip(chunks, ranges):
+                if pool is not None:
+                    writer.write_blocks(next(encoded_chunks))
+                    writer.append_meta_data(reader.meta_data[first:last])
+                else:
+                    writer.append_readouts(reader.raw_data[start:stop], reader.meta_data[first:last])
+                progress.update(stop - start)
+        writer.set_attrs(**reader.attrs)
+        for name in reader.tables:
+            if name in reader.table_dtypes:
+                writer.append_table(name, reader.read_table(name))
+            else:
+                writer.write_table(name, reader.read_table(name))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        writer.close()
+    return output_file
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pytlu convert', description='Convert a raw capture (pytlu --layout raw) into an HDF5 raw data file')
+    parser.add_argument('input_file', type=str, help='Raw capture (any of its .raw, .idx, .yaml files)')
+    parser.add_argument('-o', '--output_file', type=str, default=None, help='HDF5 output file. Default=name of the capture with .h5 extension')
+    add_storage_arguments(parser, layouts=list(writer_classes))
+    parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(), help='Number of compression threads / encoding processes. Default=number of CPUs')
+    parser.add_argument('--chunk_size', type=int, default=1000000, help='Number of records converted at once. Default=1000000')
+    args = parser.parse_args(argv)
+    check_storage_arguments(parser, args)
+
+    if not os.path.exists(get_capture_name(args.input_file) + '.raw'):
+        parser.error('No raw capture %s' % args.input_file)
+    convert(args.input_file, output_file=args.output_file, layout=args.layout,
+            filter_data=create_filters(complib=args.complib, complevel=args.complevel, shuffle=args.shuffle),
+            chunkshape=args.chunkshape, jobs=args.jobs, chunk_size=args.chunk_size)
+
+
+if __name__ == '__main__':
+    main()
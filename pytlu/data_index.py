@@ -0,0 +1,162 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Indexes on trigger_id and time_stamp for fast lookups in large raw data files.
+
+    block index (all layouts): table raw_data_index with the minimum and maximum of both fields
+        for every block of records, only blocks that can contain matching records are read
+        (time_stamp increases monotonically, trigger_id between wrap arounds)
+    table layout: in addition a completely sorted PyTables index (CSI) on trigger_id, PyTables
+        cannot index uint64 columns (time_stamp)
+
+    Indexes are optional, the queries scan the file chunk by chunk if there is none.
+    Indexes are created after the run (pytlu index <file>, pytlu --index) or for every closed
+    segment of a rotated run.
+
+    Note: trigger_id wraps around if n_bits_trig_id < 32, a trigger range query returns
+    the records of all wraps.
+'''
+
+import argparse
+import logging
+import os
+import time
+
+import numpy as np
+import tables as tb
+
+from pytlu.data_reader import RawDataReader, get_layout
+from pytlu.file_rotation import get_segment_files
+
+index_columns = ('trigger_id', 'time_stamp')
+
+block_index_dtype = np.dtype([('index_start', 'u8'), ('n_records', 'u4'),
+                              ('trigger_id_min', 'u4'), ('trigger_id_max', 'u4'),
+                              ('time_stamp_min', 'u8'), ('time_stamp_max', 'u8')])
+
+
+def create_indexes(h5_file, block_size=65536, chunk_size=1000000):
+    ''' Create (or update) the indexes of an opened (mode='a') raw data file.
+    '''
+    if get_layout(h5_file) == 'table':
+        column = h5_file.root.raw_data.cols.trigger_id
+        if column.is_indexed:
+            column.reindex_dirty()
+        else:
+            column.create_csindex()
+    reader = RawDataReader(h5_file)
+    chunk_size = max(block_size, chunk_size - chunk_size % block_size)  # chunks of complete blocks
+    blocks = []
+    for start in range(0, reader.n_words, chunk_size):
+        columns = dict((name, reader.read_column(name, start, start + chunk_size)) for name in index_columns)
+        block_starts = np.arange(0, columns['trigger_id'].shape[0], block_size)
+        chunk_blocks = np.zeros(block_starts.shape[0], dtype=block_index_dtype)
+        chunk_blocks['index_start'] = start + block_starts
+        chunk_blocks['n_records'] = np.diff(np.append(block_starts, columns['trigger_id'].shape[0]))
+        for name in index_columns:
+            chunk_blocks[name + '_min'] = np.minimum.reduceat(columns[name], block_starts)
+            chunk_blocks[name + '_max'] = np.maximum.reduceat(columns[name], block_starts)
+        blocks.append(chunk_blocks)
+    blocks = np.concatenate(blocks) if blocks else np.zeros(0, dtype=block_index_dtype)
+    if 'raw_data_index' in h5_file.root:
+        h5_file.remove_node(h5_file.root, 'raw_data_index')
+    index_table = h5_file.create_table(h5_file.root, name='raw_data_index', obj=blocks, title='Block index of trigger_id and time_stamp',
+                                       filters=h5_file.root.meta_data.filters)
+    index_table.attrs.block_size = block_size
+
+
+def index_file(filename, **kwargs):
+    ''' Create the indexes of a raw data file (HDF5, raw captures are skipped).
+    '''
+    if not os.path.exists(filename) or not tb.is_hdf5_file(filename):
+        logging.info('%s is no HDF5 file, not indexed', filename)
+        return
+    with tb.open_file(filename, mode='a') as h5_file:
+        create_indexes(h5_file, **kwargs)
+
+
+def is_indexed(h5_file):
+    return 'raw_data_index' in h5_file.root
+
+
+def find_records(h5_file, name, start, stop, chunk_size=1000000):
+    ''' Returns the indices (sorted) of the raw data records with start <= name < stop (name is trigger_id or time_stamp).
+    '''
+    if name not in index_columns:
+        raise ValueError('No index on %s, use one of %s' % (name, ', '.join(index_columns)))
+    reader = RawDataReader(h5_file)
+    # Inclusive range [first, last] in the type of the field, limits outside of the range of the type are clipped
+    dtype_info = np.iinfo(reader.dtype[name])
+    first, last = max(int(start), dtype_info.min), min(int(stop) - 1, dtype_info.max)
+    if first > last:
+        return np.zeros(0, dtype=np.int64)
+    first, last = np.array([first, last], dtype=reader.dtype[name])
+    if name == 'trigger_id' and reader.layout == 'table' and h5_file.root.raw_data.cols.trigger_id.is_indexed:  # query uses the CSI
+        return h5_file.root.raw_data.get_where_list('(trigger_id >= first) & (trigger_id <= last)', condvars={'first': first, 'last': last}, sort=True)
+    if 'raw_data_index' in h5_file.root:
+        blocks = h5_file.root.raw_data_index[:]  # small, one entry per block
+        blocks = blocks[(blocks[name + '_max'] >= first) & (blocks[name + '_min'] <= last)]
+        ranges = _merge_ranges(blocks['index_start'].astype(np.int64), (blocks['index_start'] + blocks['n_records']).astype(np.int64))
+    else:
+        ranges = [(0, reader.n_words)]
+    indices = []
+    for range_start, range_stop in ranges:
+        for chunk_start in range(range_start, range_stop, chunk_size):
+            values = reader.read_column(name, chunk_start, min(chunk_start + chunk_size, range_stop))
+            indices.append(chunk_start + np.nonzero((values >= first) & (values <= last))[0])
+    return np.concatenate(indices) if indices else np.zeros(0, dtype=np.int64)
+
+
+def _merge_ranges(starts, stops):
+    ''' Merge adjacent index ranges (blocks). '''
+    if starts.shape[0] == 0:
+        return []
+    new_range = np.nonzero(starts[1:] != stops[:-1])[0] + 1
+    return list(zip(starts[np.r_[0, new_range]], stops[np.r_[new_range - 1, -1]]))
+
+
+def read_records(h5_file, name, start, stop):
+    ''' Returns the raw data records with start <= name < stop.
+    '''
+    indices = find_records(h5_file, name, start, stop)
+    reader = RawDataReader(h5_file)
+    if indices.shape[0] == 0:
+        return np.zeros(0, dtype=reader.dtype)
+    if reader.layout == 'table':
+        return h5_file.root.raw_data.read_coordinates(indices)
+    ranges = _merge_ranges(indices, indices + 1)
+    return np.concatenate([reader.read(int(range_start), int(range_stop)) for range_start, range_stop in ranges])
+
+
+def read_trigger_range(h5_file, trigger_id_start, trigger_id_stop):
+    ''' Returns the raw data records with trigger_id_start <= trigger_id < trigger_id_stop.
+    '''
+    return read_records(h5_file, 'trigger_id', trigger_id_start, trigger_id_stop)
+
+
+def read_time_range(h5_file, time_stamp_start, time_stamp_stop):
+    ''' Returns the raw data records with time_stamp_start <= time_stamp < time_stamp_stop (TLU clock cycles).
+    '''
+    return read_records(h5_file, 'time_stamp', time_stamp_start, time_stamp_stop)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pytlu index', description='Create indexes on trigger_id and time_stamp of raw data files')
+    parser.add_argument('input_files', type=str, nargs='+', help='Raw data files (all segments of rotated runs)')
+    parser.add_argument('--block_size', type=int, default=65536, help='Records per block of the block index (delta and column layouts). Default=65536')
+    args = parser.parse_args(argv)
+
+    for input_file in args.input_files:
+        for filename in get_segment_files(input_file):
+            start = time.time()
+            index_file(filename, block_size=args.block_size)
+            logging.info('Indexed %s in %0.1f s', filename, time.time() - start)
+
+
+if __name__ == '__main__':
+    main()
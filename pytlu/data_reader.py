@@ -0,0 +1,272 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Reading of pytlu raw data files independent of the raw data layout (see data_writer).
+    The raw data is always returned as structured array with the data_dtype of the TLU.
+
+    RawDataReader: random access to raw data records
+    ChunkedReader: iteration over a file in chunks of complete readouts with bounded memory
+'''
+
+import threading
+try:
+    from queue import Queue, Full  # Python3
+except ImportError:
+    from Queue import Queue, Full  # Python2
+
+import numpy as np
+import tables as tb
+
+from pytlu import delta_codec
+from pytlu.data_writer import dtype_from_yaml
+
+
+def get_layout(h5_file):
+    ''' Returns the raw data layout of an opened raw data file (tables.File).
+    '''
+    attrs = h5_file.root.meta_data.attrs
+    return attrs.layout if 'layout' in attrs._v_attrnames else 'table'
+
+
+def get_data_dtype(h5_file):
+    attrs = h5_file.root.meta_data.attrs
+    if 'data_dtype' in attrs._v_attrnames:
+        return dtype_from_yaml(attrs.data_dtype)
+    return h5_file.root.raw_data.dtype
+
+
+def get_n_words(h5_file):
+    ''' Returns the number of raw data records.
+    '''
+    layout = get_layout(h5_file)
+    if layout == 'table':
+        return h5_file.root.raw_data.nrows
+    meta_data_table = h5_file.root.meta_data
+    return int(meta_data_table[-1]['index_stop']) if meta_data_table.nrows else 0
+
+
+class RawDataReader(object):
+    ''' Random access to the raw data records of an opened raw data file.
+
+        Keeps the block index of encoded layouts in memory for repeated reads (e.g. readout by readout).
+        n_words overrides the number of records given by meta_data (e.g. for damaged files).
+    '''
+
+    def __init__(self, h5_file, n_words=None):
+        self.h5_file = h5_file
+        self.layout = get_layout(h5_file)
+        self.dtype = get_data_dtype(h5_file)
+        self.n_words = get_n_words(h5_file) if n_words is None else n_words
+        if self.layout == 'delta':
+            self._blocks = h5_file.root.raw_data_blocks[:]
+        elif self.layout not in ('table', 'column'):
+            raise ValueError('Unknown raw data layout %s' % self.layout)
+
+    def __len__(self):
+        return self.n_words
+
+    def read(self, start=0, stop=None):
+        ''' Returns the raw data records [start, stop).
+        '''
+        stop = self.n_words if stop is None else min(stop, self.n_words)
+        if stop <= start:
+            return np.zeros(0, dtype=self.dtype)
+        if self.layout == 'table':
+            return self.h5_file.root.raw_data.read(start, stop)
+        if self.layout == 'column':
+            raw_data = np.empty(stop - start, dtype=self.dtype)
+            for name in self.dtype.names:
+                raw_data[name] = self.h5_file.root.raw_data_columns._f_get_child(name).read(start, stop)
+            return raw_data
+        return self._read_delta(start, stop)
+
+    def read_column(self, name, start=0, stop=None):
+        ''' Returns one field (e.g. time_stamp) of the raw data records [start, stop).
+
+            Only the column layout reads the field alone, the other layouts decompress all fields.
+        '''
+        stop = self.n_words if stop is None else min(stop, self.n_words)
+        if stop <= start:
+            return np.zeros(0, dtype=self.dtype[name])
+        if self.layout == 'table':
+            return self.h5_file.root.raw_data.read(start, stop, field=name)
+        if self.layout == 'column':
+            return self.h5_file.root.raw_data_columns._f_get_child(name).read(start, stop)
+        return self._read_delta(start, stop)[name]
+
+    def _read_delta(self, start, stop):
+        first = np.searchsorted(self._blocks['index_start'], start, side='right') - 1
+        last = np.searchsorted(self._blocks['index_start'], stop, side='left')
+        blocks = self._blocks[first:last]
+        byte_offset = int(blocks['offset'][0])
+        data = self.h5_file.root.raw_data_delta.read(byte_offset, int(blocks['offset'][-1] + blocks['size'][-1]))
+        raw_data = np.concatenate([delta_codec.decode_block(data[block['offset'] - byte_offset:block['offset'] - byte_offset + block['size']], self.dtype)
+                                   for block in blocks])
+        offset = start - int(blocks['index_start'][0])
+        return raw_data[offset:offset + stop - start]
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.step not in (None, 1):
+            raise IndexError('Only slices with step 1 are supported')
+        start, stop, _ = index.indices(self.n_words)
+        return self.read(start, stop)
+
+
+def read_raw_data(h5_file, start=0, stop=None):
+    ''' Returns the raw data records [start, stop) of an opened raw data file.
+    '''
+    return RawDataReader(h5_file).read(start, stop)
+
+
+def read_column(h5_file, name, start=0, stop=None):
+    ''' Returns one field of the raw data records [start, stop) of an opened raw data file.
+    '''
+    return RawDataReader(h5_file).read_column(name, start, stop)
+
+
+def get_readout_chunks(meta_data, chunk_size=1000000):
+    ''' Split the readouts into chunks of about chunk_size records without splitting a readout.
+
+        Returns list of (first readout, last readout + 1). A readout with more than chunk_size records is a chunk on its own.
+    '''
+    n_readouts = meta_data.shape[0]
+    chunks = []
+    readout_start = 0
+    while readout_start < n_readouts:
+        index_limit = int(meta_data['index_start'][readout_start]) + chunk_size
+        readout_stop = int(np.searchsorted(meta_data['index_stop'], index_limit, side='right'))
+        readout_stop = max(readout_stop, readout_start + 1)
+        chunks.append((readout_start, readout_stop))
+        readout_start = readout_stop
+    return chunks
+
+
+class ChunkedReader(object):
+    ''' Out-of-core reading of a raw data file (file name or opened tables.File) in chunks of complete readouts.
+
+        meta_data is read in blocks of meta_block_size readouts, only the chunk in use and up to read_ahead
+        chunks read by a background thread are in memory (read_ahead=0: no thread).
+        Random access by readout index with read_readout() and read_readouts().
+
+        Example:
+            with ChunkedReader('run.h5') as reader:
+                for meta_data, raw_data in reader:  # raw_data[0] is the record meta_data['index_start'][0]
+                    ...
+    '''
+
+    def __init__(self, filename, chunk_size=1000000, read_ahead=2, meta_block_size=100000):
+        if isinstance(filename, tb.File):
+            self.h5_file, self._own_file = filename, False
+        else:
+            self.h5_file, self._own_file = tb.open_file(filename, mode='r'), True
+        self.chunk_size = chunk_size
+        self.read_ahead = read_ahead
+        self.meta_block_size = meta_block_size
+        self.meta_data_table = self.h5_file.root.meta_data
+        self.raw_data = RawDataReader(self.h5_file)
+        self.dtype = self.raw_data.dtype
+        self._lock = threading.Lock()  # HDF5 access is not thread safe
+
+    def __len__(self):
+        return self.meta_data_table.nrows
+
+    def read_readouts(self, start, stop):
+        ''' Returns (meta_data, raw_data) of the readouts [start, stop).
+        '''
+        with self._lock:
+            meta_data = self.meta_data_table.read(start, stop)
+            if meta_data.shape[0] == 0:
+                return meta_data, np.zeros(0, dtype=self.dtype)
+            return meta_data, self.raw_data.read(int(meta_data['index_start'][0]), int(meta_data['index_stop'][-1]))
+
+    def read_readout(self, index):
+        ''' Returns the data tuple (raw_data, timestamp_start, timestamp_stop, error, skipped_triggers) of a readout.
+        '''
+        if index < 0:
+            index += len(self)
+        meta_data, raw_data = self.read_readouts(index, index + 1)
+        if meta_data.shape[0] == 0:
+            raise IndexError('Readout %d does not exist' % index)
+        meta = meta_data[0]
+        return raw_data, meta['timestamp_start'], meta['timestamp_stop'], meta['error'], meta['skipped_triggers']
+
+    def _read_chunks(self, readout_start, readout_stop):
+        for block_start in range(readout_start, readout_stop, self.meta_block_size):
+            with self._lock:
+                meta_data = self.meta_data_table.read(block_start, min(block_start + self.meta_block_size, readout_stop))
+            for first, last in get_readout_chunks(meta_data, chunk_size=self.chunk_size):
+                with self._lock:
+                    raw_data = self.raw_data.read(int(meta_data['index_start'][first]), int(meta_data['index_stop'][last - 1]))
+                yield meta_data[first:last], raw_data
+
+    def chunks(self, readout_start=0, readout_stop=None):
+        ''' Generator of (meta_data, raw_data) of the chunks of the readouts [readout_start, readout_stop).
+        '''
+        readout_stop = len(self) if readout_stop is None else min(readout_stop, len(self))
+        if self.read_ahead <= 0:
+            for chunk in self._read_chunks(readout_start, readout_stop):
+                yield chunk
+            return
+
+        chunks = Queue(maxsize=self.read_ahead)
+        stop = threading.Event()
+
+        def put(item):  # returns False if the consumer stopped
+            while not stop.is_set():
+                try:
+                    chunks.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        def read_ahead():
+            try:
+                for chunk in self._read_chunks(readout_start, readout_stop):
+                    if not put(chunk):
+                        return
+                put(None)
+            except Exception as e:  # raised in the consumer
+                put(e)
+
+        thread = threading.Thread(target=read_ahead, name='ChunkedReader')
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+        finally:
+            stop.set()
+            thread.join()
+
+    def __iter__(self):
+        return self.chunks()
+
+    def readouts(self, readout_start=0, readout_stop=None):
+        ''' Generator of the data tuples (raw_data, timestamp_start, timestamp_stop, error, skipped_triggers) of the readouts.
+        '''
+        for meta_data, raw_data in self.chunks(readout_start, readout_stop):
+            index_start = int(meta_data['index_start'][0])
+            for meta in meta_data:
+                yield (raw_data[meta['index_start'] - index_start:meta['index_stop'] - index_start], meta['timestamp_start'],
+                       meta['timestamp_stop'], meta['error'], meta['skipped_triggers'])
+
+    def close(self):
+        if self._own_file:
+            self.h5_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,98 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Consumer APIs for the readout data: blocking iterator and asyncio iterator (async_data_stream, Python 3 only).
+    Both use a bounded buffer; if the consumer is too slow, readouts are dropped
+    (and counted) instead of blocking the readout.
+'''
+
+import logging
+try:
+    from queue import Queue, Empty, Full  # Python3
+except ImportError:
+    from Queue import Queue, Empty, Full  # Python2
+
+
+class DataStream(object):
+    ''' Blocking iterator over the readout data tuples
+        (raw_data, timestamp_start, timestamp_stop, error, skipped_triggers).
+
+        The iteration ends when the readout is stopped, when close() is called
+        or when no data arrives within timeout seconds (if timeout is not None).
+    '''
+
+    def __init__(self, maxsize=1000, timeout=None, on_close=None):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.dropped = 0
+        self._on_close = on_close
+        self._closed = False
+        self._queue = Queue(maxsize=maxsize)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def put(self, data_tuple):
+        ''' Add readout data. Called from the readout worker thread, never blocks.
+        '''
+        if self._closed:
+            return
+        try:
+            self._queue.put_nowait(data_tuple)
+        except Full:
+            if not self.dropped:
+                logging.warning('Data stream buffer full (%d readouts), dropping data', self.maxsize)
+            self.dropped += 1
+
+    def stop(self):
+        ''' Signal end of data (called when readout stops). Buffered data is still delivered.
+        '''
+        while True:
+            try:
+                self._queue.put_nowait(None)
+            except Full:  # make room for end marker
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except Empty:
+                    pass
+            else:
+                break
+
+    def close(self):
+        ''' Stop consuming: detach from the readout and end the iteration (buffered data is not delivered).
+        '''
+        if self._closed:
+            return
+        self._closed = True
+        if self._on_close is not None:
+            self._on_close(self)
+        self.stop()
+
+    def get(self, timeout=None):
+        ''' Returns the next readout data tuple or None at end of data.
+        '''
+        try:
+            return self._queue.get(timeout=timeout)
+        except Empty:
+            return None
+
+    def __iter__(self):
+        while not self._closed:
+            data_tuple = self.get(timeout=self.timeout)
+            if data_tuple is None or self._closed:
+                break
+            yield data_tuple
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
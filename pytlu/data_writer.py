@@ -0,0 +1,274 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Writer of the pytlu HDF5 raw data file (raw_data and meta_data tables).
+
+    Layouts of the raw data:
+        table: raw_data table with one row per record (default)
+        delta: delta encoded and bit-packed blocks of records (raw_data_delta), see delta_codec
+        column: one array per field in the group raw_data_columns (fast reading of single fields)
+    Files of all layouts can be read with pytlu.data_reader.
+'''
+
+import time
+
+import numpy as np
+import tables as tb
+import yaml
+
+from pytlu import delta_codec
+
+# Meta data of the readouts (one row per readout), written by the TLU and by the tools rebuilding meta data
+meta_data_dtype = np.dtype([('index_start', 'u4'), ('index_stop', 'u4'), ('data_length', 'u4'),
+                            ('timestamp_start', 'f8'), ('timestamp_stop', 'f8'), ('error', 'u4'), ('skipped_triggers', 'u8')])
+
+
+def create_filters(complib='blosc', complevel=5, shuffle='byte'):
+    ''' Returns PyTables filters. Shuffle can be 'none', 'byte' or 'bit' (only with the blosc compression libraries).
+    '''
+    if shuffle == 'bit' and complevel and not complib.startswith('blosc'):
+        raise ValueError('Bit shuffle needs a blosc compression library (e.g. blosc:lz4), not %s' % complib)
+    return tb.Filters(complib=complib, complevel=complevel, shuffle=(shuffle == 'byte'), bitshuffle=(shuffle == 'bit'))
+
+
+def add_storage_arguments(parser, layouts):
+    ''' Add the command line arguments of the raw data storage settings to an argparse parser.
+    '''
+    parser.add_argument('--complib', type=str, default='blosc', choices=tb.filters.all_complibs,
+                        help="Compression library of raw data. Default=blosc. Allowed values are " + ', '.join(tb.filters.all_complibs), metavar='LIB')
+    parser.add_argument('--complevel', type=int, default=5, choices=range(10),
+                        help="Compression level of raw data (0=no compression). Default=5", metavar='0...9')
+    parser.add_argument('--shuffle', type=str, default='byte', choices=['none', 'byte', 'bit'],
+                        help="Shuffle filter of raw data. Default=byte")
+    parser.add_argument('--chunkshape', type=int, default=None,
+                        help="Size of the HDF5 chunks of raw data: rows for the table layout, records per field for the column layout (default 65536), "
+                             "bytes for the delta layout. Default=chosen by PyTables", metavar='1...n')
+    parser.add_argument('--layout', type=str, default='table', choices=layouts,
+                        help="Layout of raw data: " + ', '.join('%s (%s)' % (layout, layout_descriptions[layout]) for layout in layouts) + ". Default=table")
+
+
+def check_storage_arguments(parser, args):
+    ''' Exit with a usage error if the storage settings of the command line (see add_storage_arguments()) do not fit together.
+    '''
+    try:
+        create_filters(complib=args.complib, complevel=args.complevel, shuffle=args.shuffle)
+    except ValueError as e:
+        parser.error(str(e))
+
+
+def dtype_to_yaml(dtype):
+    return yaml.safe_dump([[name, dtype[name].str] for name in dtype.names], default_flow_style=True)
+
+
+def dtype_from_yaml(string):
+    return np.dtype([tuple(field) for field in yaml.safe_load(string)])
+
+
+class RawDataWriter(object):
+    ''' Appends readouts (raw data + meta data) to the raw_data and meta_data tables.
+
+        Every checkpoint_interval seconds (if not None) the HDF5 file is flushed and the number of
+        readouts and records at this consistent state is stored in the checkpoint attribute.
+    '''
+    layout = 'table'
+
+    def __init__(self, h5_file, data_table, meta_data_table, filter_tables=None, own_file=False, checkpoint_interval=None):
+        self.h5_file = h5_file
+        self.data_table = data_table
+        self.meta_data_table = meta_data_table
+        self.filter_tables = filter_tables if filter_tables is not None else meta_data_table.filters
+        self._own_file = own_file
+        self.n_words = int(meta_data_table[-1]['index_stop']) if meta_data_table.nrows else 0
+        self.checkpoint_interval = checkpoint_interval
+        self._last_checkpoint = time.time()
+
+    @classmethod
+    def create(cls, filename, data_dtype, meta_data_dtype, filter_data=None, filter_tables=None, chunkshape=None, checkpoint_interval=None, **layout_kwargs):
+        ''' Create a new raw data file.
+        '''
+        if filter_data is None:
+            filter_data = tb.Filters(complib='blosc', complevel=5)
+        if filter_tables is None:
+            filter_tables = tb.Filters(complib='zlib', complevel=5)
+        h5_file = tb.open_file(filename, mode='w', title='TLU')
+        data_table = cls.create_data_node(h5_file, data_dtype, filter_data, chunkshape, **layout_kwargs)
+        meta_data_table = h5_file.create_table(h5_file.root, name='meta_data', description=meta_data_dtype, title='meta_data', filters=filter_tables)
+        meta_data_table.attrs.layout = cls.layout
+        meta_data_table.attrs.data_dtype = dtype_to_yaml(data_dtype)
+        h5_file.flush()
+        return cls(h5_file, data_table, meta_data_table, filter_tables=filter_tables, own_file=True, checkpoint_interval=checkpoint_interval)
+
+    @classmethod
+    def create_data_node(cls, h5_file, data_dtype, filter_data, chunkshape):
+        return h5_file.create_table(h5_file.root, name='raw_data', description=data_dtype, title='data', filters=filter_data, chunkshape=chunkshape)
+
+    def write_raw_data(self, raw_data):
+        self.data_table.append(raw_data)
+        self.data_table.flush()
+
+    def append(self, data_tuple):
+        ''' Append one readout (raw_data, timestamp_start, timestamp_stop, error, skipped_triggers).
+        '''
+        self.append_readout(data_tuple[0], data_tuple[1], data_tuple[2], data_tuple[3], data_tuple[4])
+
+    def append_readouts(self, raw_data, meta_data):
+        ''' Append the raw data of several readouts at once. The index ranges of the meta data are rebased.
+        '''
+        self.write_raw_data(raw_data)
+        self.append_meta_data(meta_data)
+
+    def append_meta_data(self, meta_data):
+        ''' Append meta data of readouts whose raw data was written, rebases the index ranges.
+        '''
+        if meta_data.shape[0] == 0:
+            return
+        meta_data = meta_data.copy()
+        meta_data['index_stop'] = self.n_words + np.cumsum(meta_data['data_length'], dtype=np.uint64)
+        meta_data['index_start'] = meta_data['index_stop'] - meta_data['data_length']
+        self.n_words = int(meta_data['index_stop'][-1])
+        self.meta_data_table.append(meta_data)
+        self.meta_data_table.flush()
+
+    def append_readout(self, raw_data, timestamp_start, timestamp_stop, error, skipped_triggers):
+        self.write_raw_data(raw_data)
+
+        len_raw_data = raw_data.shape[0]
+        self.meta_data_table.row['timestamp_start'] = timestamp_start
+        self.meta_data_table.row['timestamp_stop'] = timestamp_stop
+        self.meta_data_table.row['error'] = error
+        self.meta_data_table.row['skipped_triggers'] = skipped_triggers
+        self.meta_data_table.row['data_length'] = len_raw_data
+        self.meta_data_table.row['index_start'] = self.n_words
+        self.n_words += len_raw_data
+        self.meta_data_table.row['index_stop'] = self.n_words
+        self.meta_data_table.row.append()
+        self.meta_data_table.flush()
+        if self.checkpoint_interval is not None and time.time() - self._last_checkpoint >= self.checkpoint_interval:
+            self.checkpoint()
+
+    def checkpoint(self):
+        ''' Write all buffers and the HDF5 meta data to disk. The file can be opened with this content after a crash.
+        '''
+        self.meta_data_table.attrs.checkpoint = yaml.safe_dump({'n_readouts': int(self.meta_data_table.nrows), 'n_words': int(self.n_words), 'time': time.time()})
+        self.h5_file.flush()
+        self._last_checkpoint = time.time()
+
+    def set_attrs(self, **attrs):
+        ''' Set attributes of the meta_data table (e.g. configuration as YAML string).
+        '''
+        for name, value in attrs.items():
+            self.meta_data_table.attrs[name] = value
+
+    def write_table(self, name, data, title=None):
+        ''' Create or replace the content of an additional table (e.g. clock_samples).
+        '''
+        try:
+            table = self.h5_file.get_node(self.h5_file.root, name)
+        except tb.NoSuchNodeError:
+            table = self.h5_file.create_table(self.h5_file.root, name=name, description=data.dtype, title=title or name, filters=self.filter_tables)
+        else:
+            table.truncate(0)
+        table.append(data)
+        table.flush()
+
+    def append_table(self, name, data, title=None):
+        ''' Append rows to an additional table written during the run (e.g. status), the table is created by the first call.
+            In rotated runs each segment has the rows written while it was open (attribute appended, see merge).
+        '''
+        try:
+            table = self.h5_file.get_node(self.h5_file.root, name)
+        except tb.NoSuchNodeError:
+            table = self.h5_file.create_table(self.h5_file.root, name=name, description=data.dtype, title=title or name, filters=self.filter_tables)
+            table.attrs.appended = True
+        table.append(data)
+        table.flush()
+
+    def close(self):
+        if self._own_file:
+            self.h5_file.close()
+
+
+class DeltaDataWriter(RawDataWriter):
+    ''' Stores the raw data as delta encoded blocks (one or more per readout) in the byte array raw_data_delta.
+
+        The table raw_data_blocks holds the first record index, the number of records and the
+        byte range of each block. The chunkshape setting is in bytes for this layout.
+    '''
+    layout = 'delta'
+    block_dtype = np.dtype([('index_start', 'u8'), ('n_records', 'u4'), ('offset', 'u8'), ('size', 'u4')])
+
+    def __init__(self, h5_file, data_table, meta_data_table, filter_tables=None, own_file=False, checkpoint_interval=None):
+        super(DeltaDataWriter, self).__init__(h5_file, data_table, meta_data_table, filter_tables=filter_tables, own_file=own_file,
+                                              checkpoint_interval=checkpoint_interval)
+        self.block_table = h5_file.root.raw_data_blocks
+        self.block_size = data_table.attrs.block_size
+        self.n_bytes = data_table.nrows
+        last_block = self.block_table[-1] if self.block_table.nrows else None
+        self.n_records = int(last_block['index_start'] + last_block['n_records']) if last_block is not None else 0  # records in blocks
+
+    @classmethod
+    def create_data_node(cls, h5_file, data_dtype, filter_data, chunkshape, block_size=65536):
+        data_array = h5_file.create_earray(h5_file.root, name='raw_data_delta', atom=tb.UInt8Atom(), shape=(0,), title='delta encoded data',
+                                           filters=filter_data, chunkshape=(chunkshape,) if chunkshape else None)
+        data_array.attrs.block_size = block_size
+        h5_file.create_table(h5_file.root, name='raw_data_blocks', description=cls.block_dtype, title='blocks of raw_data_delta', filters=filter_data)
+        return data_array
+
+    def write_raw_data(self, raw_data):
+        self.write_blocks(delta_codec.encode(raw_data, block_size=self.block_size))
+
+    def write_blocks(self, blocks):
+        ''' Write blocks encoded with delta_codec (e.g. encoded in parallel).
+        '''
+        for encoded in blocks:
+            n_records = int(delta_codec.get_n_records(encoded))
+            self.data_table.append(encoded)
+            self.block_table.append([(self.n_records, n_records, self.n_bytes, encoded.shape[0])])
+            self.n_records += n_records
+            self.n_bytes += encoded.shape[0]
+        self.data_table.flush()
+        self.block_table.flush()
+
+
+class ColumnDataWriter(RawDataWriter):
+    ''' Stores each field of the raw data in its own array (group raw_data_columns).
+
+        All arrays have the same length and share the index ranges of meta_data.
+    '''
+    layout = 'column'
+    default_chunkshape = 65536  # large chunks for reading at full disk bandwidth
+
+    @classmethod
+    def create_data_node(cls, h5_file, data_dtype, filter_data, chunkshape):
+        group = h5_file.create_group(h5_file.root, name='raw_data_columns', title='data')
+        for name in data_dtype.names:
+            h5_file.create_earray(group, name=name, atom=tb.Atom.from_dtype(data_dtype[name]), shape=(0,), title=name,
+                                  filters=filter_data, chunkshape=(chunkshape or cls.default_chunkshape,))
+        return group
+
+    def write_raw_data(self, raw_data):
+        for column in self.data_table:
+            column.append(raw_data[column.name])
+        for column in self.data_table:
+            column.flush()
+
+
+layout_descriptions = {'table': 'one row per record',
+                       'delta': 'delta encoded, bit-packed blocks',
+                       'column': 'one array per field',
+                       'raw': 'uncompressed binary capture, convert with pytlu convert'}
+
+writer_classes = {'table': RawDataWriter,
+                  'delta': DeltaDataWriter,
+                  'column': ColumnDataWriter}
+
+
+def create_file_writer(filename, data_dtype, meta_data_dtype, layout='table', **writer_kwargs):
+    ''' Create a new raw data file with the given layout. Returns the writer.
+    '''
+    return writer_classes[layout].create(filename, data_dtype, meta_data_dtype, **writer_kwargs)
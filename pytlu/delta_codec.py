@@ -0,0 +1,138 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Lossless codec for blocks of raw data records (le0..le3, time_stamp, trigger_id).
+
+    Time stamps and trigger IDs are stored as differences to the previous record.
+    The differences are stored relative to their minimum within the block (frame of reference)
+    and bit-packed with the smallest bit width that holds all of them. For continuous
+    trigger IDs the width is 0 bits, for time stamps it is given by the jitter of the
+    trigger intervals. Wrap arounds of truncated trigger IDs are handled (wider block).
+
+    Block layout (little endian):
+        header (block_header_dtype)
+        le0..le3 (4 bytes per record)
+        packed time stamp differences ((n_records - 1) * ts_bits bits, padded to full bytes)
+        packed trigger ID differences ((n_records - 1) * trigger_id_bits bits, padded to full bytes)
+'''
+
+import numpy as np
+
+block_header_dtype = np.dtype([('n_records', '<u4'), ('time_stamp', '<u8'), ('trigger_id', '<u4'),
+                               ('ts_delta_min', '<u8'), ('trigger_id_delta_min', '<u4'),
+                               ('ts_bits', 'u1'), ('trigger_id_bits', 'u1')])
+
+TDC_FIELDS = ('le0', 'le1', 'le2', 'le3')
+
+
+def pack_bits(values, n_bits):
+    ''' Pack unsigned integers with n_bits each into a uint8 array (LSB first).
+    '''
+    if n_bits == 0 or values.shape[0] == 0:
+        return np.zeros(0, dtype=np.uint8)
+    values = values.astype(np.uint64)
+    bits = ((values[:, np.newaxis] >> np.arange(n_bits, dtype=np.uint64)) & np.uint64(1)).astype(np.uint8)
+    return np.packbits(bits.ravel(), bitorder='little')
+
+
+def unpack_bits(packed, n_bits, n_values):
+    ''' Inverse of pack_bits. Returns uint64 array.
+    '''
+    if n_bits == 0 or n_values == 0:
+        return np.zeros(n_values, dtype=np.uint64)
+    bits = np.unpackbits(packed, count=n_values * n_bits, bitorder='little').reshape(n_values, n_bits)
+    values = np.zeros(n_values, dtype=np.uint64)
+    for bit in range(n_bits):  # loop over bits, not values
+        values |= bits[:, bit].astype(np.uint64) << np.uint64(bit)
+    return values
+
+
+def _n_bytes(n_values, n_bits):
+    return (n_values * n_bits + 7) // 8
+
+
+def _bit_width(value):
+    return int(value).bit_length()
+
+
+def _delta_frame(values, dtype):
+    ''' Returns the differences (modulo 2^n) relative to their minimum, the minimum and the bit width.
+    '''
+    deltas = np.diff(values).view(dtype.str.replace('u', 'i'))  # negative for wrap arounds
+    if deltas.shape[0] == 0:
+        return np.zeros(0, dtype=dtype), 0, 0
+    delta_min = deltas[deltas.argmin():][:1]
+    offsets = (deltas - delta_min).view(dtype)  # range is always < 2^n, difference modulo 2^n is exact
+    return offsets, delta_min.view(dtype)[0], _bit_width(offsets.max())
+
+
+def encode_block(raw_data):
+    ''' Encode raw data records (structured array with le0..le3, time_stamp, trigger_id). Returns uint8 array.
+    '''
+    n_records = raw_data.shape[0]
+    header = np.zeros(1, dtype=block_header_dtype)
+    header['n_records'] = n_records
+    if n_records == 0:
+        return header.view(np.uint8)
+    time_stamp = np.ascontiguousarray(raw_data['time_stamp'], dtype=np.uint64)
+    trigger_id = np.ascontiguousarray(raw_data['trigger_id'], dtype=np.uint32)
+    ts_offsets, ts_delta_min, ts_bits = _delta_frame(time_stamp, np.dtype(np.uint64))
+    trigger_id_offsets, trigger_id_delta_min, trigger_id_bits = _delta_frame(trigger_id, np.dtype(np.uint32))
+    header['time_stamp'] = time_stamp[0]
+    header['trigger_id'] = trigger_id[0]
+    header['ts_delta_min'] = ts_delta_min
+    header['trigger_id_delta_min'] = trigger_id_delta_min
+    header['ts_bits'] = ts_bits
+    header['trigger_id_bits'] = trigger_id_bits
+    tdc = np.column_stack([raw_data[field].astype(np.uint8) for field in TDC_FIELDS]).ravel()
+    return np.concatenate((header.view(np.uint8), tdc, pack_bits(ts_offsets, ts_bits), pack_bits(trigger_id_offsets, trigger_id_bits)))
+
+
+def get_n_records(block):
+    ''' Returns the number of records of an encoded block.
+    '''
+    return block[:block_header_dtype.itemsize].view(block_header_dtype)['n_records'][0]
+
+
+def decode_block(block, dtype):
+    ''' Decode a block created by encode_block into a structured array with the given dtype.
+    '''
+    block = np.asarray(block, dtype=np.uint8)
+    header = block[:block_header_dtype.itemsize].view(block_header_dtype)[0]
+    n_records = int(header['n_records'])
+    raw_data = np.zeros(n_records, dtype=dtype)
+    if n_records == 0:
+        return raw_data
+    position = block_header_dtype.itemsize
+    tdc = block[position:position + 4 * n_records].reshape(n_records, 4)
+    for index, field in enumerate(TDC_FIELDS):
+        raw_data[field] = tdc[:, index]
+    position += 4 * n_records
+
+    n_deltas = n_records - 1
+    ts_bits, trigger_id_bits = int(header['ts_bits']), int(header['trigger_id_bits'])
+    ts_offsets = unpack_bits(block[position:position + _n_bytes(n_deltas, ts_bits)], ts_bits, n_deltas)
+    position += _n_bytes(n_deltas, ts_bits)
+    trigger_id_offsets = unpack_bits(block[position:position + _n_bytes(n_deltas, trigger_id_bits)], trigger_id_bits, n_deltas)
+
+    # Integrate differences, all arithmetic is modulo 2^n (unsigned overflow)
+    time_stamp = np.empty(n_records, dtype=np.uint64)
+    time_stamp[0] = header['time_stamp']
+    time_stamp[1:] = ts_offsets + header['ts_delta_min']
+    raw_data['time_stamp'] = np.cumsum(time_stamp, dtype=np.uint64)
+    trigger_id = np.empty(n_records, dtype=np.uint32)
+    trigger_id[0] = header['trigger_id']
+    trigger_id[1:] = trigger_id_offsets.astype(np.uint32) + header['trigger_id_delta_min']
+    raw_data['trigger_id'] = np.cumsum(trigger_id, dtype=np.uint32)
+    return raw_data
+
+
+def encode(raw_data, block_size=65536):
+    ''' Split raw data into blocks of at most block_size records. Returns list of encoded blocks.
+    '''
+    return [encode_block(raw_data[index:index + block_size]) for index in range(0, raw_data.shape[0], block_size)]
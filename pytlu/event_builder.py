@@ -0,0 +1,267 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Event building: join the TLU raw data with the data of a DUT (or telescope) on trigger_id or time_stamp.
+
+    Both streams are read chunk by chunk and merged in the order of the match key (sort merge join with
+    searchsorted), only the TLU records that can still match later DUT records are kept in memory:
+        trigger_id: the trigger IDs of both streams are unwrapped modulo 2^n_bits_trig_id (truncated DUT
+            trigger IDs), the DUT trigger IDs start at the first TLU trigger ID. DUT records have to follow
+            the TLU within 2^(n_bits_trig_id - 1) triggers.
+        time_stamp: every DUT time stamp (TLU clock cycles) is matched to the nearest TLU time stamp within
+            max_time_difference clock cycles
+    The key has to increase in both streams, DUT records that are out of order by more than one chunk stay
+    unmatched. Duplicates: TLU records with the key of the record before, DUT records matched to a TLU record
+    that is already matched (e.g. several hits per trigger), all of them are in the events.
+
+    DUT data: pytlu raw data file (e.g. of a second TLU, also rotated runs) or any HDF5 table (dut_node) with
+    the key field (dut_field, e.g. trigger_number of a hit table).
+
+    Usage: pytlu events run.h5 dut.h5 --dut_node /Hits --dut_field trigger_number --n_bits_trig_id 15
+    Output (<dut>_events.h5), written chunk by chunk:
+        events: dut_index, tlu_index, trigger_id and time_stamp of the TLU, time_difference (DUT - TLU time stamp)
+        dut_unmatched, tlu_unmatched: indices of the records without partner
+        attribute summary (yaml): number of matched, unmatched and duplicated records
+'''
+
+import argparse
+import logging
+import os
+import time
+
+import numpy as np
+import tables as tb
+import yaml
+
+from pytlu.data_reader import ChunkedReader
+from pytlu.file_rotation import get_segment_files
+from pytlu.trigger_id import get_mask, get_steps
+
+event_dtype = np.dtype([('dut_index', 'u8'), ('tlu_index', 'u8'), ('trigger_id', 'u4'), ('time_stamp', 'u8'), ('time_difference', 'i8')])
+
+
+def read_raw_data_chunks(filename, chunk_size=1000000):
+    ''' Generator of (record indices, raw data) of the chunks of a raw data file or rotated run, the indices count over all segments.
+    '''
+    for path in get_segment_files(filename):
+        with ChunkedReader(path, chunk_size=chunk_size) as reader:
+            attrs = reader.meta_data_table.attrs
+            index_offset = int(attrs.index_offset) if 'index_offset' in attrs._v_attrnames else 0
+            for meta_data, raw_data in reader:
+                yield index_offset + int(meta_data['index_start'][0]) + np.arange(raw_data.shape[0], dtype=np.int64), raw_data
+
+
+def read_table_chunks(filename, node, chunk_size=1000000):
+    ''' Generator of (row indices, rows) of the chunks of a table.
+    '''
+    with tb.open_file(filename, mode='r') as h5_file:
+        table = h5_file.get_node(node)
+        for start in range(0, table.nrows, chunk_size):
+            rows = table.read(start, min(start + chunk_size, table.nrows))
+            yield start + np.arange(rows.shape[0], dtype=np.int64), rows
+
+
+class EventMatcher(object):
+    ''' Sort merge join of TLU and DUT records on trigger_id or time_stamp.
+
+        add_tlu() appends TLU records to the buffer, match() matches a chunk of DUT records with the buffer,
+        release() removes the TLU records with keys below a limit (reported as unmatched if never matched).
+    '''
+
+    def __init__(self, key='trigger_id', n_bits_trig_id=32, max_time_difference=0):
+        if key not in ('trigger_id', 'time_stamp'):
+            raise ValueError('Events are built on trigger_id or time_stamp, not %s' % key)
+        self.key = key
+        self.n_bits_trig_id = n_bits_trig_id
+        self.tolerance = max_time_difference if key == 'time_stamp' else 0
+        self._last_key = {'tlu': None, 'dut': None}  # unwrapped key of the last record of the streams
+        self._tlu_key_min = None  # first TLU key, start of the DUT trigger IDs
+        self._dut_key_max = None
+        tlu_columns = (('index', np.int64), ('key', np.int64), ('trigger_id', np.uint32), ('time_stamp', np.uint64), ('matched', bool))
+        self._tlu = dict((name, np.zeros(0, dtype=dtype)) for name, dtype in tlu_columns)
+        self.n_tlu = self.n_dut = self.n_matched = 0
+        self.n_tlu_unmatched = self.n_dut_unmatched = 0
+        self.n_tlu_duplicates = self.n_dut_duplicates = 0
+        self.n_dut_out_of_order = 0
+
+    def get_keys(self, stream, values):
+        ''' Match keys (int64) of the next records of a stream, trigger IDs are unwrapped (not wrapped at 2^32 either).
+        '''
+        if values.shape[0] == 0:
+            return np.zeros(0, dtype=np.int64)
+        if self.key == 'time_stamp':
+            self._last_key[stream] = int(values[-1])
+            return values.astype(np.int64)
+        previous = self._last_key[stream]
+        if previous is None:  # DUT trigger IDs start at the first TLU trigger ID
+            previous = self._tlu_key_min - 1 if stream == 'dut' and self._tlu_key_min is not None else int(values[0]) - 1
+        keys = previous + np.cumsum(get_steps(values, self.n_bits_trig_id, previous=previous & get_mask(self.n_bits_trig_id)))
+        self._last_key[stream] = int(keys[-1])
+        return keys
+
+    def _count_duplicates(self, keys, previous):
+        ''' Records with the key of the record before (keys are sorted). '''
+        if keys.shape[0] == 0:
+            return 0
+        return int(np.count_nonzero(np.diff(keys) == 0)) + int(previous is not None and keys[0] == previous)
+
+    @property
+    def tlu_key_max(self):
+        return int(self._tlu['key'][-1]) if self._tlu['key'].shape[0] else None
+
+    def add_tlu(self, index, raw_data):
+        ''' Append TLU records (raw data with record indices) to the buffer.
+        '''
+        previous = self._last_key['tlu']
+        keys = self.get_keys('tlu', raw_data[self.key])
+        self.n_tlu += keys.shape[0]
+        if self._tlu_key_min is None and keys.shape[0]:
+            self._tlu_key_min = int(keys[0])
+        self.n_tlu_duplicates += self._count_duplicates(keys, previous)
+        new = {'index': index, 'key': keys, 'trigger_id': raw_data['trigger_id'], 'time_stamp': raw_data['time_stamp'],
+               'matched': np.zeros(keys.shape[0], dtype=bool)}
+        for name in self._tlu:
+            self._tlu[name] = np.concatenate((self._tlu[name], new[name]))
+
+    def release(self, key_limit):
+        ''' Remove the TLU records with key < key_limit from the buffer. Returns the indices of those never matched.
+        '''
+        n_release = int(np.searchsorted(self._tlu['key'], key_limit, side='left'))
+        unmatched = self._tlu['index'][:n_release][~self._tlu['matched'][:n_release]]
+        self.n_tlu_unmatched += unmatched.shape[0]
+        for name in self._tlu:
+            self._tlu[name] = self._tlu[name][n_release:]
+        return unmatched
+
+    def match(self, index, keys, time_stamp=None):
+        ''' Match DUT records (record indices and keys) with the buffered TLU records.
+
+            The buffer has to contain all TLU records up to the maximum key + max_time_difference.
+            Returns the events and the indices of the unmatched DUT records.
+        '''
+        self.n_dut += keys.shape[0]
+        if keys.shape[0] == 0:
+            return np.zeros(0, dtype=event_dtype), np.zeros(0, dtype=np.int64)
+        order = np.argsort(keys, kind='stable')  # in order, unless records of the DUT are swapped
+        index, keys = index[order], keys[order]
+        if self._dut_key_max is not None:
+            self.n_dut_out_of_order += int(np.count_nonzero(keys < self._dut_key_max - self.tolerance))
+        self._dut_key_max = int(keys[-1]) if self._dut_key_max is None else max(self._dut_key_max, int(keys[-1]))
+
+        tlu_keys = self._tlu['key']
+        if tlu_keys.shape[0] == 0:
+            matched, position = np.zeros(keys.shape[0], dtype=bool), np.zeros(keys.shape[0], dtype=np.int64)
+        elif self.key == 'trigger_id':
+            position = np.minimum(np.searchsorted(tlu_keys, keys, side='left'), tlu_keys.shape[0] - 1)
+            matched = tlu_keys[position] == keys
+        else:  # nearest time stamp
+            right = np.minimum(np.searchsorted(tlu_keys, keys, side='left'), tlu_keys.shape[0] - 1)
+            left = np.maximum(right - 1, 0)
+            position = np.where(np.abs(tlu_keys[left] - keys) <= np.abs(tlu_keys[right] - keys), left, right)
+            matched = np.abs(tlu_keys[position] - keys) <= self.tolerance
+        position = position[matched]  # sorted
+        first = np.concatenate(([True], np.diff(position) != 0))  # first DUT record of a TLU record in this chunk
+        self.n_dut_duplicates += int(np.count_nonzero(~first)) + int(np.count_nonzero(self._tlu['matched'][position[first]]))
+        self._tlu['matched'][position] = True
+        self.n_matched += position.shape[0]
+        self.n_dut_unmatched += keys.shape[0] - position.shape[0]
+
+        events = np.zeros(position.shape[0], dtype=event_dtype)
+        events['dut_index'] = index[matched]
+        events['tlu_index'] = self._tlu['index'][position]
+        events['trigger_id'] = self._tlu['trigger_id'][position]
+        events['time_stamp'] = self._tlu['time_stamp'][position]
+        if time_stamp is not None:
+            events['time_difference'] = time_stamp[order][matched].astype(np.int64) - self._tlu['time_stamp'][position].astype(np.int64)
+        return events, index[~matched]
+
+    def get_summary(self):
+        return {'key': self.key, 'n_bits_trig_id': self.n_bits_trig_id, 'max_time_difference': self.tolerance,
+                'n_tlu': self.n_tlu, 'n_dut': self.n_dut, 'n_matched': self.n_matched,
+                'n_tlu_unmatched': self.n_tlu_unmatched, 'n_dut_unmatched': self.n_dut_unmatched,
+                'n_tlu_duplicates': self.n_tlu_duplicates, 'n_dut_duplicates': self.n_dut_duplicates,
+                'n_dut_out_of_order': self.n_dut_out_of_order}
+
+
+def build_events(tlu_file, dut_file, output_file=None, key='trigger_id', dut_node=None, dut_field=None, n_bits_trig_id=32,
+                 max_time_difference=0, chunk_size=1000000):
+    ''' Match the DUT data (dut_node of dut_file, None: pytlu raw data) with the TLU raw data, write the events to output_file
+        (None: <dut_file>_events.h5). Returns the summary (dict).
+    '''
+    if output_file is None:
+        output_file = os.path.splitext(dut_file)[0] + '_events.h5'
+    dut_field = key if dut_field is None else dut_field
+    matcher = EventMatcher(key=key, n_bits_trig_id=n_bits_trig_id, max_time_difference=max_time_difference)
+    tlu_chunks = read_raw_data_chunks(tlu_file, chunk_size=chunk_size)
+    dut_chunks = read_raw_data_chunks(dut_file, chunk_size=chunk_size) if dut_node is None else read_table_chunks(dut_file, dut_node, chunk_size=chunk_size)
+    filters = tb.Filters(complib='blosc', complevel=5)
+
+    with tb.open_file(output_file, mode='w', title='Events of %s' % os.path.basename(dut_file)) as out_file:
+        events_table = out_file.create_table(out_file.root, name='events', description=event_dtype, title='Matched TLU and DUT records',
+                                             filters=filters, expectedrows=chunk_size)
+        unmatched_arrays = dict((stream, out_file.create_earray(out_file.root, name=stream + '_unmatched', atom=tb.Int64Atom(), shape=(0,),
+                                                                title='Indices of the %s records without partner' % stream.upper(), filters=filters))
+                                for stream in ('tlu', 'dut'))
+        tlu_done = False
+        try:
+            while not tlu_done and matcher.tlu_key_max is None:  # DUT trigger IDs are unwrapped relative to the TLU
+                try:
+                    matcher.add_tlu(*next(tlu_chunks))
+                except StopIteration:
+                    tlu_done = True
+            for dut_index, dut_data in dut_chunks:
+                dut_keys = matcher.get_keys('dut', dut_data[dut_field])
+                if dut_keys.shape[0] == 0:
+                    continue
+                key_max = int(dut_keys.max())
+                while not tlu_done and (matcher.tlu_key_max is None or matcher.tlu_key_max <= key_max + matcher.tolerance):
+                    try:
+                        matcher.add_tlu(*next(tlu_chunks))
+                    except StopIteration:
+                        tlu_done = True
+                    unmatched_arrays['tlu'].append(matcher.release(int(dut_keys.min()) - matcher.tolerance))  # bounded buffer if the DUT is behind
+                time_stamp = dut_data['time_stamp'] if 'time_stamp' in dut_data.dtype.names else None
+                events, dut_unmatched = matcher.match(dut_index, dut_keys, time_stamp=time_stamp)
+                events_table.append(events)
+                unmatched_arrays['dut'].append(dut_unmatched)
+                unmatched_arrays['tlu'].append(matcher.release(key_max - matcher.tolerance))
+            for tlu_index, raw_data in tlu_chunks:  # rest of the TLU without DUT data
+                matcher.add_tlu(tlu_index, raw_data)
+                unmatched_arrays['tlu'].append(matcher.release(np.iinfo(np.int64).max))
+            unmatched_arrays['tlu'].append(matcher.release(np.iinfo(np.int64).max))
+        finally:
+            tlu_chunks.close()
+            dut_chunks.close()
+        summary = matcher.get_summary()
+        summary.update({'tlu_file': tlu_file, 'dut_file': dut_file, 'dut_node': dut_node, 'dut_field': dut_field})
+        out_file.root._v_attrs.summary = yaml.safe_dump(summary)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pytlu events', description='Match the data of a DUT with the TLU raw data (event building)')
+    parser.add_argument('tlu_file', type=str, help='TLU raw data file (or data file name of a rotated run)')
+    parser.add_argument('dut_file', type=str, help='DUT data file')
+    parser.add_argument('-o', '--output_file', type=str, default=None, help='Output file. Default=<dut_file>_events.h5')
+    parser.add_argument('--key', type=str, choices=('trigger_id', 'time_stamp'), default='trigger_id', help='Match on trigger_id or time_stamp. Default=trigger_id')
+    parser.add_argument('--dut_node', type=str, default=None, help='Table with the DUT data. Default=pytlu raw data file')
+    parser.add_argument('--dut_field', type=str, default=None, help='Field of the DUT table with the key. Default=key')
+    parser.add_argument('--n_bits_trig_id', type=int, default=32, help='Number of bits of the DUT trigger ID. Default=32')
+    parser.add_argument('--max_time_difference', type=int, default=0, help='Maximum time stamp difference in clock cycles (key time_stamp). Default=0')
+    parser.add_argument('--chunk_size', type=int, default=1000000, help='Number of records processed at once. Default=1000000')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    summary = build_events(args.tlu_file, args.dut_file, output_file=args.output_file, key=args.key, dut_node=args.dut_node, dut_field=args.dut_field,
+                           n_bits_trig_id=args.n_bits_trig_id, max_time_difference=args.max_time_difference, chunk_size=args.chunk_size)
+    print(yaml.safe_dump(summary, default_flow_style=False))
+    logging.info('Matched %d of %d DUT records in %0.1f s', summary['n_matched'], summary['n_dut'], time.time() - start)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Export of a raw data file into columnar formats, streamed in chunks of complete readouts (bounded memory).
+
+    npy: one .npy file per raw data field (raw_data.<field>.npy), meta_data.npy and attrs.yaml in the output folder.
+        The files can be memory mapped: np.load('run_npy/raw_data.trigger_id.npy', mmap_mode='r'), see load_npy().
+    parquet: raw_data.parquet with one row group per chunk of complete readouts (no readout is split
+        between row groups) and meta_data.parquet; the attributes are in the schema metadata (key pytlu).
+        Needs pyarrow (optional dependency).
+
+    Usage: pytlu export run.h5 [--format parquet] [-o run_parquet] [--compression zstd] [--jobs 4]
+'''
+
+import argparse
+import logging
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import tables as tb
+import yaml
+
+from pytlu.data_reader import ChunkedReader
+from pytlu.merge import get_attrs
+
+formats = ('npy', 'parquet')
+
+
+def _get_attrs(h5_file):
+    attrs = dict((name, value.decode() if isinstance(value, bytes) else str(value)) for name, value in get_attrs(h5_file).items())
+    attrs['source'] = os.path.abspath(h5_file.filename)
+    return attrs
+
+
+class NpyColumnWriter(object):
+    ''' Writes a .npy file of known length sequentially (without holding the array in memory).
+    '''
+
+    def __init__(self, filename, dtype, length):
+        self.filename = filename
+        self.length = int(length)
+        self.n_written = 0
+        self._file = open(filename, 'wb')
+        np.lib.format.write_array_header_1_0(self._file, {'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)), 'fortran_order': False,
+                                                          'shape': (self.length,)})
+
+    def write(self, data):
+        np.ascontiguousarray(data).tofile(self._file)
+        self.n_written += data.shape[0]
+
+    def close(self):
+        self._file.close()
+        if self.n_written != self.length:
+            raise RuntimeError('%s has %d of %d values' % (self.filename, self.n_written, self.length))
+
+
+def export_npy(reader, output_dir):
+    ''' Export the readouts of a ChunkedReader into .npy files. Returns the list of files.
+    '''
+    meta_data_table = reader.meta_data_table
+    n_words = len(reader.raw_data)
+    columns = [(name, NpyColumnWriter(os.path.join(output_dir, 'raw_data.%s.npy' % name), reader.dtype[name], n_words)) for name in reader.dtype.names]
+    meta_data = NpyColumnWriter(os.path.join(output_dir, 'meta_data.npy'), meta_data_table.dtype, meta_data_table.nrows)
+    try:
+        for meta, raw_data in reader:
+            for name, column in columns:
+                column.write(raw_data[name])
+            meta_data.write(meta)
+    finally:
+        for _, column in columns:
+            column.close()
+        meta_data.close()
+    with open(os.path.join(output_dir, 'attrs.yaml'), 'w') as attrs_file:
+        yaml.safe_dump(_get_attrs(reader.h5_file), attrs_file, default_flow_style=False)
+    return [column.filename for _, column in columns] + [meta_data.filename, attrs_file.name]
+
+
+def _to_arrow(data, schema):
+    import pyarrow as pa
+    return pa.Table.from_arrays([pa.array(np.ascontiguousarray(data[name])) for name in data.dtype.names], schema=schema)
+
+
+def _get_schema(dtype, metadata):
+    import pyarrow as pa
+    return pa.schema([(name, pa.from_numpy_dtype(dtype[name])) for name in dtype.names], metadata=metadata)
+
+
+def export_parquet(reader, output_dir, compression='zstd'):
+    ''' Export the readouts of a ChunkedReader into Parquet files (one row group per chunk). Returns the list of files.
+    '''
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError('Parquet export requires pyarrow (pip install pyarrow)')
+    metadata = {'pytlu': yaml.safe_dump(_get_attrs(reader.h5_file), default_flow_style=False)}
+    raw_data_schema = _get_schema(reader.dtype, metadata)
+    meta_data_schema = _get_schema(reader.meta_data_table.dtype, metadata)
+    files = [os.path.join(output_dir, 'raw_data.parquet'), os.path.join(output_dir, 'meta_data.parquet')]
+    raw_data_writer = pq.ParquetWriter(files[0], raw_data_schema, compression=compression)
+    meta_data_writer = pq.ParquetWriter(files[1], meta_data_schema, compression=compression)
+    try:
+        for meta_data, raw_data in reader:
+            raw_data_writer.write_table(_to_arrow(raw_data, raw_data_schema), row_group_size=max(1, raw_data.shape[0]))
+            meta_data_writer.write_table(_to_arrow(meta_data, meta_data_schema))
+    finally:
+        raw_data_writer.close()
+        meta_data_writer.close()
+    return files
+
+
+def export(input_file, output_dir=None, output_format='npy', chunk_size=1000000, compression='zstd', jobs=1):
+    ''' Export a raw data file into output_dir (default: name of the input file with _npy or _parquet). Returns the list of files.
+
+        jobs: number of threads for the decompression of the input (blosc) and for pyarrow
+    '''
+    if output_format not in formats:
+        raise ValueError('Unknown export format %s, use one of %s' % (output_format, ', '.join(formats)))
+    if output_dir is None:
+        output_dir = os.path.splitext(input_file)[0] + '_' + output_format
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    tb.set_blosc_max_threads(jobs)
+    with ChunkedReader(input_file, chunk_size=chunk_size) as reader:
+        logging.info('Exporting %s (%d readouts, %d records) to %s', input_file, len(reader), len(reader.raw_data), output_dir)
+        if output_format == 'npy':
+            return export_npy(reader, output_dir)
+        try:
+            import pyarrow as pa
+            pa.set_cpu_count(jobs)
+        except ImportError:
+            pass
+        return export_parquet(reader, output_dir, compression=compression)
+
+
+def load_npy(output_dir, mmap_mode='r'):
+    ''' Returns the exported raw data columns (dict of field name -> memory mapped array), the meta data and the attributes.
+    '''
+    columns = {}
+    for filename in sorted(os.listdir(output_dir)):
+        if filename.startswith('raw_data.') and filename.endswith('.npy'):
+            columns[filename.split('.')[1]] = np.load(os.path.join(output_dir, filename), mmap_mode=mmap_mode)
+    with open(os.path.join(output_dir, 'attrs.yaml')) as attrs_file:
+        attrs = yaml.safe_load(attrs_file)
+    return columns, np.load(os.path.join(output_dir, 'meta_data.npy'), mmap_mode=mmap_mode), attrs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pytlu export', description='Export a raw data file into .npy column files or Parquet')
+    parser.add_argument('input_file', type=str, help='Raw data file')
+    parser.add_argument('-o', '--output_dir', type=str, default=None, help='Output folder. Default=name of the input file with _npy or _parquet')
+    parser.add_argument('--format', type=str, default='npy', choices=formats, help='Output format. Default=npy')
+    parser.add_argument('--compression', type=str, default='zstd', help='Parquet compression (none, snappy, zstd, ...). Default=zstd')
+    parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(), help='Number of threads. Default=number of CPUs')
+    parser.add_argument('--chunk_size', type=int, default=1000000, help='Number of records exported at once (row group size). Default=1000000')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    files = export(args.input_file, output_dir=args.output_dir, output_format=args.format, chunk_size=args.chunk_size,
+                   compression=args.compression, jobs=args.jobs)
+    logging.info('Exported %d files in %0.1f s', len(files), time.time() - start)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,14 @@
 import logging
-from time import sleep, time, mktime
+from time import sleep
 from threading import Thread, Event, Lock
-from collections import deque
+from collections import deque, OrderedDict
 try:
-    from queue import Queue, Empty  # Python3
+    from queue import Queue, Empty, Full  # Python3
 except ImportError:
-    from Queue import Queue, Empty  # Python2
+    from Queue import Queue, Empty, Full  # Python2
 import sys
-import datetime
+
+from pytlu.time_sync import HostClock, ClockCorrelation, monotonic
 
 data_iterable = ("data", "timestamp_start", "timestamp_stop", "error")
 
@@ -24,18 +25,102 @@ class StopTimeout(Exception):
     pass
 
 
+class Subscriber(object):
+    '''Consumer of the readout data with its own queue and worker thread.
+
+    A slow subscriber does not delay the readout or other subscribers. With maxsize > 0 the
+    queue is bounded and readouts are dropped (and counted) if the subscriber cannot keep up.
+    '''
+
+    def __init__(self, name, callback, errback=None, maxsize=0):
+        self.name = name
+        self.callback = callback
+        self.errback = errback
+        self.maxsize = maxsize
+        self.thread = None
+        self._queue = Queue(maxsize=maxsize)
+        self.processed = 0
+        self.dropped = 0
+        self._last_put_time = None
+        self._last_processed_time = None
+
+    @property
+    def lag(self):
+        '''Number of readouts waiting to be processed.
+        '''
+        return self._queue.qsize()
+
+    @property
+    def lag_time(self):
+        '''Time span (in s) of the readouts waiting to be processed.
+        '''
+        if not self.lag or self._last_put_time is None or self._last_processed_time is None:
+            return 0.0
+        return max(0.0, self._last_put_time - self._last_processed_time)
+
+    @property
+    def is_alive(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def put(self, data_tuple):
+        try:
+            self._queue.put_nowait(data_tuple)
+        except Full:
+            if not self.dropped:
+                logging.warning('Subscriber %s cannot keep up, dropping data', self.name)
+            self.dropped += 1
+        else:
+            self._last_put_time = data_tuple[2]
+            if self._last_processed_time is None:
+                self._last_processed_time = data_tuple[1]
+
+    def start(self):
+        self.thread = Thread(target=self.worker, name='%sSubscriberThread' % self.name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        '''Stop the worker thread after all queued data is processed.
+        '''
+        self._queue.put(None)  # last item, will stop worker
+        self.thread.join()
+        self.thread = None
+
+    def worker(self):
+        '''Worker thread calling the callback function when data is available.
+        '''
+        logging.debug('Starting %s', self.thread.name)
+        while True:
+            data = self._queue.get()
+            if data is None:  # if None then exit
+                break
+            try:
+                self.callback(data)
+            except Exception:
+                if self.errback:
+                    self.errback(sys.exc_info())
+                else:
+                    logging.error('Subscriber %s failed: %s', self.name, sys.exc_info()[1])
+            self.processed += 1
+            self._last_processed_time = data[2]
+        logging.debug('Stopped %s', self.thread.name)
+
+
 class FifoReadout(object):
     def __init__(self, dut):
         self.dut = dut
         self.callback = None
         self.errback = None
         self.readout_thread = None
-        self.worker_thread = None
         self.watchdog_thread = None
+        self.clock_sync_thread = None
         self.fill_buffer = False
         self.readout_interval = 0.05
+        self.clock_sync_interval = 1.0
+        self.host_clock = HostClock()
+        self.clock = ClockCorrelation()
         self._moving_average_time_period = 10.0
-        self._data_deque = deque()
+        self._subscribers = OrderedDict()
         self._data_buffer = deque()
         self._words_per_read = deque(maxlen=int(self._moving_average_time_period / self.readout_interval))
         self._result = Queue(maxsize=1)
@@ -55,10 +140,33 @@ class FifoReadout(object):
 
     @property
     def is_alive(self):
-        if self.worker_thread:
-            return self.worker_thread.is_alive()
-        else:
-            False
+        return any(subscriber.is_alive for subscriber in self._subscribers.values())
+
+    @property
+    def subscribers(self):
+        return list(self._subscribers.values())
+
+    def add_subscriber(self, name, callback, maxsize=0):
+        '''Register a consumer of the readout data tuples. Each subscriber has its own queue and thread.
+        A subscriber with the same name is replaced.
+        '''
+        if name in self._subscribers:
+            self.remove_subscriber(name)
+        subscriber = Subscriber(name=name, callback=callback, errback=self.errback, maxsize=maxsize)
+        self._subscribers[name] = subscriber
+        if self._is_running:
+            subscriber.start()
+        return subscriber
+
+    def remove_subscriber(self, name):
+        subscriber = self._subscribers.pop(name)
+        if subscriber.is_alive:
+            subscriber.stop()
+
+    def get_subscriber_status(self):
+        '''Returns dict with lag (in readouts and seconds) of each subscriber.
+        '''
+        return OrderedDict((name, (subscriber.lag, subscriber.lag_time)) for name, subscriber in self._subscribers.items())
 
     @property
     def data(self):
@@ -86,6 +194,8 @@ class FifoReadout(object):
         self.callback = callback
         self.errback = errback
         self.fill_buffer = fill_buffer
+        if self.callback:
+            self.add_subscriber('callback', self.callback)
         self._record_count = 0
         if reset_sram_fifo:
             self.reset_sram_fifo()
@@ -95,7 +205,6 @@ class FifoReadout(object):
                 logging.warning('SRAM FIFO not empty when starting FIFO readout: size = %i', fifo_size)
         self._words_per_read.clear()
         if clear_buffer:
-            self._data_deque.clear()
             self._data_buffer.clear()
         self.stop_readout.clear()
         self.force_stop.clear()
@@ -103,10 +212,13 @@ class FifoReadout(object):
             self.watchdog_thread = Thread(target=self.watchdog, name='WatchdogThread')
             self.watchdog_thread.daemon = True
             self.watchdog_thread.start()
-        if self.callback:
-            self.worker_thread = Thread(target=self.worker, name='WorkerThread')
-            self.worker_thread.daemon = True
-            self.worker_thread.start()
+        for subscriber in self._subscribers.values():
+            subscriber.errback = self.errback
+            subscriber.start()
+        if self.clock_sync_interval:
+            self.clock_sync_thread = Thread(target=self.clock_sync, name='ClockSyncThread')
+            self.clock_sync_thread.daemon = True
+            self.clock_sync_thread.start()
         self.readout_thread = Thread(target=self.readout, name='ReadoutThread', kwargs={'no_data_timeout': no_data_timeout})
         self.readout_thread.daemon = True
         self.readout_thread.start()
@@ -133,8 +245,13 @@ class FifoReadout(object):
             self.readout_thread.join()
         if self.errback:
             self.watchdog_thread.join()
+        if self.clock_sync_thread:
+            self.clock_sync_thread.join()
+            self.clock_sync_thread = None
+        for subscriber in self._subscribers.values():
+            subscriber.stop()
         if self.callback:
-            self.worker_thread.join()
+            del self._subscribers['callback']
         self.callback = None
         self.errback = None
         logging.info('Stopped FIFO readout')
@@ -142,25 +259,32 @@ class FifoReadout(object):
     def print_readout_status(self):
         tlu_lost_count = self.get_data_tlu_fifo_lost_count()
         logging.info('Received words: %d', self._record_count)
-        logging.info('Data queue size: %d', len(self._data_deque))
+        for subscriber in self._subscribers.values():
+            logging.info('Subscriber %-10s processed: %d | queue size: %d (%.1f s) | dropped: %d',
+                         subscriber.name, subscriber.processed, subscriber.lag, subscriber.lag_time, subscriber.dropped)
         logging.info('SRAM FIFO size: %d', self.dut['stream_fifo']['SIZE'])
         logging.info('Channel:                     %s', " | ".join(['TLU']))
         logging.info('Lost data counter:           %s', " | ".join([str(tlu_lost_count).rjust(3)]))
 
+        intf = self.dut['intf']
+        if hasattr(intf, 'log_transfer_stats'):
+            logging.info('USB transfer statistics:')
+            intf.log_transfer_stats()
+
         if tlu_lost_count:
             logging.warning('Errors detected')
 
     def readout(self, no_data_timeout=None):
         '''Readout thread continuously reading SRAM.
 
-        Readout thread, which uses read_data() and appends data to self._data_deque (collection.deque).
+        Readout thread, which uses read_data() and passes the data to all subscribers.
         '''
         logging.debug('Starting %s', self.readout_thread.name)
         curr_time = self.get_float_time()
         time_wait = 0.0
         while not self.force_stop.wait(time_wait if time_wait >= 0.0 else 0.0):
             try:
-                time_read = time()
+                time_read = monotonic()
                 if no_data_timeout and curr_time + no_data_timeout < self.get_float_time():
                     raise NoDataTimeout('Received no data for %0.1f second(s)' % no_data_timeout)
                 data = self.read_data()
@@ -181,8 +305,8 @@ class FifoReadout(object):
                     last_time, curr_time = self.update_timestamp()
                     status = 0
                     skip_triggers = self.get_data_tlu_skipped_trigger_count()
-                    if self.callback:
-                        self._data_deque.append((data, last_time, curr_time, status, skip_triggers))
+                    for subscriber in list(self._subscribers.values()):
+                        subscriber.put((data, last_time, curr_time, status, skip_triggers))
                     if self.fill_buffer:
                         self._data_buffer.append((data, last_time, curr_time, status, skip_triggers))
                     self._words_per_read.append(data_words)
@@ -191,34 +315,12 @@ class FifoReadout(object):
                 else:
                     self._words_per_read.append(0)
             finally:
-                time_wait = self.readout_interval - (time() - time_read)
+                time_wait = self.readout_interval - (monotonic() - time_read)
             if self._calculate.is_set():
                 self._calculate.clear()
                 self._result.put(sum(self._words_per_read))
-        if self.callback:
-            self._data_deque.append(None)  # last item, will stop worker
         logging.debug('Stopped %s', self.readout_thread.name)
 
-    def worker(self):
-        '''Worker thread continuously calling callback function when data is available.
-        '''
-        logging.debug('Starting %s', self.worker_thread.name)
-        while True:
-            try:
-                data = self._data_deque.popleft()
-            except IndexError:
-                self.stop_readout.wait(self.readout_interval / 2.0)  # sleep a little bit, reducing CPU usage
-            else:
-                if data is None:  # if None then exit
-                    break
-                else:
-                    try:
-                        self.callback(data)
-                    except Exception:
-                        self.errback(sys.exc_info())
-
-        logging.debug('Stopped %s', self.worker_thread.name)
-
     def watchdog(self):
         logging.debug('Starting %s', self.watchdog_thread.name)
         while True:
@@ -231,6 +333,26 @@ class FifoReadout(object):
                 break
         logging.debug('Stopped %s', self.watchdog_thread.name)
 
+    def clock_sync(self):
+        '''Clock sync thread periodically sampling the TLU time stamp to correlate host and TLU clock.
+        '''
+        logging.debug('Starting %s', self.clock_sync_thread.name)
+        while True:
+            try:
+                self.clock.sample(self.get_tlu_time_stamp, self.host_clock)
+            except Exception:
+                if self.errback:
+                    self.errback(sys.exc_info())
+                else:
+                    logging.warning('Reading TLU time stamp failed: %s', sys.exc_info()[1])
+            if self.stop_readout.wait(self.clock_sync_interval):
+                break
+        try:
+            self.clock.fit()
+        except Exception:
+            logging.warning('Fitting TLU clock model failed: %s', sys.exc_info()[1])
+        logging.debug('Stopped %s', self.clock_sync_thread.name)
+
     def read_data(self):
         return self.dut.get_fifo_data()
 
@@ -273,9 +395,10 @@ class FifoReadout(object):
     def get_data_tlu_skipped_trigger_count(self):
         return self.dut['tlu_master'].SKIP_TRIG_COUNTER
 
+    def get_tlu_time_stamp(self):
+        return self.dut['tlu_master'].TIME_STAMP
+
     def get_float_time(self):
-        '''returns time as double precision floats - Time64 in pytables - mapping to and from python datetime's
+        '''returns monotonic host time (UNIX time at start of FifoReadout) as double precision float
         '''
-        t1 = time()
-        t2 = datetime.datetime.fromtimestamp(t1)
-        return mktime(t2.timetuple()) + 1e-6 * t2.microsecond
+        return self.host_clock()
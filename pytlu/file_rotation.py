@@ -0,0 +1,203 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Rotation of the raw data output file by size or duration.
+
+    A run is written into segments <name>_0000.h5, <name>_0001.h5, ... Each segment is a complete
+    raw data file with its own meta_data (index ranges start at 0 in every segment) and all
+    attributes (kwargs, config, ...). The manifest <name>_manifest.yaml lists the segments with their
+    position in the run (global record and readout ranges) and is updated on every rotation.
+    Finished segments are closed and can be read while later segments are written.
+'''
+
+import logging
+import os
+import time
+
+import numpy as np
+import tables as tb
+import yaml
+
+from pytlu.raw_capture import get_capture_name, replace_file
+
+MANIFEST_SUFFIX = '_manifest.yaml'
+
+
+def get_manifest_name(filename):
+    return os.path.splitext(filename)[0] + MANIFEST_SUFFIX
+
+
+def load_manifest(filename):
+    ''' Returns the manifest (dict) of a rotated run. filename is the manifest or the data file name of the run.
+    '''
+    if not filename.endswith(MANIFEST_SUFFIX):
+        filename = get_manifest_name(filename)
+    with open(filename, 'r') as f:
+        manifest = yaml.safe_load(f)
+    folder = os.path.dirname(os.path.abspath(filename))
+    for segment in manifest['segments']:
+        segment['path'] = os.path.join(folder, segment['file'])
+    return manifest
+
+
+def get_segment_files(filename):
+    ''' Returns the data files of a run: the segments if the run is rotated, otherwise [filename].
+    '''
+    if filename.endswith(MANIFEST_SUFFIX) or os.path.exists(get_manifest_name(filename)):
+        return [segment['path'] for segment in load_manifest(filename)['segments']]
+    return [filename]
+
+
+class RotatingWriter(object):
+    ''' Same interface as the writers of data_writer, starts a new segment when the current one
+        exceeds max_size (bytes) or max_duration (seconds). Rotation happens between readouts.
+        The size is the size of the file, or the size property of the writer if it has one
+        (raw capture: bytes written, writer process: uncompressed bytes sent).
+
+        create_writer(filename) has to return the writer of a new segment, segment_closed(filename)
+        is called after a segment is closed (e.g. to index it).
+    '''
+
+    update_retries = 20
+
+    def __init__(self, filename, create_writer, max_size=None, max_duration=None, segment_closed=None):
+        self.base, self.extension = os.path.splitext(filename)
+        self.manifest_file = get_manifest_name(filename)
+        self.create_writer = create_writer
+        self.segment_closed = segment_closed
+        self.max_size = max_size
+        self.max_duration = max_duration
+        self.attrs = {}
+        self.tables = {}
+        self.segments = []
+        self.finished = False
+        self.writer = None
+        self._open_segment()
+
+    @property
+    def filename(self):
+        return self.segments[-1]['path']
+
+    def _open_segment(self):
+        index = len(self.segments)
+        path = '%s_%04d%s' % (self.base, index, self.extension)
+        previous = self.segments[-1] if self.segments else {'index_stop': 0, 'readout_stop': 0}
+        self.segments.append({'file': os.path.basename(path),
+                              'path': path,
+                              'index_start': previous['index_stop'],
+                              'index_stop': previous['index_stop'],
+                              'readout_start': previous['readout_stop'],
+                              'readout_stop': previous['readout_stop'],
+                              'timestamp_start': None,
+                              'timestamp_stop': None,
+                              'closed': False})
+        self._segment_start = time.time()
+        self.writer = self.create_writer(path)
+        self.writer.set_attrs(segment=index, index_offset=self.segments[-1]['index_start'], readout_offset=self.segments[-1]['readout_start'], **self.attrs)
+        for name, data in self.tables.items():
+            self.writer.write_table(name, data)
+        self._write_manifest()
+        logging.info('Writing segment %d: %s', index, path)
+
+    def _close_segment(self):
+        self.writer.close()
+        if self.segment_closed is not None:
+            self.segment_closed(self.segments[-1]['path'])
+        self.segments[-1]['closed'] = True
+
+    def _write_manifest(self):
+        segments = [dict((key, value) for key, value in segment.items() if key != 'path') for segment in self.segments]
+        tmp_file = self.manifest_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            yaml.safe_dump({'segments': segments, 'finished': self.finished}, f, default_flow_style=False)
+        replace_file(tmp_file, self.manifest_file)  # atomic, readers never see a partial manifest
+
+    def _segment_size(self):
+        size = getattr(self.writer, 'size', None)  # raw capture is preallocated, file size is meaningless
+        if size is None:
+            size = os.path.getsize(self.segments[-1]['path'])
+        return size
+
+    def _rotate_required(self):
+        if self.segments[-1]['readout_stop'] == self.segments[-1]['readout_start']:
+            return False  # at least one readout per segment
+        if self.max_duration is not None and time.time() - self._segment_start >= self.max_duration:
+            return True
+        if self.max_size is not None and self._segment_size() >= self.max_size:
+            return True
+        return False
+
+    def append(self, data_tuple):
+        self.writer.append(data_tuple)
+        segment = self.segments[-1]
+        segment['index_stop'] += int(data_tuple[0].shape[0])
+        segment['readout_stop'] += 1
+        if segment['timestamp_start'] is None:
+            segment['timestamp_start'] = float(data_tuple[1])
+        segment['timestamp_stop'] = float(data_tuple[2])
+        if self._rotate_required():
+            self._close_segment()
+            self._open_segment()
+
+    def append_readout(self, raw_data, timestamp_start, timestamp_stop, error, skipped_triggers):
+        self.append((raw_data, timestamp_start, timestamp_stop, error, skipped_triggers))
+
+    def set_attrs(self, **attrs):
+        ''' Set attributes of the current segment and of all following segments.
+
+            Closed segments get the attributes when the run is closed.
+        '''
+        self.attrs.update(attrs)
+        self.writer.set_attrs(**attrs)
+
+    def write_table(self, name, data, title=None):
+        self.tables[name] = data
+        self.writer.write_table(name, data, title=title)
+
+    def append_table(self, name, data, title=None):
+        self.writer.append_table(name, data, title=title)  # rows stay in the current segment
+
+    def close(self):
+        self._close_segment()
+        self._update_closed_segments()
+        self.finished = True
+        self._write_manifest()
+
+    def _update_segment_file(self, path):
+        with tb.open_file(path, mode='a') as h5_file:
+            for name, value in self.attrs.items():
+                h5_file.root.meta_data.attrs[name] = value
+            for name, data in self.tables.items():
+                if name in h5_file.root:
+                    h5_file.remove_node(h5_file.root, name)
+                h5_file.create_table(h5_file.root, name=name, obj=data, filters=h5_file.root.meta_data.filters)
+
+    def _update_closed_segments(self):
+        ''' Add attributes and tables to the earlier segments (e.g. configuration and clock model stored at the end of the run).
+        '''
+        for segment in self.segments[:-1]:
+            if os.path.exists(segment['path']):
+                for _ in range(self.update_retries):
+                    try:
+                        self._update_segment_file(segment['path'])
+                        break
+                    except (IOError, tb.HDF5ExtError):  # segment is opened by a reader
+                        time.sleep(0.5)
+                else:
+                    logging.warning('Cannot update attributes of %s, file is in use', segment['path'])
+            else:  # raw capture
+                name = get_capture_name(segment['path'])
+                with open(name + '.yaml', 'r') as f:
+                    header = yaml.safe_load(f)
+                header['attrs'].update(self.attrs)
+                for table_name, data in self.tables.items():
+                    np.save('%s.%s.npy' % (name, table_name), data)
+                    if table_name not in header['tables']:
+                        header['tables'].append(table_name)
+                with open(name + '.yaml', 'w') as f:
+                    yaml.safe_dump(header, f, default_flow_style=False)
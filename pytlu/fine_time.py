@@ -0,0 +1,117 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Fine time (leading edge) analysis of the trigger inputs CH0..CH3.
+
+    le0..le3 are the leading edges of the inputs before the trigger decision in TDC bins of 1.5625 ns
+    (1/16 of the 40 MHz clock) with a fixed offset (tlu_master_core.v): a larger value is an earlier
+    edge, 0 means the input is disabled. The TLU triggers if all enabled inputs have a valid edge and
+    the spread max(le) - min(le) of the enabled inputs is smaller than --coincidence_window.
+
+    FineTimeHistograms, filled chunk by chunk (exact merge), used by pytlu analyze and the online monitor converter:
+        le_histograms: distribution of le0..le3
+        difference_histograms: time difference t_j - t_i = le_i - le_j of the input pairs (i, j), triggers with both inputs enabled
+        spread_histogram: spread of the enabled inputs, triggers with at least two enabled inputs
+            get_window_occupancy(): fraction of the triggers within each coincidence window
+'''
+
+import numpy as np
+
+TDC_BIN = 1.5625  # ns
+N_INPUTS = 4
+MAX_COINCIDENCE_WINDOW = 31
+input_pairs = [(i, j) for i in range(N_INPUTS) for j in range(i + 1, N_INPUTS)]
+
+
+def get_le(raw_data):
+    ''' Returns the leading edges le0..le3 (list of uint8 arrays) of raw data records.
+    '''
+    return [raw_data['le%d' % i] for i in range(N_INPUTS)]
+
+
+def get_spread(le):
+    ''' Returns the spread max(le) - min(le) of the enabled inputs and the number of enabled inputs of every trigger.
+    '''
+    le_max = np.maximum.reduce(le)  # disabled inputs are 0
+    le_min = np.minimum.reduce([channel - np.uint8(1) for channel in le]) + np.uint8(1)  # disabled inputs wrap to 255
+    n_enabled = np.add.reduce([(channel > 0).view(np.uint8) for channel in le])
+    return np.where(n_enabled > 0, le_max - le_min, 0).astype(np.uint8), n_enabled
+
+
+class FineTimeHistograms(object):
+    ''' Histograms of the leading edges of consecutive raw data records, see add() and merge().
+    '''
+
+    def __init__(self):
+        self.n_records = 0
+        self.le_histograms = np.zeros((N_INPUTS, 256), dtype=np.int64)
+        self.difference_histograms = np.zeros((len(input_pairs), 511), dtype=np.int64)  # bin 255: no time difference
+        self.spread_histogram = np.zeros(256, dtype=np.int64)
+
+    def add(self, raw_data):
+        ''' Add the leading edges of raw data records.
+        '''
+        if raw_data.shape[0] == 0:
+            return self
+        le = get_le(raw_data)
+        self.n_records += raw_data.shape[0]
+        le_histograms = np.array([np.bincount(channel, minlength=256) for channel in le])
+        self.le_histograms += le_histograms
+        if not le_histograms[:, 1:].any():  # all inputs disabled (e.g. test pulses)
+            return self
+        for pair, (i, j) in enumerate(input_pairs):
+            both = (le[i] > 0) & (le[j] > 0)
+            if both.any():
+                self.difference_histograms[pair] += np.bincount(le[i][both].astype(np.int16) - le[j][both] + 255, minlength=511)
+        spread, n_enabled = get_spread(le)
+        self.spread_histogram += np.bincount(spread[n_enabled > 1], minlength=256)
+        return self
+
+    def merge(self, other):
+        self.n_records += other.n_records
+        self.le_histograms += other.le_histograms
+        self.difference_histograms += other.difference_histograms
+        self.spread_histogram += other.spread_histogram
+        return self
+
+    def reset(self):
+        self.__init__()
+
+    def get_window_occupancy(self):
+        ''' Returns the fraction of the triggers (with at least two enabled inputs) with spread < window for the windows 0...31.
+        '''
+        n_triggers = self.spread_histogram.sum()
+        if n_triggers == 0:
+            return np.zeros(MAX_COINCIDENCE_WINDOW + 1)
+        return np.concatenate(([0], np.cumsum(self.spread_histogram)[:MAX_COINCIDENCE_WINDOW])) / float(n_triggers)
+
+    def get_window(self, fraction=0.99):
+        ''' Returns the smallest coincidence window that keeps fraction of the triggers (None: no coincidences or > 31).
+        '''
+        occupancy = self.get_window_occupancy()
+        if self.spread_histogram.sum() == 0 or occupancy[-1] < fraction:
+            return None
+        return int(np.argmax(occupancy >= fraction))
+
+    def get_summary(self):
+        ''' Returns the summary (dict): mean and RMS of the enabled leading edges (TDC bins) and of the pair time differences (ns).
+        '''
+        summary = {'enabled_inputs': [i for i in range(N_INPUTS) if self.le_histograms[i, 1:].sum()],
+                   'coincidence_window_99': self.get_window(0.99),
+                   'spread_max': int(np.nonzero(self.spread_histogram)[0][-1]) if self.spread_histogram.sum() else None}
+        for i in summary['enabled_inputs']:
+            summary['le%d' % i] = _get_mean_rms(np.arange(1, 256), self.le_histograms[i, 1:])
+        for pair, (i, j) in enumerate(input_pairs):
+            if self.difference_histograms[pair].sum():
+                summary['le%d-le%d' % (i, j)] = _get_mean_rms((np.arange(511) - 255) * TDC_BIN, self.difference_histograms[pair])
+        return summary
+
+
+def _get_mean_rms(values, counts):
+    mean = float(np.average(values, weights=counts))
+    return {'mean': mean, 'rms': float(np.sqrt(np.average((values - mean) ** 2, weights=counts)))}
@@ -0,0 +1,293 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Merging of runs and slicing of time windows out of runs, streamed chunk by chunk.
+
+    pytlu merge run_a.h5 run_b.h5 -o merged.h5: concatenate runs (also rotated runs)
+    pytlu slice run.h5 --start 60 --stop 120 -o slice.h5: readouts starting in [start, stop) seconds after the run start
+
+    The output has the layout, filters and chunkshape of the (first) input. The raw data is copied without
+    decoding if the layout is the same: the compressed HDF5 chunks are copied as they are where the filters
+    and chunkshape match and input and output position are chunk aligned (always for the first input), delta
+    encoded blocks are copied as bytes. Other data is copied by reading and appending chunks.
+    The meta_data index ranges are rebased, the attributes (config, kwargs, ...) of the first input are kept,
+    the additional tables (status, clock_samples, ...) are concatenated (merge) or cut to the time window
+    (slice, tables with a timestamp field). The source of the output is stored in the attribute source.
+'''
+
+import argparse
+import logging
+import os
+import time
+
+import numpy as np
+import tables as tb
+import yaml
+
+from pytlu.data_reader import RawDataReader, get_layout, get_data_dtype
+from pytlu.data_writer import create_file_writer
+from pytlu.file_rotation import get_segment_files
+
+# Nodes that are written by the writer, indexes are not copied (pytlu index)
+data_nodes = ('raw_data', 'meta_data', 'raw_data_blocks', 'raw_data_index')
+# Attributes that describe one file or segment
+file_attrs = ('layout', 'data_dtype', 'checkpoint', 'segment', 'index_offset', 'readout_offset', 'source')
+
+
+def _get_data_node(h5_file, layout):
+    ''' Returns the node with the chunkshape and filters of the raw data. '''
+    if layout == 'table':
+        return h5_file.root.raw_data
+    if layout == 'column':
+        return h5_file.root.raw_data_columns.time_stamp
+    return h5_file.root.raw_data_delta
+
+
+def create_output_writer(h5_file, output_file):
+    ''' Returns the writer of a new raw data file with the layout, filters and chunkshape of an opened raw data file.
+    '''
+    layout = get_layout(h5_file)
+    data_node = _get_data_node(h5_file, layout)
+    kwargs = {'block_size': int(data_node.attrs.block_size)} if layout == 'delta' else {}
+    return create_file_writer(output_file, get_data_dtype(h5_file), h5_file.root.meta_data.dtype, layout=layout, filter_data=data_node.filters,
+                              filter_tables=h5_file.root.meta_data.filters, chunkshape=int(data_node.chunkshape[0]), **kwargs)
+
+
+def _can_copy_chunks(src_node, dst_node):
+    return (src_node.filters == dst_node.filters and src_node.chunkshape == dst_node.chunkshape and src_node.dtype == dst_node.dtype)
+
+
+def copy_rows(src_node, dst_node, start, stop, chunk_size=1000000):
+    ''' Append the rows [start, stop) of src_node to dst_node (tables or 1-dimensional arrays).
+
+        Compressed chunks are copied without decompression if the nodes have the same filters and chunkshape
+        and the rows are chunk aligned in both nodes. Returns the number of rows copied as chunks.
+    '''
+    dst_node.flush()
+    n_chunk = src_node.chunkshape[0]
+    if not _can_copy_chunks(src_node, dst_node) or (start - dst_node.nrows) % n_chunk:
+        _append_rows(src_node, dst_node, start, stop, chunk_size)
+        return 0
+    aligned_start = min(stop, -(-start // n_chunk) * n_chunk)
+    aligned_stop = stop if stop == src_node.nrows else max(aligned_start, stop - stop % n_chunk)  # last chunk of a node may be partial
+    _append_rows(src_node, dst_node, start, aligned_start, chunk_size)
+    if aligned_stop > aligned_start:
+        dst_start = dst_node.nrows
+        dst_node.truncate(dst_start + aligned_stop - aligned_start)
+        for index in range(aligned_start, aligned_stop, n_chunk):
+            dst_node.write_chunk((dst_start + index - aligned_start,), src_node.read_chunk((index,)))
+    _append_rows(src_node, dst_node, aligned_stop, stop, chunk_size)
+    return int(aligned_stop - aligned_start)
+
+
+def _append_rows(src_node, dst_node, start, stop, chunk_size):
+    for chunk_start in range(start, stop, chunk_size):
+        dst_node.append(src_node.read(chunk_start, min(chunk_start + chunk_size, stop)))
+    dst_node.flush()
+
+
+def _write_decoded(reader, writer, start, stop, chunk_size):
+    for chunk_start in range(start, stop, chunk_size):
+        writer.write_raw_data(reader.read(chunk_start, min(chunk_start + chunk_size, stop)))
+
+
+def _find_block(block_table, index, row_start=0):
+    ''' Returns the first row of the block table with index_start >= index (binary search, reads single rows).
+    '''
+    row_stop = block_table.nrows
+    while row_start < row_stop:
+        row = (row_start + row_stop) // 2
+        if block_table.read(row, row + 1, field='index_start')[0] < index:
+            row_start = row + 1
+        else:
+            row_stop = row
+    return row_start
+
+
+def _copy_delta(h5_file, reader, writer, start, stop, chunk_size):
+    ''' Copy the records [start, stop) between delta encoded files: the complete blocks are copied as bytes,
+        the records of partial blocks at the edges are encoded again. Only the blocks in [start, stop) are read.
+    '''
+    block_table = h5_file.root.raw_data_blocks
+    first_row = _find_block(block_table, start)
+    blocks = block_table.read(first_row, _find_block(block_table, stop, row_start=first_row))
+    blocks = blocks[blocks['index_start'] + blocks['n_records'] <= stop]
+    if blocks.shape[0] == 0:
+        _write_decoded(reader, writer, start, stop, chunk_size)
+        return
+    first, last = int(blocks['index_start'][0]), int(blocks['index_start'][-1] + blocks['n_records'][-1])
+    byte_start, byte_stop = int(blocks['offset'][0]), int(blocks['offset'][-1] + blocks['size'][-1])
+    _write_decoded(reader, writer, start, first, chunk_size)
+    copy_rows(h5_file.root.raw_data_delta, writer.data_table, byte_start, byte_stop, chunk_size=chunk_size)
+    new_blocks = blocks.astype(writer.block_dtype)
+    new_blocks['index_start'] = blocks['index_start'] - first + writer.n_records
+    new_blocks['offset'] = blocks['offset'] - byte_start + writer.n_bytes
+    writer.block_table.append(new_blocks)
+    writer.block_table.flush()
+    writer.n_records += last - first
+    writer.n_bytes += byte_stop - byte_start
+    _write_decoded(reader, writer, last, stop, chunk_size)
+
+
+def copy_readouts(h5_file, writer, readout_start, readout_stop, chunk_size=1000000, meta_block_size=100000):
+    ''' Append the readouts [readout_start, readout_stop) of an opened raw data file with the writer (index ranges are rebased).
+    '''
+    reader = RawDataReader(h5_file)
+    for block_start in range(readout_start, readout_stop, meta_block_size):
+        meta_data = h5_file.root.meta_data.read(block_start, min(block_start + meta_block_size, readout_stop))
+        start, stop = int(meta_data['index_start'][0]), int(meta_data['index_stop'][-1])
+        if reader.layout != writer.layout:
+            _write_decoded(reader, writer, start, stop, chunk_size)
+        elif reader.layout == 'delta':
+            _copy_delta(h5_file, reader, writer, start, stop, chunk_size)
+        else:
+            for src_node, dst_node in _get_row_nodes(h5_file, writer):
+                copy_rows(src_node, dst_node, start, stop, chunk_size=chunk_size)
+        writer.append_meta_data(meta_data)
+
+
+def _get_row_nodes(h5_file, writer):
+    ''' Pairs of (input node, output node) with one row per record. '''
+    if writer.layout == 'table':
+        return [(h5_file.root.raw_data, writer.data_table)]
+    return [(h5_file.root.raw_data_columns._f_get_child(column.name), column) for column in writer.data_table]
+
+
+def get_attrs(h5_file):
+    ''' Returns the attributes of the run (without the attributes of the file, e.g. layout).
+    '''
+    attrs = h5_file.root.meta_data.attrs
+    return dict((name, attrs[name]) for name in attrs._v_attrnamesuser if name not in file_attrs)
+
+
+def get_tables(h5_file):
+    ''' Returns the additional tables (name -> data) of a raw data file.
+    '''
+    return dict((node.name, node[:]) for node in h5_file.root._f_iter_nodes(classname='Table') if node.name not in data_nodes)
+
+
+def get_appended_tables(h5_file):
+    ''' Returns the names of the additional tables that were appended during the run (e.g. status), see RawDataWriter.append_table().
+        In rotated runs these are split into the segments, the other tables are in every segment.
+    '''
+    return [node.name for node in h5_file.root._f_iter_nodes(classname='Table') if node.name not in data_nodes and 'appended' in node.attrs]
+
+
+def _add_tables(tables, h5_file, first_segment):
+    ''' Concatenate the additional tables of a segment to tables (name -> data). '''
+    appended = get_appended_tables(h5_file)
+    for name, data in get_tables(h5_file).items():
+        if first_segment or name in appended:
+            tables[name] = np.concatenate((tables[name], data.astype(tables[name].dtype))) if name in tables else data
+
+
+def _write_output(writer, h5_file, tables, source):
+    for name, value in get_attrs(h5_file).items():
+        writer.set_attrs(**{name: value})
+    appended = get_appended_tables(h5_file)
+    for name, data in tables.items():
+        if name in appended:
+            writer.append_table(name, data)
+        else:
+            writer.write_table(name, data)
+    writer.set_attrs(source=yaml.safe_dump(source, default_flow_style=False))
+
+
+def merge(input_files, output_file, chunk_size=1000000):
+    ''' Concatenate runs (raw data files or rotated runs) into output_file. Returns the source description (list of dict).
+    '''
+    runs = [get_segment_files(input_file) for input_file in input_files]
+    source, tables = [], {}
+    with tb.open_file(runs[0][0], mode='r') as first_file:
+        writer = create_output_writer(first_file, output_file)
+        try:
+            for input_file, segment_files in zip(input_files, runs):
+                run_source = {'file': os.path.abspath(input_file), 'readout_start': int(writer.meta_data_table.nrows), 'index_start': int(writer.n_words)}
+                for i, segment_file in enumerate(segment_files):
+                    with tb.open_file(segment_file, mode='r') as h5_file:
+                        copy_readouts(h5_file, writer, 0, h5_file.root.meta_data.nrows, chunk_size=chunk_size)
+                        _add_tables(tables, h5_file, first_segment=(i == 0))
+                run_source.update({'readout_stop': int(writer.meta_data_table.nrows), 'index_stop': int(writer.n_words)})
+                source.append(run_source)
+            _write_output(writer, first_file, tables, source)
+        finally:
+            writer.close()
+    return source
+
+
+def get_run_start_time(h5_file):
+    ''' Returns the host time of the first readout. '''
+    meta_data = h5_file.root.meta_data.read(0, 1)
+    return float(meta_data['timestamp_start'][0]) if meta_data.shape[0] else 0.0
+
+
+def slice_run(input_file, output_file, start=None, stop=None, chunk_size=1000000):
+    ''' Write the readouts of a run that start in [start, stop) seconds after the run start into output_file.
+        Returns the source description (dict).
+    '''
+    segment_files = get_segment_files(input_file)
+    with tb.open_file(segment_files[0], mode='r') as first_file:
+        run_start = get_run_start_time(first_file)
+        time_start = run_start + (start if start is not None else 0.0)
+        time_stop = run_start + stop if stop is not None else np.inf
+        source = {'file': os.path.abspath(input_file), 'start': start, 'stop': stop, 'run_start': run_start}
+        writer = create_output_writer(first_file, output_file)
+        try:
+            readout_offset = 0
+            all_tables = {}
+            for i, segment_file in enumerate(segment_files):
+                with tb.open_file(segment_file, mode='r') as h5_file:
+                    _add_tables(all_tables, h5_file, first_segment=(i == 0))
+                    timestamp_start = h5_file.root.meta_data.col('timestamp_start')
+                    first, last = np.searchsorted(timestamp_start, [time_start, time_stop], side='left')
+                    if last > first:
+                        source.setdefault('readout_start', readout_offset + int(first))
+                        source['readout_stop'] = readout_offset + int(last)
+                        copy_readouts(h5_file, writer, int(first), int(last), chunk_size=chunk_size)
+                    readout_offset += timestamp_start.shape[0]
+            tables = {}
+            for name, data in all_tables.items():
+                if data.dtype.names and 'timestamp' in data.dtype.names:
+                    data = data[(data['timestamp'] >= time_start) & (data['timestamp'] < time_stop)]
+                tables[name] = data
+            source['n_readouts'] = int(writer.meta_data_table.nrows)
+            source['n_records'] = int(writer.n_words)
+            _write_output(writer, first_file, tables, source)
+        finally:
+            writer.close()
+    return source
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pytlu merge', description='Concatenate runs into one raw data file')
+    parser.add_argument('input_files', type=str, nargs='+', help='Raw data files (or data file names of rotated runs) in order')
+    parser.add_argument('-o', '--output_file', type=str, required=True, help='Output file')
+    parser.add_argument('--chunk_size', type=int, default=1000000, help='Number of records copied at once. Default=1000000')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    source = merge(args.input_files, args.output_file, chunk_size=args.chunk_size)
+    logging.info('Merged %d runs (%d records) into %s in %0.1f s', len(source), source[-1]['index_stop'], args.output_file, time.time() - start)
+
+
+def main_slice(argv=None):
+    parser = argparse.ArgumentParser(prog='pytlu slice', description='Write the readouts of a time window of a run into a new raw data file')
+    parser.add_argument('input_file', type=str, help='Raw data file (or data file name of a rotated run)')
+    parser.add_argument('-o', '--output_file', type=str, required=True, help='Output file')
+    parser.add_argument('--start', type=float, default=None, help='Start of the window in s after the run start. Default=run start')
+    parser.add_argument('--stop', type=float, default=None, help='End of the window in s after the run start. Default=run end')
+    parser.add_argument('--chunk_size', type=int, default=1000000, help='Number of records copied at once. Default=1000000')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    source = slice_run(args.input_file, args.output_file, start=args.start, stop=args.stop, chunk_size=args.chunk_size)
+    logging.info('Wrote %d readouts (%d records) into %s in %0.1f s', source['n_readouts'], source['n_records'], args.output_file, time.time() - start)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,9 @@ from zmq.utils import jsonapi
 from online_monitor.converter.transceiver import Transceiver
 from online_monitor.utils import utils
 
+from pytlu.fine_time import FineTimeHistograms
+from pytlu.scalers import InputScalers
+
 
 class PyTLU(Transceiver):
     def setup_transceiver(self):
@@ -46,17 +49,19 @@ class PyTLU(Transceiver):
         self.readout = 0
         self.n_readouts = 0
         self.skipped_trigger_counter_old = 0  # variable needed to calcualte actual trigger counter
+        self.fine_time = FineTimeHistograms()  # le0..le3 histograms of the raw data
+        self.scalers = InputScalers()  # software input scalers
 
     def deserialize_data(self, data):
         try:
             self.meta_data = jsonapi.loads(data)
         except ValueError:
             try:
-                dtype = self.meta_data.pop('dtype')
+                dtype = self.meta_data.pop('dtype')  # descr of the raw data dtype
                 shape = self.meta_data.pop('shape')
                 if self.meta_data:
                     try:
-                        raw_data_array = np.frombuffer(data, dtype=dtype).reshape(shape)
+                        raw_data_array = np.frombuffer(data, dtype=np.dtype([tuple(field) for field in dtype])).reshape(shape)
                         return raw_data_array
                     except (KeyError, ValueError, TypeError):  # KeyError happens if meta data read is omitted; ValueError if np.frombuffer fails due to wrong sha
                         return None
@@ -72,7 +77,7 @@ class PyTLU(Transceiver):
             array[1][0] = data
             return array
 
-        if data[0][1] is not None:
+        if isinstance(data[0][1], dict):
             meta_data = data[0][1]['meta_data']
             data_length = meta_data['data_length']
             timestamp_start = meta_data['timestamp_start']
@@ -105,8 +110,14 @@ class PyTLU(Transceiver):
             self.updateTime = now
             self.fps = self.fps * 0.7 + recent_fps * 0.3
 
-            return [{'tlu': self.all_arrays, 'indices': self.array_indices, 'fps': self.fps, 'timestamp_stop': now}]
+            return [{'tlu': self.all_arrays, 'indices': self.array_indices, 'fps': self.fps, 'timestamp_stop': now,
+                     'fine_time': {'le_histograms': self.fine_time.le_histograms, 'spread_histogram': self.fine_time.spread_histogram,
+                                   'window_occupancy': self.fine_time.get_window_occupancy()},
+                     'scalers': self.scalers.counts}]
 
+        if isinstance(data[0][1], np.ndarray):  # raw data of the readout
+            self.fine_time.add(data[0][1])
+            self.scalers.add(data[0][1])
         self.readout += 1
 
         if self.n_readouts != 0:  # = 0 for infinite integration
@@ -117,6 +128,7 @@ class PyTLU(Transceiver):
                 self.array_indices['trigger_rate_real'] = 0
                 self.update_time_indices['trigger_rate_acc'] = 0
                 self.update_time_indices['trigger_rate_real'] = 0
+                self.fine_time.reset()
                 self.readouts = 0
 
     def serialize_data(self, data):
@@ -131,5 +143,7 @@ class PyTLU(Transceiver):
             self.array_indices['trigger_rate_real'] = 0
             self.update_time_indices['trigger_rate_acc'] = 0
             self.update_time_indices['trigger_rate_real'] = 0
+            self.fine_time.reset()
+            self.scalers.reset()
         else:
             self.n_readouts = int(command[0])
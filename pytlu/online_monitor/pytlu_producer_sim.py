@@ -1,22 +1,23 @@
 ''' This is a producer faking data coming from pytlu by taking real data and sending these in chunks'''
 
 import time
-import numpy as np
 import tables as tb
 import zmq
 import logging
 
 from online_monitor.utils.producer_sim import ProducerSim
 
+from pytlu.data_reader import ChunkedReader
+
 
 class PyTLU(ProducerSim):
 
     def setup_producer_device(self):
         ProducerSim.setup_producer_device(self)
-        self.in_file_h5 = tb.open_file(self.config['data_file'], mode="r")
-        self.meta_data = self.in_file_h5.root.meta_data[:]
-        self.raw_data = self.in_file_h5.root.raw_data
-        self.n_readouts = self.meta_data.shape[0]
+        self.reader = ChunkedReader(self.config['data_file'])
+        self.in_file_h5 = self.reader.h5_file
+        self.readouts = self.reader.readouts()
+        self.n_readouts = len(self.reader)
         self.total_data = 0  # amount of replayed data in MB
         self.time_start = time.time()  # calculate duration of replay
         self.time_end = 0  # calculate duration of replay
@@ -28,26 +29,20 @@ class PyTLU(ProducerSim):
             self.scan_parameter_name = 'No parameter'
             self.scan_parameters = None
 
-        self.readout_word_indeces = np.column_stack((self.meta_data['index_start'], self.meta_data['index_stop']))
         self.actual_readout = 0
         self.last_readout_time = None
 
     def get_data(self):  # Return the data of one readout
         if self.actual_readout < self.n_readouts:
-            index_start, index_stop = self.readout_word_indeces[self.actual_readout]
-            data = []
-            data.append(self.raw_data[index_start:index_stop])
-            data.extend((float(self.meta_data[self.actual_readout]['timestamp_start']),
-                         float(self.meta_data[self.actual_readout]['timestamp_stop']),
-                         int(self.meta_data[self.actual_readout]['error']),
-                         int(self.meta_data[self.actual_readout]['skipped_triggers'])))
+            raw_data, timestamp_start, timestamp_stop, error, skipped_triggers = next(self.readouts)
+            data = [raw_data, float(timestamp_start), float(timestamp_stop), int(error), int(skipped_triggers)]
 
             # FIXME: Simple syncronization to replay with similar timing, does not really work
             now = time.time()
 
             if self.last_readout_time is not None:
                 delay = now - self.last_readout_time
-                additional_delay = self.meta_data[self.actual_readout]['timestamp_stop'] - self.meta_data[self.actual_readout]['timestamp_start'] - delay
+                additional_delay = timestamp_stop - timestamp_start - delay
                 if additional_delay > 0:
                     time.sleep(additional_delay)
             self.last_readout_time = now
@@ -74,7 +69,7 @@ class PyTLU(ProducerSim):
 
         data_meta_data = dict(
             name='ReadoutData',
-            dtype=str(data[0].dtype),
+            dtype=data[0].dtype.descr,  # str() of a structured dtype cannot be parsed by numpy
             shape=data[0].shape,
             data_length=data[0].shape[0],  # data length
             timestamp_start=data[1],  # float
@@ -91,4 +86,5 @@ class PyTLU(ProducerSim):
             pass
 
     def __del__(self):
-        self.in_file_h5.close()
+        self.readouts.close()  # stops the read ahead thread
+        self.reader.close()
@@ -1,5 +1,6 @@
 import time
 
+import numpy as np
 from PyQt5 import QtWidgets
 import pyqtgraph as pg
 from pyqtgraph.dockarea import DockArea, Dock
@@ -19,7 +20,9 @@ class PyTLU(Receiver):
         # Docks
         dock_rate = Dock("Particle rate (Trigger rate)", size=(400, 400))
         dock_status = Dock("Status", size=(800, 40))
+        dock_fine_time = Dock("Fine time (leading edges)", size=(400, 400))
         dock_area.addDock(dock_rate, 'above')
+        dock_area.addDock(dock_fine_time, 'right', dock_rate)
         dock_area.addDock(dock_status, 'top')
 
         # Status dock on top
@@ -30,6 +33,7 @@ class PyTLU(Receiver):
         self.rate_label = QtWidgets.QLabel("Readout Rate\n0 Hz")
         self.timestamp_label = QtWidgets.QLabel("Data Timestamp\n")
         self.plot_delay_label = QtWidgets.QLabel("Plot Delay\n")
+        self.scalers_label = QtWidgets.QLabel("Scalers CH0..CH3\n")
         self.spin_box = QtWidgets.QSpinBox(value=0)
         self.spin_box.setMaximum(1000000)
         self.spin_box.setSuffix(" Readouts")
@@ -37,6 +41,7 @@ class PyTLU(Receiver):
         layout.addWidget(self.timestamp_label, 0, 0, 0, 1)
         layout.addWidget(self.plot_delay_label, 0, 1, 0, 1)
         layout.addWidget(self.rate_label, 0, 2, 0, 1)
+        layout.addWidget(self.scalers_label, 0, 3, 0, 1)
         layout.addWidget(self.spin_box, 0, 6, 0, 1)
         layout.addWidget(self.reset_button, 0, 7, 0, 1)
         dock_status.addWidget(cw)
@@ -77,6 +82,17 @@ class PyTLU(Receiver):
                       'trigger_rate_real': self.trigger_rate_real_curve}
         self.plot_delay = 0
 
+        # fine time dock: le0..le3 distributions and fraction of triggers within the coincidence window
+        fine_time_graphics = pg.GraphicsLayoutWidget()
+        plot_le = pg.PlotItem(labels={'left': '#', 'bottom': 'Leading edge / 1.5625 ns'})
+        plot_le.addLegend()
+        self.le_curves = [plot_le.plot(pen=pen, name='le%d' % i) for i, pen in enumerate(('#B00B13', '#228B22', '#1F3FB0', '#B0A01F'))]
+        plot_window = pg.PlotItem(labels={'left': 'Triggers within window', 'bottom': 'Coincidence window / 1.5625 ns'})
+        self.window_curve = plot_window.plot(pen='#B00B13', symbol='o')
+        fine_time_graphics.addItem(plot_le, row=0, col=0)
+        fine_time_graphics.addItem(plot_window, row=1, col=0)
+        dock_fine_time.addWidget(fine_time_graphics)
+
     def deserialize_data(self, data):
         datar, meta = utils.simple_dec(data)
         return meta
@@ -98,6 +114,14 @@ class PyTLU(Receiver):
                     self.plots[key].setData(data['tlu'][key][0],
                                             data['tlu'][key][1], autoDownsample=True)
 
+        if 'fine_time' in data:
+            for curve, histogram in zip(self.le_curves, data['fine_time']['le_histograms']):
+                curve.setData(np.arange(1, histogram.shape[0]), histogram[1:])  # 0: input disabled
+            self.window_curve.setData(np.arange(data['fine_time']['window_occupancy'].shape[0]), data['fine_time']['window_occupancy'])
+
+        if 'scalers' in data:
+            self.scalers_label.setText("Scalers CH0..CH3\n%s" % ', '.join('%d' % count for count in data['scalers']))
+
         # set timestamp, plot delay and readour rate
         self.rate_label.setText("Readout Rate\n%d Hz" % data['fps'])
         self.timestamp_label.setText("Data Timestamp\n%s" % time.asctime(time.localtime(data['timestamp_stop'])))
@@ -34,7 +34,7 @@ def send_data(socket, data, len_raw_data, scan_parameters={}, name='ReadoutData'
         scan_parameters = {}
     data_meta_data = dict(
         name=name,
-        dtype=str(data[0].dtype),
+        dtype=data[0].dtype.descr,  # str() of a structured dtype cannot be parsed by numpy
         shape=data[0].shape,
         data_length=len_raw_data,  # data length
         timestamp_start=data[1],  # float
@@ -0,0 +1,191 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Writer running in a separate process. Compression and HDF5 I/O do not compete for the GIL
+    with the readout. The raw data is passed through a shared memory ring buffer, only small
+    descriptors (offset, size, meta data) are sent through a queue.
+'''
+
+import logging
+import multiprocessing
+import sys
+import time
+
+import numpy as np
+
+from pytlu.data_writer import create_file_writer
+from pytlu.raw_capture import RawCaptureWriter
+
+try:
+    from multiprocessing import shared_memory  # Python >= 3.8
+except ImportError:
+    shared_memory = None
+
+
+class SharedMemoryRing(object):
+    ''' Ring buffer in shared memory with a single producer and a single consumer.
+
+        The producer keeps track of the produced bytes, the consumer increments the shared
+        counter of consumed bytes. A chunk is never split: if it does not fit before the end
+        of the buffer, the remaining bytes are skipped (padding) and the chunk starts at offset 0.
+    '''
+
+    def __init__(self, size, name=None, consumed=None):
+        if shared_memory is None:
+            raise RuntimeError('Shared memory requires Python >= 3.8')
+        self.size = size
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self._owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self._owner = False
+        self.buffer = np.ndarray((size,), dtype=np.uint8, buffer=self.shm.buf)
+        self.consumed = consumed if consumed is not None else multiprocessing.Value('Q', 0, lock=False)
+        self._produced = 0
+        self._write_pos = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def free(self):
+        return self.size - (self._produced - self.consumed.value)
+
+    def put(self, data, wait=None):
+        ''' Copy data (numpy array) into the ring. Returns (offset, used bytes) or None if the data does
+            not fit into the ring at all. Waits for free space; wait() is called while waiting.
+        '''
+        raw = data.view(np.uint8).ravel()
+        nbytes = raw.shape[0]
+        if nbytes > self.size:
+            return None
+        padding = self.size - self._write_pos if self._write_pos + nbytes > self.size else 0
+        while self.free < padding + nbytes:
+            if wait is not None:
+                wait()
+            time.sleep(0.001)
+        if padding:
+            self._write_pos = 0
+        self.buffer[self._write_pos:self._write_pos + nbytes] = raw
+        offset = self._write_pos
+        self._write_pos += nbytes
+        self._produced += padding + nbytes
+        return offset, padding + nbytes
+
+    def get(self, offset, nbytes, dtype):
+        return self.buffer[offset:offset + nbytes].view(dtype)
+
+    def release(self, used):
+        self.consumed.value += used
+
+    def close(self):
+        del self.buffer
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
+
+
+def _writer_process(filename, data_dtype, meta_data_dtype, writer_kwargs, ring_name, ring_size, consumed, descriptors):
+    ''' Main function of the writer process.
+    '''
+    ring = SharedMemoryRing(size=ring_size, name=ring_name, consumed=consumed)
+    writer = create_file_writer(filename, data_dtype, meta_data_dtype, **writer_kwargs)
+    try:
+        while True:
+            msg = descriptors.get()
+            command = msg[0]
+            if command == 'data':
+                _, offset, nbytes, used, timestamp_start, timestamp_stop, error, skipped_triggers = msg
+                raw_data = ring.get(offset, nbytes, data_dtype)
+                writer.append_readout(raw_data, timestamp_start, timestamp_stop, error, skipped_triggers)
+                del raw_data
+                ring.release(used)
+            elif command == 'inline_data':  # too large for ring
+                writer.append(msg[1])
+            elif command == 'attrs':
+                writer.set_attrs(**msg[1])
+            elif command == 'table':
+                writer.write_table(msg[1], msg[2])
+            elif command == 'append_table':
+                writer.append_table(msg[1], msg[2])
+            elif command == 'close':
+                break
+    finally:
+        writer.close()
+        ring.close()
+
+
+class ProcessWriter(object):
+    ''' Same interface as the writers of data_writer, but the file is written by a separate process.
+    '''
+
+    def __init__(self, filename, data_dtype, meta_data_dtype, ring_size=64 * 1024 * 1024, **writer_kwargs):
+        self.filename = filename
+        self.h5_file = None  # file is owned by the writer process
+        self.ring = SharedMemoryRing(size=ring_size)
+        self.size = 0  # bytes of raw data sent, the file is written later by the writer process
+        self._descriptors = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=_writer_process, name='WriterProcess',
+                                               args=(filename, data_dtype, meta_data_dtype, writer_kwargs,
+                                                     self.ring.name, ring_size, self.ring.consumed, self._descriptors))
+        self.process.daemon = True
+        self.process.start()
+        logging.info('Started writer process (PID %d, %d MB ring buffer)', self.process.pid, ring_size // 1024 // 1024)
+
+    def _check_alive(self):
+        if not self.process.is_alive():
+            raise RuntimeError('Writer process died (exit code %s)' % self.process.exitcode)
+
+    def append(self, data_tuple):
+        self._check_alive()
+        raw_data = np.ascontiguousarray(data_tuple[0])
+        ret = self.ring.put(raw_data, wait=self._check_alive)
+        self.size += raw_data.nbytes
+        if ret is None:
+            self._descriptors.put(('inline_data', tuple(data_tuple[:5])))
+        else:
+            offset, used = ret
+            self._descriptors.put(('data', offset, raw_data.nbytes, used) + tuple(data_tuple[1:5]))
+
+    def set_attrs(self, **attrs):
+        self._descriptors.put(('attrs', attrs))
+
+    def write_table(self, name, data, title=None):
+        self._descriptors.put(('table', name, data))
+
+    def append_table(self, name, data, title=None):
+        self._descriptors.put(('append_table', name, data))
+
+    def close(self, timeout=60.0):
+        if self.process.is_alive():
+            self._descriptors.put(('close',))
+            self.process.join(timeout)
+            if self.process.is_alive():
+                logging.error('Writer process did not finish within %0.1f s, terminating', timeout)
+                self.process.terminate()
+        self.ring.close()
+        self._descriptors.close()
+        if self.process.exitcode:
+            raise RuntimeError('Writer process failed with exit code %d' % self.process.exitcode)
+
+
+def create_writer(filename, data_dtype, meta_data_dtype, process=False, ring_size=64 * 1024 * 1024, **writer_kwargs):
+    ''' Returns the writer of the layout (writer_kwargs) or ProcessWriter (process=True).
+    '''
+    if writer_kwargs.get('layout') == 'raw':  # no compression, nothing to offload
+        if process:
+            logging.info('Raw capture does not use a writer process')
+        return RawCaptureWriter(filename, data_dtype, meta_data_dtype, checkpoint_interval=writer_kwargs.get('checkpoint_interval'))
+    if process:
+        if shared_memory is None:
+            logging.warning('Writer process needs Python >= 3.8 (running %d.%d), using writer thread', *sys.version_info[:2])
+        else:
+            return ProcessWriter(filename, data_dtype, meta_data_dtype, ring_size=ring_size, **writer_kwargs)
+    return create_file_writer(filename, data_dtype, meta_data_dtype, **writer_kwargs)
@@ -0,0 +1,195 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Append-only binary capture of the raw data (no compression, no HDF5 during data taking).
+
+    A capture consists of the files (same base name):
+        <name>.raw: raw data records (data_dtype), preallocated and memory mapped
+        <name>.idx: meta data of the readouts (meta_data_dtype), appended after the raw data of a readout
+        <name>.yaml: data types, attributes (kwargs, config, ...) and names of additional tables
+        <name>.<table>.npy: additional tables (e.g. clock_samples)
+        <name>.<table>.bin: records of the tables appended during the run (e.g. status), data type in <name>.yaml
+
+    The index is written after the raw data, thus after a crash all readouts in the index are complete
+    and other processes can read the capture while it is written (see run_follower).
+    Use pytlu convert to create the HDF5 raw data file.
+'''
+
+import logging
+import mmap
+import os
+import time
+
+import numpy as np
+import yaml
+
+from pytlu.data_writer import dtype_to_yaml, dtype_from_yaml
+
+
+def get_capture_name(filename):
+    ''' Returns the base name of a capture from the file name of any of its files (or the HDF5 file name).
+    '''
+    base, ext = os.path.splitext(filename)
+    return base if ext in ('.raw', '.idx', '.yaml', '.h5') else filename
+
+
+def replace_file(src, dst):
+    ''' Rename src to dst and overwrite dst, atomic on POSIX (os.replace is missing in Python 2).
+    '''
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    else:
+        if os.name == 'nt' and os.path.exists(dst):  # rename does not overwrite on Windows
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+class RawCaptureWriter(object):
+    ''' Same interface as the writers of data_writer, writes a raw capture.
+    '''
+
+    def __init__(self, filename, data_dtype, meta_data_dtype, preallocate=1024 * 1024 * 1024, checkpoint_interval=None):
+        self.name = get_capture_name(filename)
+        self.data_dtype = np.dtype(data_dtype)
+        self.meta_data_dtype = np.dtype(meta_data_dtype)
+        self.preallocate = preallocate - preallocate % mmap.ALLOCATIONGRANULARITY
+        self.n_words = 0
+        self.attrs = {}
+        self.tables = []
+        self.table_dtypes = {}  # tables appended during the run
+        self.closed = False
+        self.checkpoint_interval = checkpoint_interval
+        self._last_checkpoint = time.time()
+
+        self._raw_file = open(self.name + '.raw', 'w+b')
+        self._size = 0
+        self._mmap = None
+        self._resize(self.preallocate)
+        self._position = 0
+        self._idx_file = open(self.name + '.idx', 'wb')
+        self._write_header()
+        logging.info('Capturing raw data to %s.raw (%d MB preallocated)', self.name, self.preallocate // 1024 // 1024)
+
+    def _resize(self, size):
+        if self._mmap is not None:
+            self._mmap.close()
+        self._raw_file.truncate(size)
+        self._size = size
+        self._mmap = mmap.mmap(self._raw_file.fileno(), size)
+
+    def _write_header(self):
+        header = {'data_dtype': dtype_to_yaml(self.data_dtype),
+                  'meta_data_dtype': dtype_to_yaml(self.meta_data_dtype),
+                  'attrs': self.attrs,
+                  'tables': self.tables,
+                  'table_dtypes': self.table_dtypes,
+                  'closed': self.closed}
+        tmp_file = self.name + '.yaml.tmp'
+        with open(tmp_file, 'w') as f:
+            yaml.safe_dump(header, f, default_flow_style=False)
+        replace_file(tmp_file, self.name + '.yaml')  # atomic for readers of a running capture
+
+    @property
+    def size(self):
+        ''' Number of bytes of raw data written.
+        '''
+        return self._position
+
+    def append(self, data_tuple):
+        self.append_readout(data_tuple[0], data_tuple[1], data_tuple[2], data_tuple[3], data_tuple[4])
+
+    def append_readout(self, raw_data, timestamp_start, timestamp_stop, error, skipped_triggers):
+        data = np.ascontiguousarray(raw_data, dtype=self.data_dtype).view(np.uint8)
+        if self._position + data.nbytes > self._size:
+            self._resize(self._size + max(self.preallocate, data.nbytes + mmap.ALLOCATIONGRANULARITY))
+        self._mmap[self._position:self._position + data.nbytes] = data
+        self._position += data.nbytes
+
+        meta_data = np.zeros(1, dtype=self.meta_data_dtype)
+        meta_data['index_start'] = self.n_words
+        self.n_words += raw_data.shape[0]
+        meta_data['index_stop'] = self.n_words
+        meta_data['data_length'] = raw_data.shape[0]
+        meta_data['timestamp_start'] = timestamp_start
+        meta_data['timestamp_stop'] = timestamp_stop
+        meta_data['error'] = error
+        meta_data['skipped_triggers'] = skipped_triggers
+        self._idx_file.write(meta_data.tobytes())
+        self._idx_file.flush()
+        if self.checkpoint_interval is not None and time.time() - self._last_checkpoint >= self.checkpoint_interval:
+            self.checkpoint()
+
+    def checkpoint(self):
+        ''' Write the raw data and the index to disk (survives a power loss).
+        '''
+        self._mmap.flush()
+        os.fsync(self._idx_file.fileno())
+        self._last_checkpoint = time.time()
+
+    def set_attrs(self, **attrs):
+        self.attrs.update(attrs)
+        self._write_header()
+
+    def write_table(self, name, data, title=None):
+        np.save('%s.%s.npy' % (self.name, name), data)
+        if name not in self.tables:
+            self.tables.append(name)
+        self._write_header()
+
+    def append_table(self, name, data, title=None):
+        with open('%s.%s.bin' % (self.name, name), 'ab') as f:
+            f.write(np.ascontiguousarray(data).tobytes())
+        if name not in self.tables:
+            self.tables.append(name)
+            self.table_dtypes[name] = dtype_to_yaml(data.dtype)
+            self._write_header()
+
+    def close(self):
+        self._mmap.flush()
+        self._mmap.close()
+        self._raw_file.truncate(self._position)  # remove preallocated space
+        self._raw_file.close()
+        self._idx_file.close()
+        self.closed = True
+        self._write_header()
+
+
+class RawCaptureReader(object):
+    ''' Reads a raw capture. Raw data and index are memory mapped, only the readouts in the index are used.
+    '''
+
+    def __init__(self, filename):
+        self.name = get_capture_name(filename)
+        with open(self.name + '.yaml', 'r') as f:
+            header = yaml.safe_load(f)
+        self.data_dtype = dtype_from_yaml(header['data_dtype'])
+        self.meta_data_dtype = dtype_from_yaml(header['meta_data_dtype'])
+        self.attrs = header['attrs']
+        self.tables = header['tables']
+        self.table_dtypes = dict((name, dtype_from_yaml(dtype)) for name, dtype in header.get('table_dtypes', {}).items())
+
+        n_readouts = os.path.getsize(self.name + '.idx') // self.meta_data_dtype.itemsize  # ignore incomplete last entry
+        if n_readouts:
+            self.meta_data = np.memmap(self.name + '.idx', dtype=self.meta_data_dtype, mode='r', shape=(n_readouts,))
+        else:
+            self.meta_data = np.zeros(0, dtype=self.meta_data_dtype)
+        self.n_words = int(self.meta_data['index_stop'][-1]) if n_readouts else 0
+        if os.path.getsize(self.name + '.raw') < self.n_words * self.data_dtype.itemsize:
+            raise IOError('Raw data file %s.raw is shorter than its index' % self.name)
+        if self.n_words:
+            self.raw_data = np.memmap(self.name + '.raw', dtype=self.data_dtype, mode='r', shape=(self.n_words,))
+        else:
+            self.raw_data = np.zeros(0, dtype=self.data_dtype)
+
+    def read_table(self, name):
+        if name in self.table_dtypes:
+            with open('%s.%s.bin' % (self.name, name), 'rb') as f:
+                data = f.read()
+            dtype = self.table_dtypes[name]
+            return np.frombuffer(data[:len(data) - len(data) % dtype.itemsize], dtype=dtype)  # ignore incomplete last record
+        return np.load('%s.%s.npy' % (self.name, name))
@@ -0,0 +1,285 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Run journal and recovery of raw data files of runs that did not end properly (crash, power loss).
+
+    At the start of a run the configuration is journaled into <name>_journal.yaml; the journal is marked
+    as finished when the data file is closed. The writers flush the file at checkpoints (--checkpoint_interval).
+
+    pytlu recover <file> scans a damaged raw data file chunk by chunk and writes <name>_recovered.h5:
+        - readouts in meta_data whose raw data is missing are dropped (reported as lost)
+        - raw data records without meta_data are kept, meta_data is rebuilt for them (one readout per
+          chunk, error flag RECOVERED_READOUT, time from the clock model if available)
+        - missing attributes (config, kwargs) are restored from the journal
+    Raw captures (--layout raw) are recovered the same way into the table layout. The .raw file is
+    preallocated, pages that were not written before a crash read as zero: only the leading non-zero
+    records count as stored, index entries pointing beyond them are dropped.
+    meta_data and raw data are processed in blocks, the memory needed does not grow with the run.
+'''
+
+import argparse
+import logging
+import os
+import time
+
+import numpy as np
+import tables as tb
+import yaml
+
+from pytlu.data_writer import create_file_writer, meta_data_dtype
+from pytlu.data_reader import RawDataReader, get_layout, get_data_dtype, get_readout_chunks
+from pytlu.raw_capture import RawCaptureReader, get_capture_name, replace_file
+from pytlu.time_sync import to_host_time
+
+JOURNAL_SUFFIX = '_journal.yaml'
+RECOVERED_READOUT = 0x80000000  # error flag of readouts rebuilt by recover
+
+
+def get_journal_name(filename):
+    return os.path.splitext(filename)[0] + JOURNAL_SUFFIX
+
+
+def write_journal(filename, **entries):
+    ''' Create or update the journal of the run with data file filename.
+    '''
+    journal = load_journal(filename) or {}
+    journal.update(entries)
+    journal_file = get_journal_name(filename)
+    with open(journal_file + '.tmp', 'w') as f:
+        yaml.safe_dump(journal, f, default_flow_style=False)
+        f.flush()
+        os.fsync(f.fileno())
+    replace_file(journal_file + '.tmp', journal_file)
+
+
+def load_journal(filename):
+    ''' Returns the journal (dict) of the run with data file filename or None.
+    '''
+    journal_file = get_journal_name(filename)
+    if not os.path.exists(journal_file):
+        return None
+    with open(journal_file, 'r') as f:
+        return yaml.safe_load(f)
+
+
+def _get_stored_words(h5_file, layout, block_size=100000):
+    ''' Number of raw data records that are actually stored (independent of meta_data).
+    '''
+    if layout == 'table':
+        return h5_file.root.raw_data.nrows
+    if layout == 'column':
+        return min(column.nrows for column in h5_file.root.raw_data_columns)
+    blocks_table, n_bytes = h5_file.root.raw_data_blocks, h5_file.root.raw_data_delta.nrows
+    for stop in range(blocks_table.nrows, 0, -block_size):  # blocks are in file order, search the last complete one
+        blocks = blocks_table.read(max(0, stop - block_size), stop)
+        blocks = blocks[blocks['offset'] + blocks['size'] <= n_bytes]
+        if blocks.shape[0]:
+            return int(blocks['index_start'][-1] + blocks['n_records'][-1])
+    return 0
+
+
+def _get_captured_words(raw_data, block_size=1000000):
+    ''' Number of leading records of a raw capture that were written. Records read as zero (e.g. preallocated
+        pages not written before a crash) are not stored, the TLU never sends records with time stamp 0.
+    '''
+    for start in range(0, raw_data.shape[0], block_size):
+        records = raw_data[start:start + block_size]
+        written = records.view(np.uint8).reshape(records.shape[0], records.dtype.itemsize).any(axis=1)
+        if not written.all():
+            return start + int(np.argmin(written))
+    return raw_data.shape[0]
+
+
+def _valid_readouts(meta_data, n_words, index_start=0):
+    ''' Returns the number of leading readouts with consistent index ranges (the first one starts at index_start)
+        whose raw data is stored.
+    '''
+    if meta_data.shape[0] == 0:
+        return 0
+    index_stop = meta_data['index_stop'].astype(np.int64)
+    expected_start = np.concatenate(([index_start], index_stop[:-1]))
+    valid = (meta_data['index_start'] == expected_start) & (index_stop - expected_start == meta_data['data_length']) & (index_stop <= n_words)
+    return int(np.argmin(valid)) if not valid.all() else meta_data.shape[0]
+
+
+def _scan_meta_data(meta_data, n_words, block_size):
+    ''' Check the meta data (table or array) block by block, see _valid_readouts().
+
+        Returns the number of leading valid readouts, the number of their records and the largest index_stop.
+    '''
+    n_valid, n_words_valid, n_referenced = 0, 0, 0
+    for start in range(0, len(meta_data), block_size):
+        meta_data_block = meta_data[start:start + block_size]
+        n_referenced = max(n_referenced, int(meta_data_block['index_stop'].max()))
+        if n_valid == start:  # all readouts before are valid
+            n_block_valid = _valid_readouts(meta_data_block, n_words, index_start=n_words_valid)
+            if n_block_valid:
+                n_valid += n_block_valid
+                n_words_valid = int(meta_data_block['index_stop'][n_block_valid - 1])
+    return n_valid, n_words_valid, n_referenced
+
+
+def _rebuild_meta_data(read, index_start, index_stop, chunk_size, skipped_triggers, clock_model):
+    ''' Meta data for the records [index_start, index_stop) without meta data, one readout per chunk.
+        read(start, stop) returns the raw data records.
+    '''
+    starts = np.arange(index_start, index_stop, chunk_size, dtype=np.int64)
+    meta_data = np.zeros(starts.shape[0], dtype=meta_data_dtype)
+    meta_data['index_start'] = starts
+    meta_data['index_stop'] = np.minimum(starts + chunk_size, index_stop)
+    meta_data['data_length'] = meta_data['index_stop'] - meta_data['index_start']
+    meta_data['error'] = RECOVERED_READOUT
+    meta_data['skipped_triggers'] = skipped_triggers
+    meta_data['timestamp_start'] = np.nan
+    meta_data['timestamp_stop'] = np.nan
+    if clock_model is not None:
+        for meta in meta_data:
+            meta['timestamp_start'] = to_host_time(read(meta['index_start'], meta['index_start'] + 1)['time_stamp'][0], clock_model)
+            meta['timestamp_stop'] = to_host_time(read(meta['index_stop'] - 1, meta['index_stop'])['time_stamp'][0], clock_model)
+    return meta_data
+
+
+def _append_readouts(writer, read, meta_data, chunk_size):
+    for first, last in get_readout_chunks(meta_data, chunk_size=chunk_size):
+        writer.append_readouts(read(int(meta_data['index_start'][first]), int(meta_data['index_stop'][last - 1])), meta_data[first:last])
+
+
+def _recover_readouts(report, read, meta_data, n_stored, attrs, journal, chunk_size, meta_block_size):
+    ''' Check the meta data (table or array) against the n_stored records, update the report and restore the attributes.
+
+        Returns a generator writing the readouts (valid and rebuilt) with a writer, in blocks of meta_block_size readouts.
+    '''
+    n_valid, n_words_valid, n_referenced = _scan_meta_data(meta_data, n_stored, meta_block_size)
+    report.update({'n_records_stored': n_stored,
+                   'n_readouts_stored': len(meta_data),
+                   'n_readouts_valid': n_valid,
+                   'n_readouts_lost': len(meta_data) - n_valid,
+                   'n_records_lost': max(0, n_referenced - n_stored),  # in meta_data but not stored
+                   'n_records_without_meta_data': n_stored - n_words_valid})
+    if 'checkpoint' in attrs:
+        report['last_checkpoint'] = yaml.safe_load(attrs['checkpoint'])
+
+    restored = []
+    for name in ('config', 'kwargs'):
+        if name not in attrs and journal is not None and name in journal:
+            attrs[name] = journal[name]
+            restored.append(name)
+    report['attrs_restored'] = restored
+
+    clock_model = yaml.safe_load(attrs['clock_model']) if 'clock_model' in attrs else None
+    skipped_triggers = int(meta_data[n_valid - 1]['skipped_triggers']) if n_valid else 0
+    rebuilt = _rebuild_meta_data(read, n_words_valid, n_stored, chunk_size, skipped_triggers, clock_model)
+    report['n_readouts_rebuilt'] = int(rebuilt.shape[0])
+
+    def write_readouts(writer):
+        for start in range(0, n_valid, meta_block_size):
+            _append_readouts(writer, read, meta_data[start:min(start + meta_block_size, n_valid)].astype(meta_data_dtype), chunk_size)
+        _append_readouts(writer, read, rebuilt, chunk_size)
+    return write_readouts
+
+
+def _write_output(output_file, report, write_readouts, data_dtype, layout, filter_data, attrs, tables):
+    ''' Write the recovered file. tables: iterable of (name, data, appended) of the additional tables.
+    '''
+    writer = create_file_writer(output_file, data_dtype, meta_data_dtype, layout=layout, filter_data=filter_data)
+    try:
+        write_readouts(writer)
+        for name, value in attrs.items():
+            if name not in ('layout', 'data_dtype', 'checkpoint'):
+                writer.set_attrs(**{name: value})
+        for name, data, appended in tables:
+            if appended:
+                writer.append_table(name, data)
+            else:
+                writer.write_table(name, data)
+        report['output_file'] = output_file
+        writer.set_attrs(recovery=yaml.safe_dump(dict((key, value) for key, value in report.items() if key != 'last_checkpoint')))
+    finally:
+        writer.close()
+
+
+def _recover_capture(filename, output_file, report, journal, chunk_size, meta_block_size):
+    try:
+        capture = RawCaptureReader(filename)
+    except (IOError, KeyError, TypeError) as e:
+        report['readable'] = False
+        report['error'] = str(e)
+        return report
+    report.update({'readable': True, 'layout': 'raw'})
+    raw_size = os.path.getsize(capture.name + '.raw') // capture.data_dtype.itemsize
+    raw_data = np.memmap(capture.name + '.raw', dtype=capture.data_dtype, mode='r', shape=(raw_size,)) if raw_size else np.zeros(0, dtype=capture.data_dtype)
+    n_stored = _get_captured_words(raw_data, block_size=chunk_size)
+    attrs = dict(capture.attrs)
+    write_readouts = _recover_readouts(report, lambda start, stop: raw_data[start:stop], capture.meta_data, n_stored, attrs, journal,
+                                       chunk_size, meta_block_size)
+    _write_output(output_file, report, write_readouts, capture.data_dtype, 'table', None, attrs,
+                  ((name, capture.read_table(name), name in capture.table_dtypes) for name in capture.tables))
+    return report
+
+
+def recover(filename, output_file=None, chunk_size=1000000, meta_block_size=100000):
+    ''' Scan a raw data file and write the recovered data to output_file. Returns the report (dict).
+
+        The meta data is read in blocks of meta_block_size readouts, the raw data in chunks of about chunk_size records.
+    '''
+    report = {'file': filename}
+    journal = load_journal(filename)
+    report['journal'] = journal is not None
+    if journal is not None:
+        report['run_finished'] = journal.get('finished', False)
+    if output_file is None:
+        output_file = os.path.splitext(filename)[0] + '_recovered.h5'
+
+    if os.path.exists(get_capture_name(filename) + '.raw'):
+        return _recover_capture(filename, output_file, report, journal, chunk_size, meta_block_size)
+
+    try:
+        h5_file = tb.open_file(filename, mode='r')
+    except (IOError, tb.HDF5ExtError) as e:
+        report['readable'] = False
+        report['error'] = str(e)
+        return report
+    report['readable'] = True
+    with h5_file:
+        layout = str(get_layout(h5_file))
+        report['layout'] = layout
+        n_stored = int(_get_stored_words(h5_file, layout))
+        reader = RawDataReader(h5_file, n_words=n_stored)
+        try:
+            meta_data = h5_file.root.meta_data
+            attrs = dict((name, meta_data.attrs[name]) for name in meta_data.attrs._v_attrnamesuser)
+        except tb.NoSuchNodeError:
+            meta_data, attrs = np.zeros(0, dtype=meta_data_dtype), {}
+        write_readouts = _recover_readouts(report, reader.read, meta_data, n_stored, attrs, journal, chunk_size, meta_block_size)
+        filter_data = (h5_file.root.raw_data.filters if layout == 'table' else
+                       h5_file.root.raw_data_delta.filters if layout == 'delta' else h5_file.root.raw_data_columns.time_stamp.filters)
+        tables = ((node.name, node[:], 'appended' in node.attrs) for node in h5_file.root._f_iter_nodes(classname='Table')
+                  if node.name not in ('raw_data', 'meta_data', 'raw_data_blocks', 'raw_data_index'))
+        _write_output(output_file, report, write_readouts, get_data_dtype(h5_file), layout, filter_data, attrs, tables)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pytlu recover', description='Recover the data of a raw data file of a run that did not end properly')
+    parser.add_argument('input_file', type=str, help='Raw data file (HDF5 or raw capture)')
+    parser.add_argument('-o', '--output_file', type=str, default=None, help='Output file. Default=<input>_recovered.h5')
+    parser.add_argument('--chunk_size', type=int, default=1000000, help='Number of records processed at once. Default=1000000')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    report = recover(args.input_file, output_file=args.output_file, chunk_size=args.chunk_size)
+    print(yaml.safe_dump(report, default_flow_style=False))
+    if not report.get('readable', True):
+        logging.error('%s cannot be opened, nothing recovered', args.input_file)
+        return 1
+    logging.info('Recovered %s in %0.1f s', args.input_file, time.time() - start)
+    return 0
+
+
+if __name__ == '__main__':
+    main()
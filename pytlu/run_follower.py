@@ -0,0 +1,199 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Reading the data of a run while it is written.
+
+    PyTables has no single-writer/multiple-reader (SWMR) mode and an HDF5 file must not be read
+    while it is open for writing. The following outputs are safe to read during the run:
+        raw capture (--layout raw): the index entry of a readout is written after its raw data,
+            the follower reads all readouts in the index
+        rotated runs (--rotate_time, --rotate_size): closed segments are complete files, the
+            open segment is followed if it is a raw capture, otherwise read once it is closed
+    A single HDF5 file is read after the run, when its journal (see pytlu.recover) says finished.
+    With HDF5 file locking disabled the file can be opened while it is written, this is not a sign
+    that the run ended. Files without journal are read at once.
+
+    Example (quick look during a run with 10 s segments):
+        for raw_data, timestamp_start, timestamp_stop, error, skipped_triggers in RunFollower('run.h5'):
+            ...
+'''
+
+import logging
+import os
+import time
+
+import numpy as np
+import tables as tb
+import yaml
+
+from pytlu.data_reader import ChunkedReader
+from pytlu.data_writer import dtype_from_yaml
+from pytlu.file_rotation import get_manifest_name, load_manifest
+from pytlu.raw_capture import get_capture_name
+from pytlu.recover import load_journal
+
+
+def _is_capture(filename):
+    return os.path.exists(get_capture_name(filename) + '.yaml')
+
+
+class _CaptureTail(object):
+    ''' Incremental reader of a raw capture that is written. '''
+
+    def __init__(self, filename):
+        self.name = get_capture_name(filename)
+        with open(self.name + '.yaml', 'r') as f:
+            header = yaml.safe_load(f)
+        self.data_dtype = dtype_from_yaml(header['data_dtype'])
+        self.meta_data_dtype = dtype_from_yaml(header['meta_data_dtype'])
+        # Unbuffered, a read ahead buffer would keep outdated content of the preallocated file
+        self._idx_file = open(self.name + '.idx', 'rb', buffering=0)
+        self._raw_file = open(self.name + '.raw', 'rb', buffering=0)
+
+    def is_closed(self):
+        with open(self.name + '.yaml', 'r') as f:
+            return yaml.safe_load(f).get('closed', False)
+
+    def skip(self, n_readouts):
+        self._idx_file.seek(n_readouts * self.meta_data_dtype.itemsize, os.SEEK_CUR)
+
+    def read_new(self, max_readouts=None):
+        ''' Returns the data tuples of the readouts added since the last call (at most max_readouts). '''
+        data = self._idx_file.read(-1 if max_readouts is None else max_readouts * self.meta_data_dtype.itemsize)
+        n_readouts = len(data) // self.meta_data_dtype.itemsize
+        if len(data) % self.meta_data_dtype.itemsize:  # incomplete entry, read again next time
+            self._idx_file.seek(n_readouts * self.meta_data_dtype.itemsize - len(data), os.SEEK_CUR)
+        meta_data = np.frombuffer(data[:n_readouts * self.meta_data_dtype.itemsize], dtype=self.meta_data_dtype)
+        readouts = []
+        for meta in meta_data:
+            self._raw_file.seek(int(meta['index_start']) * self.data_dtype.itemsize)
+            raw_data = np.frombuffer(self._raw_file.read(int(meta['data_length']) * self.data_dtype.itemsize), dtype=self.data_dtype)
+            readouts.append((raw_data, meta['timestamp_start'], meta['timestamp_stop'], meta['error'], meta['skipped_triggers']))
+        return readouts
+
+    def close(self):
+        self._idx_file.close()
+        self._raw_file.close()
+
+
+def read_readouts(filename, first_readout=0, chunk_size=1000000):
+    ''' Generator of the data tuples of the readouts of a complete (closed) raw data file or capture.
+    '''
+    if _is_capture(filename):
+        tail = _CaptureTail(filename)
+        tail.skip(first_readout)
+        try:
+            while True:
+                readouts = tail.read_new(max_readouts=1000)
+                if not readouts:
+                    break
+                for readout in readouts:
+                    yield readout
+        finally:
+            tail.close()
+        return
+    with ChunkedReader(filename, chunk_size=chunk_size) as reader:
+        for readout in reader.readouts(readout_start=first_readout):
+            yield readout
+
+
+class RunFollower(object):
+    ''' Iterator over the readout data tuples (raw_data, timestamp_start, timestamp_stop, error, skipped_triggers)
+        of a run that is written, data is returned as soon as it is safe to read.
+
+        The iteration ends when the run is finished or no new data arrived within timeout seconds (if not None).
+    '''
+
+    def __init__(self, filename, poll_interval=1.0, timeout=None):
+        self.filename = filename
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.n_readouts = 0  # readouts returned
+        self.finished = False
+        self._tail = None
+        self._tail_segment = None
+
+    def _poll_rotated(self):
+        manifest = load_manifest(self.filename)
+        readouts = []
+        for index, segment in enumerate(manifest['segments']):
+            n_returned = self.n_readouts + len(readouts) - segment['readout_start']  # readouts of this segment already returned
+            if segment['closed']:
+                if segment['readout_stop'] - segment['readout_start'] <= n_returned:
+                    continue
+                if self._tail_segment == index:  # followed while open, read the rest
+                    readouts.extend(self._tail.read_new())
+                    self._close_tail()
+                    continue
+                try:
+                    readouts.extend(read_readouts(segment['path'], first_readout=n_returned))
+                except (IOError, tb.HDF5ExtError):  # segment is updated at the end of the run, try again later
+                    return readouts
+            elif _is_capture(segment['path']):  # open segment, always the last one
+                if self._tail_segment != index:
+                    self._close_tail()
+                    self._tail, self._tail_segment = _CaptureTail(segment['path']), index
+                    self._tail.skip(n_returned)
+                readouts.extend(self._tail.read_new())
+        self.finished = manifest.get('finished', False)
+        return readouts
+
+    def _poll_capture(self):
+        if self._tail is None:
+            self._tail = _CaptureTail(self.filename)
+        closed = self._tail.is_closed()  # check before reading, no data is missed
+        readouts = self._tail.read_new()
+        self.finished = closed
+        return readouts
+
+    def _poll_file(self):
+        if not os.path.exists(self.filename):
+            return []
+        journal = load_journal(self.filename)
+        if journal is not None and not journal.get('finished', False):  # run is still written
+            return []
+        try:
+            readouts = list(read_readouts(self.filename, first_readout=self.n_readouts))
+        except (IOError, tb.HDF5ExtError):  # file is still written
+            return []
+        self.finished = True
+        return readouts
+
+    def poll(self):
+        ''' Returns the readouts that became available since the last call. '''
+        if os.path.exists(get_manifest_name(self.filename)):
+            readouts = self._poll_rotated()
+        elif _is_capture(self.filename):
+            readouts = self._poll_capture()
+        else:
+            readouts = self._poll_file()
+        self.n_readouts += len(readouts)
+        return readouts
+
+    def _close_tail(self):
+        if self._tail is not None:
+            self._tail.close()
+        self._tail, self._tail_segment = None, None
+
+    def __iter__(self):
+        last_data = time.time()
+        try:
+            while True:
+                readouts = self.poll()
+                for readout in readouts:
+                    yield readout
+                if readouts:
+                    last_data = time.time()
+                if self.finished:
+                    break
+                if self.timeout is not None and time.time() - last_data > self.timeout:
+                    logging.warning('No new data in %s within %0.1f s', self.filename, self.timeout)
+                    break
+                time.sleep(self.poll_interval)
+        finally:
+            self._close_tail()
@@ -0,0 +1,65 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Software scalers of the trigger inputs CH0..CH3.
+
+    The TLU has no input counters that can be read, the scalers count the accepted triggers with a leading
+    edge on the input (le0..le3 > 0, see fine_time) per readout. Inputs that fire without a coincidence
+    are not counted.
+'''
+
+import threading
+import time
+
+import numpy as np
+
+from pytlu.fine_time import N_INPUTS
+
+
+def get_scalers(raw_data):
+    ''' Returns the number of records with a leading edge on every input (int64 array).
+    '''
+    return np.array([np.count_nonzero(raw_data['le%d' % i]) for i in range(N_INPUTS)], dtype=np.int64)
+
+
+class InputScalers(object):
+    ''' Accumulated input scalers, add() is called per readout from the readout threads.
+
+        interval: minimum time in seconds between updates of the EUDAQ scaler string
+    '''
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counts = np.zeros(N_INPUTS, dtype=np.int64)
+            self._published = (0.0, self._format(self._counts))
+
+    def add(self, raw_data):
+        scalers = get_scalers(raw_data)
+        with self._lock:
+            self._counts += scalers
+
+    @property
+    def counts(self):
+        with self._lock:
+            return self._counts.copy()
+
+    def _format(self, counts):
+        return ', '.join('%d' % count for count in counts)
+
+    def get_eudaq_string(self):
+        ''' Returns the scalers in the format of EUDAQ (SendEventExtraInfo), updated at most every interval seconds.
+        '''
+        now = time.time()
+        if now - self._published[0] >= self.interval:
+            self._published = (now, self._format(self.counts))
+        return self._published[1]
@@ -0,0 +1,145 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Host time and correlation of the host clock with the TLU time stamp (40 MHz).
+'''
+
+import logging
+from time import time
+from threading import Lock
+try:
+    from time import monotonic  # Python3
+except ImportError:
+    from time import time as monotonic  # Python2
+
+import numpy as np
+import yaml
+
+FPGA_CLOCK = 40e6  # Hz, clock of the TLU time stamp
+
+clock_sample_dtype = np.dtype([('host_time', 'f8'), ('time_stamp', 'u8'), ('uncertainty', 'f8')])
+
+
+class HostClock(object):
+    ''' Monotonic host clock anchored to the wall clock (UNIX time) at creation.
+
+        The returned time is not affected by steps of the system time (e.g. NTP adjustments).
+    '''
+
+    def __init__(self):
+        self.offset = time() - monotonic()
+
+    def __call__(self):
+        return monotonic() + self.offset
+
+
+class ClockCorrelation(object):
+    ''' Linear model of the host time as function of the TLU time stamp.
+
+        The model is host_time = host_time_ref + (time_stamp - time_stamp_ref) / frequency
+        and is fitted (weighted least squares) to pairs of host time and TLU time stamp.
+    '''
+
+    def __init__(self, max_samples=100000):
+        self.max_samples = max_samples
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._samples = []
+            self._parameters = None
+
+    @property
+    def samples(self):
+        with self._lock:
+            return np.array(self._samples, dtype=clock_sample_dtype)
+
+    def add_sample(self, host_time, time_stamp, uncertainty):
+        with self._lock:
+            if len(self._samples) >= self.max_samples:
+                del self._samples[1::2]  # thin out, keep the full time range
+            self._samples.append((host_time, time_stamp, uncertainty))
+            self._parameters = None
+
+    def sample(self, read_time_stamp, host_clock):
+        ''' Take a sample by reading the TLU time stamp with the given function.
+
+            The TLU latches the 64-bit time stamp when reading its first byte, i.e.
+            during the first of the 8 single byte register reads.
+        '''
+        t_before = host_clock()
+        time_stamp = read_time_stamp()
+        t_after = host_clock()
+        latch_window = (t_after - t_before) / 8.0
+        self.add_sample(host_time=t_before + latch_window / 2.0, time_stamp=time_stamp, uncertainty=latch_window / 2.0)
+        return time_stamp
+
+    def fit(self):
+        ''' Fit the clock model. Returns dict with the model parameters.
+        '''
+        samples = self.samples
+        if samples.shape[0] == 0:
+            return None
+        time_stamp_ref = int(samples['time_stamp'][0])
+        host_time_ref = samples['host_time'][0]
+        if samples.shape[0] == 1:
+            frequency, residual_rms = FPGA_CLOCK, 0.0
+        else:
+            x = (samples['time_stamp'] - time_stamp_ref).astype(np.float64)
+            y = samples['host_time'] - host_time_ref
+            w = 1.0 / np.maximum(samples['uncertainty'], 1e-6)
+            slope, offset = np.polyfit(x, y, deg=1, w=w)
+            host_time_ref += offset
+            frequency = 1.0 / slope
+            residual_rms = float(np.sqrt(np.mean((y - (offset + slope * x)) ** 2)))
+        parameters = {'time_stamp_ref': time_stamp_ref,
+                      'host_time_ref': float(host_time_ref),
+                      'frequency': float(frequency),
+                      'residual_rms': residual_rms,
+                      'n_samples': int(samples.shape[0])}
+        with self._lock:
+            self._parameters = parameters
+        return parameters
+
+    def get_parameters(self):
+        with self._lock:
+            parameters = self._parameters
+        if parameters is None:
+            parameters = self.fit()
+        return parameters
+
+    def to_host_time(self, time_stamp):
+        return to_host_time(time_stamp, self.get_parameters())
+
+
+def to_host_time(time_stamp, parameters):
+    ''' Convert TLU time stamps (e.g. raw_data['time_stamp']) to host time (UNIX time in s).
+
+        Parameters
+        ----------
+        time_stamp : int, numpy.ndarray
+            TLU time stamp(s) in units of 25 ns.
+        parameters : dict
+            Clock model parameters from ClockCorrelation.fit() (or load_clock_model()).
+    '''
+    if parameters is None:
+        raise ValueError('No clock model available')
+    # Subtract as integers to not lose precision of the 64-bit time stamp
+    delta = np.asarray(time_stamp, dtype=np.uint64).astype(np.int64) - np.int64(parameters['time_stamp_ref'])
+    return parameters['host_time_ref'] + delta / parameters['frequency']
+
+
+def load_clock_model(h5_file):
+    ''' Returns the clock model parameters stored in a pytlu raw data file (opened tables.File) or None.
+    '''
+    try:
+        return yaml.safe_load(h5_file.root.meta_data.attrs.clock_model)
+    except AttributeError:
+        logging.warning('No clock model in %s', h5_file.filename)
+        return None
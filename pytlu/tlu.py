@@ -11,7 +11,10 @@ import sys
 import time
 import argparse
 import signal
+import threading
+import importlib
 from contextlib import contextmanager
+from collections import OrderedDict
 
 import yaml
 import tables as tb
@@ -20,6 +23,14 @@ import numpy as np
 from basil.dut import Dut
 
 from pytlu.fifo_readout import FifoReadout
+from pytlu.data_writer import RawDataWriter, meta_data_dtype, create_filters, add_storage_arguments, check_storage_arguments
+from pytlu.process_writer import create_writer
+from pytlu.file_rotation import RotatingWriter
+from pytlu.recover import write_journal
+from pytlu.data_index import index_file
+from pytlu.catalogue import update_catalogue
+from pytlu.data_stream import DataStream
+from pytlu.scalers import InputScalers
 from pytlu.online_monitor import pytlu_sender
 
 root_logger = logging.getLogger()
@@ -31,6 +42,18 @@ stop_run = False
 input_ch = ['CH0', 'CH1', 'CH2', 'CH3']
 output_ch = ['CH0', 'CH1', 'CH2', 'CH3', 'CH4', 'CH5', 'LEMO0', 'LEMO1', 'LEMO2', 'LEMO3']
 
+# Tools working on raw data files: pytlu <tool> [arguments], module or module:function (default main)
+tools = {'benchmark': 'pytlu.benchmark',
+         'convert': 'pytlu.convert',
+         'recover': 'pytlu.recover',
+         'index': 'pytlu.data_index',
+         'analyze': 'pytlu.analysis',
+         'events': 'pytlu.event_builder',
+         'merge': 'pytlu.merge',
+         'slice': 'pytlu.merge:main_slice',
+         'export': 'pytlu.export',
+         'catalogue': 'pytlu.catalogue'}
+
 
 def handle_sig(signum, frame):
     logging.info('Pressed Ctrl-C')
@@ -76,6 +99,21 @@ def parse_arguments(eudaq=False):
                         help="Address for online monitor wait for DUT. Default=disabled, Example=tcp://127.0.0.1:5550")
     parser.add_argument('--scan_time', type=int, default=0,
                         help="Scan time in seconds. Default=disabled, disable=0")
+    parser.add_argument('--writer_process', action='store_true',
+                        help="Compress and write data in a separate process (data is passed via shared memory)")
+    parser.add_argument('--writer_buffer', type=int, default=64,
+                        help="Size of the shared memory buffer of the writer process in MB. Default=64")
+    add_storage_arguments(parser, layouts=['table', 'delta', 'column', 'raw'])
+    parser.add_argument('--rotate_size', type=int, default=None,
+                        help="Start a new data file (segment) when the current one exceeds this size in MB. Default=disabled", metavar='1...n')
+    parser.add_argument('--rotate_time', type=float, default=None,
+                        help="Start a new data file (segment) after this time in s. Default=disabled", metavar='1...n')
+    parser.add_argument('--checkpoint_interval', type=float, default=10.0,
+                        help="Flush the data file to disk every this many seconds (crash safety, see pytlu recover). Default=10")
+    parser.add_argument('--index', action='store_true',
+                        help="Create indexes on trigger_id and time_stamp when a data file (segment) is closed, see pytlu index")
+    parser.add_argument('--status_interval', type=float, default=1.0,
+                        help="Sampling interval of the TLU status (status table of the data file) in s. Default=1", metavar='0.01...n')
 
     if eudaq:
         # additional EUDAQ related arguments
@@ -89,13 +127,16 @@ def parse_arguments(eudaq=False):
                             help='Raw data file to replay for testing')
         parser.add_argument('--delay', type=float,
                             help='Additional delay when replaying data in seconds')
+        parser.add_argument('--scaler_interval', type=float, default=1.0,
+                            help='Update interval of the input scalers sent to EUDAQ in s. Default=1')
 
     args = parser.parse_args()
+    check_storage_arguments(parser, args)
 
     return args
 
 
-def print_log(trg_rate, trg_rate_acc, trg_number, skipped_trigger, timeout_counter, tx_state):
+def print_log(trg_rate, trg_rate_acc, trg_number, skipped_trigger, timeout_counter, tx_state, subscriber_status=None, scalers=None):
         '''
         Print logging message.
 
@@ -105,9 +146,26 @@ def print_log(trg_rate, trg_rate_acc, trg_number, skipped_trigger, timeout_count
                 Trigger rate on scintillator inputs
             trg_rate_acc: float
                 Real trigger rate (rate of triggers accepted by DUTs)
+            subscriber_status: dict
+                Lag (readouts, seconds) of the data subscribers, see FifoReadout.get_subscriber_status()
+            scalers: iterable
+                Software input scalers CH0..CH3
         '''
-        logging.info("Trigger: %8d | Skip: %8d | Timeout: %2d | Rate: %.2f (%.2f) Hz | TxState: %06x" % (
-            trg_number, skipped_trigger, timeout_counter, trg_rate_acc, trg_rate, tx_state))
+        lag = ''
+        if subscriber_status:
+            lag = " | Lag: " + ", ".join(["%s %d (%.1fs)" % (name, n_readouts, lag_time) for name, (n_readouts, lag_time) in subscriber_status.items()])
+        if scalers is not None:
+            lag = " | Scalers: " + ", ".join("%d" % count for count in scalers) + lag
+        logging.info("Trigger: %8d | Skip: %8d | Timeout: %2d | Rate: %.2f (%.2f) Hz | TxState: %06x%s" % (
+            trg_number, skipped_trigger, timeout_counter, trg_rate_acc, trg_rate, tx_state, lag))
+
+
+def log_status(status, subscriber_status=None):
+    ''' Print logging message of a status record (see Tlu.read_status()).
+    '''
+    tx_state = sum(int(dut_state) << (4 * i) for i, dut_state in enumerate(status['tx_state']))
+    print_log(status['trigger_rate'], status['accepted_trigger_rate'], status['trigger_id'], status['skipped_triggers'],
+              status['timeout_counter'], tx_state, subscriber_status, status['scalers'])
 
 
 def create_configuration(args):
@@ -117,26 +175,66 @@ def create_configuration(args):
     return config
 
 
+def create_writer_configuration(config):
+    ''' Returns the data writer settings from the configuration dict as keyword arguments of Tlu.
+    '''
+    return {'writer_process': config['writer_process'],
+            'writer_buffer': config['writer_buffer'],
+            'filter_data': create_filters(complib=config['complib'], complevel=config['complevel'], shuffle=config['shuffle']),
+            'chunkshape': config['chunkshape'],
+            'layout': config['layout'],
+            'rotate_size': config['rotate_size'] * 1024 * 1024 if config['rotate_size'] else None,
+            'rotate_time': config['rotate_time'],
+            'checkpoint_interval': config['checkpoint_interval'],
+            'index_data': config['index']}
+
+
 class Tlu(Dut):
     I2C_MUX = {'DISPLAY': 0, 'LEMO': 1, 'HDMI': 2, 'MB': 3}
     I2C_ADDR = {'LED': 0x40, 'TRIGGER_EN': 0x42, 'RESET_EN': 0x44, 'IPSEL': 0x46}
     PCA9555 = {'DIR': 6, 'OUT': 2}
     IP_SEL = {'RJ45': 0b11, 'LEMO': 0b10}
 
-    def __init__(self, conf=None, output_folder=None, log_file=None, data_file=None, monitor_addr=None):
+    def __init__(self, conf=None, output_folder=None, log_file=None, data_file=None, monitor_addr=None, writer_process=False, writer_buffer=64,
+                 filter_data=None, chunkshape=None, layout='table', rotate_size=None, rotate_time=None, checkpoint_interval=10.0,
+                 index_data=False):
         if conf is None:
             conf = os.path.dirname(os.path.abspath(__file__)) + os.sep + "tlu.yaml"
         logging.info("Loading configuration file from %s" % conf)
 
         self.data_dtype = np.dtype([('le0', 'u1'), ('le1', 'u1'), ('le2', 'u1'),
                                     ('le3', 'u1'), ('time_stamp', 'u8'), ('trigger_id', 'u4')])
-        self.meta_data_dtype = np.dtype([('index_start', 'u4'), ('index_stop', 'u4'), ('data_length', 'u4'),
-                                         ('timestamp_start', 'f8'), ('timestamp_stop', 'f8'), ('error', 'u4'),
-                                         ('skipped_triggers', 'u8')])
+        self.meta_data_dtype = meta_data_dtype
+        # TLU status sampled during the run (trigger rates in Hz since the previous sample, TX state of the 6 outputs,
+        # software input scalers of CH0..CH3 since the start)
+        self.status_dtype = np.dtype([('timestamp', 'f8'), ('time_stamp', 'u8'), ('trigger_id', 'u4'), ('skipped_triggers', 'u4'),
+                                      ('trigger_rate', 'f8'), ('accepted_trigger_rate', 'f8'), ('timeout_counter', 'u1'),
+                                      ('lost_data_counter', 'u1'), ('tx_state', 'u1', (6,)), ('scalers', 'u8', (4,))])
+        self.last_status = None  # previous status sample, the samples are stored in the data file (see read_status())
+        self.scalers = InputScalers()
 
         self.run_name = time.strftime("%Y%m%d_%H%M%S_tlu")
         self.output_filename = self.run_name
         self._first_read = False
+        self.writer = None
+        self._writer_lock = threading.Lock()  # data (hdf5 subscriber thread) and status samples (main thread) share the writer
+        self.h5_file, self.data_table, self.meta_data_table = None, None, None  # only set if the file is written by this process
+        self.writer_process = writer_process
+        self.writer_buffer = writer_buffer
+        self.filter_data = filter_data if filter_data is not None else tb.Filters(complib='blosc', complevel=5)
+        self.filter_tables = tb.Filters(complib='zlib', complevel=5)
+        self.chunkshape = chunkshape
+        self.layout = layout
+        self.rotate_size = rotate_size
+        self.rotate_time = rotate_time
+        self.checkpoint_interval = checkpoint_interval
+        self.index_data = index_data
+        self._streams = []
+        # Consumers of the readout data, each with its own queue and thread: name -> (callback, max. queue size)
+        self.subscribers = OrderedDict([('hdf5', (self.store_data, 0)),
+                                        ('monitor', (self.send_monitor_data, 100)),
+                                        ('stream', (self.send_stream_data, 0)),
+                                        ('scalers', (self.count_scalers, 0))])
 
         if output_folder:
             self.output_folder = output_folder
@@ -260,19 +358,28 @@ class Tlu(Dut):
     @contextmanager
     def readout(self, *args, **kwargs):
         if not self._first_read:
-            self.filter_data = tb.Filters(complib='blosc', complevel=5)
-            self.filter_tables = tb.Filters(complib='zlib', complevel=5)
-            self.h5_file = tb.open_file(self.data_file, mode='w', title='TLU')
-            self.data_table = self.h5_file.create_table(self.h5_file.root, name='raw_data', description=self.data_dtype, title='data', filters=self.filter_data)
-            self.meta_data_table = self.h5_file.create_table(self.h5_file.root, name='meta_data', description=self.meta_data_dtype, title='meta_data', filters=self.filter_tables)
-            self.meta_data_table.attrs.kwargs = yaml.dump(kwargs)
+            if self.rotate_size or self.rotate_time:
+                self.writer = RotatingWriter(self.data_file, create_writer=self.create_writer, max_size=self.rotate_size, max_duration=self.rotate_time,
+                                             segment_closed=index_file if self.index_data else None)
+            else:
+                self.writer = self.create_writer(self.data_file)
+            if isinstance(self.writer, RawDataWriter):
+                self.h5_file, self.data_table, self.meta_data_table = self.writer.h5_file, self.writer.data_table, self.writer.meta_data_table
+            # Journal the configuration at the start, it is not lost if the run does not end properly
+            config = yaml.dump(self.get_configuration())
+            self.writer.set_attrs(kwargs=yaml.dump(kwargs), config=config)
+            write_journal(self.data_file, data_file=os.path.basename(self.data_file), start_time=time.time(), finished=False,
+                          kwargs=yaml.dump(kwargs), config=config, layout=self.layout)
 
             self.fifo_readout = FifoReadout(self)
             self.fifo_readout.print_readout_status()
             self._first_read = True
+            if hasattr(self['intf'], 'reset_transfer_stats'):
+                self['intf'].reset_transfer_stats()  # only count transfers of the run
 
-        self.fifo_readout.start(callback=self.handle_data,
-                                errback=self.handle_err)
+        for name, (callback, maxsize) in self.subscribers.items():
+            self.fifo_readout.add_subscriber(name, callback, maxsize=maxsize)
+        self.fifo_readout.start(errback=self.handle_err)
         try:
             yield
         finally:
@@ -281,13 +388,116 @@ class Tlu(Dut):
             except Exception:
                 self.fifo_readout.stop(timeout=0.0)
             self.fifo_readout.print_readout_status()
-            self.meta_data_table.attrs.config = yaml.dump(self.get_configuration())
+            for stream in list(self._streams):
+                stream.stop()
+            del self._streams[:]
+            self.writer.set_attrs(config=yaml.dump(self.get_configuration()))
+            self.store_clock_model()
+            if hasattr(self['intf'], 'get_transfer_stats'):
+                self.writer.set_attrs(transfer_stats=yaml.dump(self['intf'].get_transfer_stats()))
+
+    def create_writer(self, filename):
+        ''' Returns a writer of a new data file with the storage settings of the TLU.
+        '''
+        return create_writer(filename, self.data_dtype, self.meta_data_dtype, process=self.writer_process,
+                             ring_size=self.writer_buffer * 1024 * 1024, filter_data=self.filter_data, filter_tables=self.filter_tables,
+                             chunkshape=self.chunkshape, layout=self.layout, checkpoint_interval=self.checkpoint_interval)
 
-    def close(self):
+    def add_subscriber(self, name, callback, maxsize=0):
+        ''' Add a consumer of the readout data tuples
+            (raw_data, timestamp_start, timestamp_stop, error, skipped_triggers).
+
+            Each subscriber is called from its own thread with its own queue, thus a slow subscriber
+            does not delay the others. With maxsize > 0 readouts are dropped if the queue is full.
+        '''
+        self.subscribers[name] = (callback, maxsize)
+        if self._first_read and self.fifo_readout.is_running:
+            self.fifo_readout.add_subscriber(name, callback, maxsize=maxsize)
+
+    def remove_subscriber(self, name):
+        del self.subscribers[name]
+        if self._first_read and name in self.fifo_readout.get_subscriber_status():
+            self.fifo_readout.remove_subscriber(name)
+
+    def stream(self, maxsize=1000, timeout=None):
+        ''' Returns a blocking iterator over the readout data tuples
+            (raw_data, timestamp_start, timestamp_stop, error, skipped_triggers).
+
+            Example:
+                with chip.readout():
+                    with chip.stream(timeout=10) as stream:
+                        for data_tuple in stream:
+                            ...
+
+            Parameters
+            ----------
+            maxsize : int
+                Maximum number of buffered readouts. If the consumer is slower, readouts are dropped.
+            timeout : float
+                Stop iteration if no data is received within timeout seconds. None waits forever.
+                The iteration also ends when the readout stops or the stream is closed.
+        '''
+        data_stream = DataStream(maxsize=maxsize, timeout=timeout, on_close=self._remove_stream)
+        self._streams.append(data_stream)
+        return data_stream
+
+    def astream(self, maxsize=1000, timeout=None, loop=None):
+        ''' Same as stream() but returns an asyncio iterator (async for).
+            Has to be called from within the event loop that consumes the data.
+        '''
+        from pytlu.async_data_stream import AsyncDataStream  # Python 3 only
+        data_stream = AsyncDataStream(maxsize=maxsize, timeout=timeout, on_close=self._remove_stream, loop=loop)
+        self._streams.append(data_stream)
+        return data_stream
+
+    def _remove_stream(self, data_stream):
         try:
-            self.h5_file.close()
-        except Exception:
+            self._streams.remove(data_stream)
+        except ValueError:
             pass
+
+    def store_clock_model(self):
+        ''' Store the host <-> TLU clock correlation (samples and fit) in the data file.
+        '''
+        clock = self.fifo_readout.clock
+        self.writer.write_table('clock_samples', clock.samples)
+        self.writer.set_attrs(host_clock_offset=self.fifo_readout.host_clock.offset,
+                              clock_model=yaml.dump(clock.get_parameters()))
+
+    def read_status(self):
+        ''' Read the status of the TLU (one register access) and append it to the status table of the data file
+            (if the data file is open, in rotated runs to the current segment).
+
+            Returns the status record, the trigger rates are calculated since the previous call.
+        '''
+        registers = self['tlu_master'].get_status()
+        status = np.zeros(1, dtype=self.status_dtype)
+        status['timestamp'] = time.time()
+        for name in ('time_stamp', 'trigger_id', 'skipped_triggers', 'timeout_counter', 'lost_data_counter'):
+            status[name] = registers[name]
+        status['tx_state'] = [(registers['tx_state'] >> (4 * i)) & 0xF for i in range(6)]
+        status['scalers'] = self.scalers.counts
+        previous = self.last_status
+        if previous is not None:
+            interval = status['timestamp'][0] - previous['timestamp']
+            triggers = (int(status['trigger_id'][0]) - int(previous['trigger_id'])) % 2 ** 32
+            skipped_triggers = (int(status['skipped_triggers'][0]) - int(previous['skipped_triggers'])) % 2 ** 32
+            status['accepted_trigger_rate'] = triggers / interval
+            status['trigger_rate'] = (triggers + skipped_triggers) / interval
+        if self.writer is not None:
+            with self._writer_lock:
+                self.writer.append_table('status', status)
+        self.last_status = status[0]
+        return self.last_status
+
+    def close(self):
+        if self.writer is not None:
+            self.close_data_file()
+        else:
+            try:
+                self.h5_file.close()
+            except Exception:
+                pass
         # close socket
         if self.socket is not None:
             try:
@@ -296,30 +506,47 @@ class Tlu(Dut):
                 pass
         super(Tlu, self).close()
 
+    def close_data_file(self):
+        ''' Close the data file. The run is marked as finished in the journal only if all data was written,
+            otherwise the file has to be recovered (pytlu recover). Index and catalogue entry are created afterwards.
+        '''
+        try:
+            self.writer.close()
+        except Exception:
+            self.logger.exception('Closing %s failed, the run is not marked as finished, use pytlu recover', self.data_file)
+            return
+        try:
+            write_journal(self.data_file, finished=True, stop_time=time.time())
+        except Exception:
+            self.logger.exception('Writing the journal of %s failed', self.data_file)
+        if self.index_data and not isinstance(self.writer, RotatingWriter):  # segments are indexed when closed
+            try:
+                index_file(self.data_file)
+            except Exception:
+                self.logger.exception('Indexing %s failed, use pytlu index', self.data_file)
+        update_catalogue(self.data_file)
+
     def handle_data(self, data_tuple):
-        '''Handling of the data.
+        '''Handling of the data: calls all subscribers one after the other.
+        During readout the subscribers are called from their own threads instead.
         '''
+        for callback, _ in list(self.subscribers.values()):
+            callback(data_tuple)
 
-        total_words = self.data_table.nrows
-        self.data_table.append(data_tuple[0])
-        self.data_table.flush()
-
-        len_raw_data = data_tuple[0].shape[0]
-        self.meta_data_table.row['timestamp_start'] = data_tuple[1]
-        self.meta_data_table.row['timestamp_stop'] = data_tuple[2]
-        self.meta_data_table.row['error'] = data_tuple[3]
-        self.meta_data_table.row['skipped_triggers'] = data_tuple[4]
-        self.meta_data_table.row['data_length'] = len_raw_data
-        self.meta_data_table.row['index_start'] = total_words
-        total_words += len_raw_data
-        self.meta_data_table.row['index_stop'] = total_words
-        self.meta_data_table.row.append()
-        self.meta_data_table.flush()
-
-        # sending data to online monitor
+    def store_data(self, data_tuple):
+        '''Store data in HDF5 file.
+        '''
+        if self.writer is None:  # tables were created by the caller
+            self.writer = RawDataWriter(self.h5_file, self.data_table, self.meta_data_table)
+        with self._writer_lock:
+            self.writer.append(data_tuple)
+
+    def send_monitor_data(self, data_tuple):
+        '''Sending data to online monitor.
+        '''
         if self.socket is not None:
             try:
-                pytlu_sender.send_data(self.socket, data_tuple, len_raw_data)
+                pytlu_sender.send_data(self.socket, data_tuple, data_tuple[0].shape[0])
             except Exception:
                 self.logger.warning('online_monitor.pytlu_sender.send_data failed %s' % str(sys.exc_info()))
                 try:
@@ -328,6 +555,17 @@ class Tlu(Dut):
                     pass
                 self.socket = None
 
+    def send_stream_data(self, data_tuple):
+        '''Sending data to consumers of stream() and astream().
+        '''
+        for data_stream in list(self._streams):
+            data_stream.put(data_tuple)
+
+    def count_scalers(self, data_tuple):
+        '''Counting the leading edges of the inputs (software scalers).
+        '''
+        self.scalers.add(data_tuple[0])
+
     def handle_err(self, exc):
         self.logger.warning(exc[1].__class__.__name__ + ": " + str(exc[1]))
 
@@ -382,20 +620,23 @@ class Tlu(Dut):
 
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] in tools:
+        module, _, function = tools[sys.argv[1]].partition(':')
+        return getattr(importlib.import_module(module), function or 'main')(sys.argv[2:])
+
     # Parse arguments
     args = parse_arguments()
 
     # Create configuration dict
     config = create_configuration(args)
 
-    chip = Tlu(output_folder=config['output_folder'], log_file=config['log_file'], data_file=config['data_file'], monitor_addr=config['monitor_addr'])
+    chip = Tlu(output_folder=config['output_folder'], log_file=config['log_file'], data_file=config['data_file'], monitor_addr=config['monitor_addr'],
+               **create_writer_configuration(config))
     chip.init()
 
     in_en, _ = chip.configure(config)
 
-    start_time = 0
-    trigger_id_start = 0
-    skipped_triggers_start = 0
+    last_log = 0
 
     logging.info("Starting... Press Ctrl+C to exit...")
     signal.signal(signal.SIGINT, handle_sig)
@@ -404,19 +645,11 @@ def main():
         with chip.readout():
             chip['test_pulser'].START  # Start test pulser
             while not chip['test_pulser'].is_ready and not stop_run:
-                # Calculate parameter for logging output
-                actual_time = time.time()
-                actual_trigger_id = chip['tlu_master'].TRIGGER_ID
-                actual_skipped_triggers = chip['tlu_master'].SKIP_TRIG_COUNTER
-                trg_rate_acc = (actual_trigger_id - trigger_id_start) / (actual_time - start_time)
-                trg_rate = trg_rate_acc + (actual_skipped_triggers - skipped_triggers_start) / (actual_time - start_time)
-                timeout_counter = chip['tlu_master'].TIMEOUT_COUNTER
-                tx_state = chip['tlu_master'].TX_STATE
-                start_time = actual_time
-                trigger_id_start = actual_trigger_id
-                skipped_triggers_start = actual_skipped_triggers
-                print_log(trg_rate, trg_rate_acc, actual_trigger_id, actual_skipped_triggers, timeout_counter, tx_state)
-                time.sleep(1)
+                status = chip.read_status()
+                if status['timestamp'] - last_log >= 1.0:  # log at most once per second
+                    log_status(status, chip.fifo_readout.get_subscriber_status())
+                    last_log = status['timestamp']
+                time.sleep(config['status_interval'])
             # reset pulser in case of abort
             chip['test_pulser'].RESET
     else:
@@ -424,19 +657,11 @@ def main():
         with chip.readout():
             chip['tlu_master'].EN_INPUT = in_en  # Enable inputs
             while not stop_run:
-                # Calculate parameter for logging output
-                actual_time = time.time()
-                actual_trigger_id = chip['tlu_master'].TRIGGER_ID
-                actual_skipped_triggers = chip['tlu_master'].SKIP_TRIG_COUNTER
-                trg_rate_acc = (actual_trigger_id - trigger_id_start) / (actual_time - start_time)
-                trg_rate = trg_rate_acc + (actual_skipped_triggers - skipped_triggers_start) / (actual_time - start_time)
-                timeout_counter = chip['tlu_master'].TIMEOUT_COUNTER
-                tx_state = chip['tlu_master'].TX_STATE
-                start_time = actual_time
-                trigger_id_start = actual_trigger_id
-                skipped_triggers_start = actual_skipped_triggers
-                print_log(trg_rate, trg_rate_acc, actual_trigger_id, actual_skipped_triggers, timeout_counter, tx_state)
-                time.sleep(1)
+                status = chip.read_status()
+                if status['timestamp'] - last_log >= 1.0:  # log at most once per second
+                    log_status(status, chip.fifo_readout.get_subscriber_status())
+                    last_log = status['timestamp']
+                time.sleep(config['status_interval'])
 
     # close and disable inputs and outputs
     chip['tlu_master'].EN_INPUT = 0
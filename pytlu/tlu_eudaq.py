@@ -14,12 +14,14 @@ import time
 import sys
 
 import numpy as np
-import tables as tb
 from tqdm import tqdm
 import yaml
 import logging
 from pytlu.tlu import Tlu
 from pytlu import tlu
+from pytlu.data_reader import ChunkedReader
+from pytlu.trigger_id import TriggerIdTracker
+from pytlu.scalers import InputScalers
 
 root_logger = logging.getLogger()
 root_logger.setLevel(logging.DEBUG)
@@ -33,60 +35,54 @@ class EudaqScan(Tlu):
         '''
 
         self.callback = fun
-        self.last_trigger_number = -1
+        self.trigger_ids = TriggerIdTracker(last_trigger_id=-1)  # first trigger number is 0
         self.event_counter = 0  # FIXME: Start at 0 or 1?
+        self.eudaq_scalers = self.scalers.get_eudaq_string()  # input scalers sent with the events of the readout
+        if 'scalers' in self.subscribers:  # counted in send_eudaq_data(), the scalers sent include the readout
+            self.remove_subscriber('scalers')
+        self.add_subscriber('eudaq', self.send_eudaq_data)
 
-    def handle_data(self, data_tuple):
+    def send_eudaq_data(self, data_tuple):
         '''
         Called on every readout (a few Hz)
         Sends data per event by checking for the trigger word that comes first.
         '''
 
-        super(EudaqScan, self).handle_data(data_tuple)
         skipped_triggers = data_tuple[4]
         raw_data = data_tuple[0]
-        n_triggers = raw_data.shape[0]
-        for i in range(n_triggers):
-            # Split can return empty data, thus do not return send empty data
-            # Otherwise fragile EUDAQ will fail. It is based on very simple event counting only
-            if np.any(raw_data['trigger_id']):
-                actual_trigger_number = raw_data[i]['trigger_id']
-                data = raw_data[i]
-                # Check for jumps in trigger number
-                if actual_trigger_number != self.last_trigger_number + 1:
-                    logging.warning('Expected != Measured trigger number: %d != %d', self.last_trigger_number + 1, actual_trigger_number)
-                self.last_trigger_number = actual_trigger_number
-                self.callback(data=data, skipped_triggers=skipped_triggers, event_counter=self.event_counter)
-                self.event_counter += 1
-
-
-def replay_tlu_data(data_file, real_time=True):
+        self.scalers.add(raw_data)
+        # Split can return empty data, thus do not return send empty data
+        # Otherwise fragile EUDAQ will fail. It is based on very simple event counting only
+        if not np.any(raw_data['trigger_id']):
+            return
+        self.trigger_ids.check(raw_data['trigger_id'])  # Check for jumps in trigger number
+        self.eudaq_scalers = self.scalers.get_eudaq_string()
+        for data in raw_data:
+            self.callback(data=data, skipped_triggers=skipped_triggers, event_counter=self.event_counter)
+            self.event_counter += 1
+
+
+def replay_tlu_data(data_file, real_time=True, scaler_interval=1.0):
     '''
     Replay data from file.
+    Yields (trigger number, trigger timestamp, skipped triggers, input scalers in EUDAQ format) per trigger.
 
     Parameters
     ----------
     real_time: boolean
         Delays return if replay is too fast to keep
         replay speed at original data taking speed.
+    scaler_interval: float
+        Update interval of the input scalers in seconds.
     '''
 
-    with tb.open_file(data_file, mode="r") as in_file_h5:
-        meta_data = in_file_h5.root.meta_data[:]
-        raw_data = in_file_h5.root.raw_data
-        n_readouts = meta_data.shape[0]
-
+    with ChunkedReader(data_file) as reader:
         last_readout_time = time.time()
 
-        last_trigger_number = -1
-
-        for i in tqdm(range(n_readouts)):
-            # Raw data indeces of readout
-            i_start = meta_data['index_start'][i]
-            i_stop = meta_data['index_stop'][i]
-
-            t_start = meta_data[i]['timestamp_start']
+        trigger_ids = TriggerIdTracker(last_trigger_id=-1)
+        scalers = InputScalers(interval=scaler_interval)
 
+        for i, (actual_data, t_start, _, _, skipped_triggers) in enumerate(tqdm(reader.readouts(), total=len(reader))):
             # Determine replay delays
             if i == 0:  # Initialize on first readout
                 last_timestamp_start = t_start
@@ -100,18 +96,11 @@ def replay_tlu_data(data_file, real_time=True):
             last_readout_time = time.time()
             last_timestamp_start = t_start
 
-            actual_data = raw_data[i_start:i_stop]
-
-            skipped_triggers = meta_data[i]['skipped_triggers']
-            for dat in actual_data:
-                actual_trigger_number = dat['trigger_id']
-                trg_number, trg_timestamp = dat['trigger_id'], dat['time_stamp']
-                # Check for jumps in trigger number
-                if actual_trigger_number != last_trigger_number + 1:
-                    logging.warning('Expected != Measured trigger number: %d != %d', last_trigger_number + 1, actual_trigger_number)
-                last_trigger_number = actual_trigger_number
-
-                yield trg_number, trg_timestamp, skipped_triggers
+            trigger_ids.check(actual_data['trigger_id'])  # Check for jumps in trigger number
+            scalers.add(actual_data)
+            scalers_string = scalers.get_eudaq_string()
+            for trg_number, trg_timestamp in zip(actual_data['trigger_id'], actual_data['time_stamp']):
+                yield trg_number, trg_timestamp, skipped_triggers, scalers_string
 
 
 def main():
@@ -185,7 +174,7 @@ def main():
         # According to EUDAQ nomenclature
         particles = trg_number + skipped_triggers  # amount of possible triggers (accepted + skipped)
         status = get_dut_status()  # TLU status according to EUDAQ format
-        scalers = '-, -, -, -'  # input triggers on each scinitllator input (TODO: not yet implemented)
+        scalers = chip.eudaq_scalers  # accepted triggers with a leading edge on each scintillator input (software scalers)
         pp.SendEventExtraInfo((event_counter, trg_timestamp, trg_number), particles, status, scalers)  # Send data to EUDAQ
 
     # Start state mashine, keep connection until termination of euRun
@@ -201,9 +190,11 @@ def main():
             logging.info('Configuring...')
             if not config['replay']:  # Only need configure step if not replaying data
                 if chip is None:  # Init TLU
-                    chip = EudaqScan(output_folder=config['output_folder'], log_file=config['log_file'], data_file=config['data_file'], monitor_addr=config['monitor_addr'])
+                    chip = EudaqScan(output_folder=config['output_folder'], log_file=config['log_file'], data_file=config['data_file'], monitor_addr=config['monitor_addr'],
+                                     **tlu.create_writer_configuration(config))
                     chip.init()
                     chip.set_callback(send_data_to_eudaq)  # Set callback function in order to send data to EUDAQ
+                    chip.scalers.interval = config['scaler_interval']
 
                 # Read configuration file, map to pytlu format and update already existing config
                 trigger_interval = float(pp.GetConfigParameter(item="TriggerInterval", default=False))  # (auto) trigger interval in units of 1 ms
@@ -243,13 +234,12 @@ def main():
         if pp.StartingRun:
             logging.info('Starting run...')
 
-            start_time = 0
-            trigger_id_start = 0
-            skipped_triggers_start = 0
+            last_log = 0
 
             if not config['replay']:
                 # Start pytlu
                 pp.StartingRun = True  # set status and send BORE
+                chip.scalers.reset()  # scalers of the run
                 with chip.readout():
                     if config["test"] > 0:
                         logging.info("Starting internal trigger generation...")
@@ -289,28 +279,19 @@ def main():
                             # FIXME: using not thread safe variable
                             stop_run = True
                             break
-                        # Calculate parameter for logging output
-                        actual_time = time.time()
-                        actual_trigger_id = chip['tlu_master'].TRIGGER_ID
-                        actual_skipped_triggers = chip['tlu_master'].SKIP_TRIG_COUNTER
-                        trg_rate_acc = (actual_trigger_id - trigger_id_start) / (actual_time - start_time)
-                        trg_rate = trg_rate_acc + (actual_skipped_triggers - skipped_triggers_start) / (actual_time - start_time)
-                        timeout_counter = chip['tlu_master'].TIMEOUT_COUNTER
-                        tx_state = chip['tlu_master'].TX_STATE
-                        start_time = actual_time
-                        trigger_id_start = actual_trigger_id
-                        skipped_triggers_start = actual_skipped_triggers
-                        tlu.print_log(trg_rate, trg_rate_acc, actual_trigger_id, actual_skipped_triggers, timeout_counter, tx_state)
-                        time.sleep(1)
+                        status = chip.read_status()
+                        if status['timestamp'] - last_log >= 1.0:  # log at most once per second
+                            tlu.log_status(status, chip.fifo_readout.get_subscriber_status())
+                            last_log = status['timestamp']
+                        time.sleep(config['status_interval'])
             else:
                 logging.info("Replaying data...")
                 pp.StartingRun = True  # set status and send BORE
-                for event_counter, data in enumerate(replay_tlu_data(data_file=config['replay'])):
-                    trg_number, trg_timestamp, skipped_triggers = data
+                for event_counter, data in enumerate(replay_tlu_data(data_file=config['replay'], scaler_interval=config['scaler_interval'])):
+                    trg_number, trg_timestamp, skipped_triggers, scalers = data
                     # According to EUDAQ nomenclature
                     particles = trg_number + skipped_triggers  # amount of possible triggers (accepted + skipped)
                     status = get_dut_status()  # TLU status (TX state)
-                    scalers = '-, -, -, -'  # input triggers on each scinitllator input (TODO: not yet implemented)
                     pp.SendEventExtraInfo((event_counter, trg_timestamp, trg_number), particles, status, scalers)  # Send data to EUDAQ
                     if pp.Error or pp.Terminating:
                         break
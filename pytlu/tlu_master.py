@@ -5,8 +5,14 @@
 # ------------------------------------------------------------
 #
 
+import numpy as np
+
 from basil.HL.RegisterHardwareLayer import RegisterHardwareLayer
 
+# Read only status registers TIME_STAMP ... TX_STATE (addresses 16 to 36)
+status_registers_dtype = np.dtype([('time_stamp', '<u8'), ('trigger_id', '<u4'), ('skipped_triggers', '<u4'),
+                                   ('timeout_counter', 'u1'), ('lost_data_counter', 'u1'), ('tx_state', 'u1', (3,))])
+
 
 class tlu_master(RegisterHardwareLayer):
     ''' TLU FSM
@@ -43,3 +49,13 @@ class tlu_master(RegisterHardwareLayer):
     def reset(self):
         '''Soft reset the module.'''
         self.RESET = 0
+
+    def get_status(self):
+        ''' Read all status registers with one transfer (consistent values, one USB access instead of five).
+
+            Returns dict with time_stamp, trigger_id, skipped_triggers, timeout_counter, lost_data_counter and tx_state.
+        '''
+        registers = np.frombuffer(bytes(bytearray(self._intf.read(self._base_addr + 16, size=status_registers_dtype.itemsize))), dtype=status_registers_dtype)[0]
+        status = dict((name, int(registers[name])) for name in ('time_stamp', 'trigger_id', 'skipped_triggers', 'timeout_counter', 'lost_data_counter'))
+        status['tx_state'] = int(registers['tx_state'][0]) | int(registers['tx_state'][1]) << 8 | int(registers['tx_state'][2]) << 16
+        return status
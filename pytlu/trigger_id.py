@@ -0,0 +1,105 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Trigger ID arithmetic for trigger IDs truncated to n_bits_trig_id bits (--n_bits_trig_id,
+    tlu_master.N_BITS_TRIGGER_ID): the DUTs receive the lower n bits of the 32-bit TLU trigger ID,
+    which wrap around every 2^n triggers.
+
+    All functions work on arrays. Steps between consecutive trigger IDs are taken modulo 2^n in
+    [-2^(n-1), 2^(n-1)), unwrapping assumes that fewer than 2^(n-1) triggers are missing between
+    consecutive records.
+'''
+
+import logging
+
+import numpy as np
+
+MAX_BITS = 32
+
+
+def get_mask(n_bits):
+    if not 1 <= n_bits <= MAX_BITS:
+        raise ValueError('Number of trigger ID bits has to be 1...%d, not %d' % (MAX_BITS, n_bits))
+    return (1 << n_bits) - 1
+
+
+def truncate_trigger_id(trigger_id, n_bits):
+    ''' Full 32-bit trigger IDs -> trigger IDs as received by the DUTs (lower n_bits bits).
+    '''
+    return np.asarray(trigger_id, dtype=np.uint32) & np.uint32(get_mask(n_bits))
+
+
+def get_steps(trigger_id, n_bits, previous=None):
+    ''' Returns the signed steps (int64) between consecutive trigger IDs modulo 2^n_bits.
+
+        previous: trigger ID before trigger_id[0] (e.g. last of the previous chunk), gives the step to
+        trigger_id[0] as first step. Without, there is one step less than trigger IDs.
+    '''
+    trigger_id = np.asarray(trigger_id).astype(np.int64)
+    if previous is not None:
+        trigger_id = np.concatenate(([int(previous)], trigger_id))
+    half = 1 << (n_bits - 1)
+    return ((np.diff(trigger_id) + half) & get_mask(n_bits)) - half
+
+
+def unwrap_trigger_id(trigger_id, n_bits, reference=None):
+    ''' Truncated trigger IDs -> full 32-bit trigger IDs.
+
+        reference: full trigger ID of the record before trigger_id[0] (e.g. last unwrapped ID of the previous
+        chunk or the TLU trigger ID of a matched event). None: trigger_id[0] is taken as full trigger ID.
+    '''
+    trigger_id = np.asarray(trigger_id)
+    if trigger_id.shape[0] == 0:
+        return np.zeros(0, dtype=np.uint32)
+    if reference is None:
+        full = int(trigger_id[0]) + np.concatenate(([0], np.cumsum(get_steps(trigger_id, n_bits))))
+    else:
+        full = int(reference) + np.cumsum(get_steps(trigger_id, n_bits, previous=int(reference) & get_mask(n_bits)))
+    return (full & get_mask(MAX_BITS)).astype(np.uint32)
+
+
+def find_discontinuities(trigger_id, n_bits=MAX_BITS, previous=None):
+    ''' Returns (indices, expected trigger IDs, trigger IDs) of the trigger IDs that are not previous trigger ID + 1 (modulo 2^n_bits).
+    '''
+    trigger_id = np.asarray(trigger_id)
+    ids = trigger_id.astype(np.int64) if previous is None else np.concatenate(([int(previous)], trigger_id.astype(np.int64)))
+    steps = np.nonzero(get_steps(ids, n_bits) != 1)[0]  # step k: ids[k] -> ids[k + 1]
+    indices = steps if previous is not None else steps + 1
+    return indices, (ids[steps] + 1) & get_mask(n_bits), trigger_id[indices]
+
+
+class TriggerIdTracker(object):
+    ''' Continuity check and unwrapping of trigger IDs over consecutive chunks (e.g. readouts).
+    '''
+
+    def __init__(self, n_bits=MAX_BITS, last_trigger_id=None):
+        self.n_bits = n_bits
+        self.last_trigger_id = last_trigger_id  # full trigger ID of the last record
+        self.n_discontinuities = 0
+
+    def check(self, trigger_id, max_messages=10):
+        ''' Log the trigger IDs that do not follow the previous one, the first is compared to the last of the previous chunk.
+            Returns (indices, expected trigger IDs, trigger IDs) of the discontinuities.
+        '''
+        trigger_id = np.asarray(trigger_id)
+        if trigger_id.shape[0] == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), trigger_id
+        previous = None if self.last_trigger_id is None else int(self.last_trigger_id) & get_mask(self.n_bits)
+        indices, expected, measured = find_discontinuities(trigger_id, self.n_bits, previous=previous)
+        for index in range(min(indices.shape[0], max_messages)):
+            logging.warning('Expected != Measured trigger number: %d != %d', expected[index], measured[index])
+        if indices.shape[0] > max_messages:
+            logging.warning('%d more trigger number jumps', indices.shape[0] - max_messages)
+        self.n_discontinuities += int(indices.shape[0])
+        self.last_trigger_id = int(self.unwrap(trigger_id)[-1])
+        return indices, expected, measured
+
+    def unwrap(self, trigger_id):
+        ''' Full trigger IDs of the truncated trigger IDs of the next chunk (does not change the state).
+        '''
+        return unwrap_trigger_id(trigger_id, self.n_bits, reference=self.last_trigger_id)
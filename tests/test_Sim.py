@@ -245,6 +245,11 @@ class TestSim(unittest.TestCase):
 
         self.assertEqual(self.dut['tlu_master'].TRIGGER_ID, how_many)
         self.assertEqual(self.dut['tlu_master'].TIMEOUT_COUNTER, 255 if how_many > 255 else how_many)
+        # consolidated status read gives the same values
+        status = self.dut['tlu_master'].get_status()
+        self.assertEqual(status['trigger_id'], how_many)
+        self.assertEqual(status['timeout_counter'], 255 if how_many > 255 else how_many)
+        self.assertEqual(status['tx_state'], self.dut['tlu_master'].TX_STATE)
 
     def test_multi_input_distance(self):
         self.dut['TLU_TB'].TRIGGER_COUNTER = 0
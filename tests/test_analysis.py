@@ -0,0 +1,181 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+''' Unit tests of the offline analysis of raw data files.
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import tables as tb
+
+import pytlu
+from pytlu.analysis import analyze
+from pytlu.data_writer import create_file_writer
+from pytlu.event_builder import build_events
+from pytlu.file_rotation import RotatingWriter
+from pytlu.trigger_id import TriggerIdTracker, truncate_trigger_id, unwrap_trigger_id
+
+pytlu_path = os.path.dirname(pytlu.__file__)
+data_folder = os.path.abspath(os.path.join(pytlu_path, '..', 'data'))
+
+
+class TestAnalysis(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.data_file = os.path.join(data_folder, 'tlu_example_data.h5')
+        with tb.open_file(cls.data_file, mode='r') as in_file:
+            cls.raw_data, cls.meta_data = in_file.root.raw_data[:], in_file.root.meta_data[:]
+        cls.tmp_dir = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir, ignore_errors=True)
+
+    def write_file(self, name, raw_data):
+        ''' Write raw_data with the readout structure of the example data (last readout takes the rest). '''
+        meta_data = self.meta_data[self.meta_data['index_stop'] < raw_data.shape[0]].copy()
+        meta_data = np.append(meta_data, self.meta_data[meta_data.shape[0]])
+        meta_data['index_stop'][-1] = raw_data.shape[0]
+        meta_data['data_length'] = meta_data['index_stop'] - meta_data['index_start']
+        filename = os.path.join(self.tmp_dir, name + '.h5')
+        writer = create_file_writer(filename, raw_data.dtype, meta_data.dtype)
+        writer.append_readouts(raw_data, meta_data)
+        writer.close()
+        return filename
+
+    def test_analysis(self):
+        ''' Test the analysis of the example data, results are independent of the chunk size '''
+        results = [analyze(self.data_file, output_file=os.path.join(self.tmp_dir, 'analysis_%d.h5' % chunk_size), chunk_size=chunk_size)
+                   for chunk_size in (1000, 10 ** 7)]
+        summary = results[0].get_summary()
+        self.assertEqual(summary, results[1].get_summary())
+        self.assertEqual(summary['n_records'], self.raw_data.shape[0])
+        self.assertEqual(summary['n_readouts'], self.meta_data.shape[0])
+        self.assertEqual(summary['n_trigger_id_gaps'], 0)
+        self.assertEqual(summary['n_time_stamp_not_increasing'], 0)
+        self.assertEqual(summary['min_interval'], np.diff(self.raw_data['time_stamp'].astype(np.int64)).min())
+        for name in ('rate', 'skipped_triggers', 'interval_histogram_log2', 'le_histograms'):
+            np.testing.assert_array_equal(getattr(results[0], name), getattr(results[1], name))
+        self.assertEqual(results[0].rate.sum(), self.raw_data.shape[0])
+        np.testing.assert_array_equal(results[0].le_histograms[2], np.bincount(self.raw_data['le2'], minlength=256))
+        with tb.open_file(os.path.join(self.tmp_dir, 'analysis_1000.h5'), mode='r') as in_file:
+            np.testing.assert_array_equal(in_file.root.rate[:], results[0].rate)
+
+    def test_trigger_id_gaps(self):
+        ''' Test detection of missing trigger IDs, also at chunk boundaries and with wrap arounds '''
+        raw_data = np.delete(self.raw_data, [5, 1000, 1001, 40000])
+        raw_data['trigger_id'] %= 2 ** 15
+        filename = self.write_file('gaps', raw_data)
+        for chunk_size in (1000, 10 ** 7):
+            result = analyze(filename, chunk_size=chunk_size, n_bits_trig_id=15)
+            self.assertEqual(result.n_gaps, 3)
+            self.assertEqual(result.n_missing_triggers, 4)
+            self.assertEqual(result.gaps['index'].tolist(), [5, 999, 39997])
+            self.assertEqual(result.gaps['trigger_id'].tolist(), [6, 1002, 40001 % 2 ** 15])
+
+    def test_parallel_analysis(self):
+        ''' Test that the analysis of ranges in several processes and of rotated runs gives the same result '''
+        raw_data = np.delete(self.raw_data, [5, 1000, 1001, 40000])
+        filename = self.write_file('parallel', raw_data)
+        result = analyze(filename, jobs=1, range_size=10 ** 7)
+        parallel_result = analyze(filename, jobs=2, range_size=5000, chunk_size=1000)
+
+        rotated_file = os.path.join(self.tmp_dir, 'rotated.h5')
+        writer = RotatingWriter(rotated_file, lambda path: create_file_writer(path, raw_data.dtype, self.meta_data.dtype), max_size=16 * 1024)
+        with tb.open_file(filename, mode='r') as in_file:
+            for meta in in_file.root.meta_data[:]:
+                writer.append((raw_data[meta['index_start']:meta['index_stop']], meta['timestamp_start'], meta['timestamp_stop'],
+                               meta['error'], meta['skipped_triggers']))
+        writer.close()
+        rotated_result = analyze(rotated_file, jobs=2)
+
+        for other in (parallel_result, rotated_result):
+            self.assertEqual(result.get_summary(), other.get_summary())
+            for name in ('gaps', 'rate', 'skipped_triggers', 'interval_histogram', 'interval_histogram_log2', 'le_histograms'):
+                np.testing.assert_array_equal(getattr(result, name), getattr(other, name))
+        self.assertEqual(result.gaps['index'].tolist(), [5, 999, 39997])
+
+    def test_trigger_id_unwrapping(self):
+        ''' Test unwrapping of truncated trigger IDs over chunks and the vectorized continuity check '''
+        full = np.delete(np.arange(2 ** 32 - 70000, 2 ** 32 + 200000) % 2 ** 32, [10, 70000, 70001, 150000]).astype(np.uint32)
+        truncated = truncate_trigger_id(full, 15)
+        np.testing.assert_array_equal(unwrap_trigger_id(truncated, 15, reference=full[0] - 1), full)
+        tracker = TriggerIdTracker(n_bits=15, last_trigger_id=full[0] - 1)
+        unwrapped, discontinuities = [], []
+        for start in range(0, full.shape[0], 1000):
+            chunk = truncated[start:start + 1000]
+            unwrapped.append(tracker.unwrap(chunk))
+            discontinuities.extend(start + tracker.check(chunk)[0])
+        np.testing.assert_array_equal(np.concatenate(unwrapped), full)
+        self.assertEqual([int(index) for index in discontinuities], [10, 69999, 149997])
+        self.assertEqual(tracker.last_trigger_id, full[-1])
+
+    def test_event_building(self):
+        ''' Test matching of DUT data with truncated trigger IDs and with time stamps, results are independent of the chunk size '''
+        raw_data = np.delete(self.raw_data, [100, 20000, 20001])  # TLU records without DUT partner are in the DUT data
+        tlu_file = self.write_file('events_tlu', raw_data)
+        dut_indices = np.delete(np.arange(self.raw_data.shape[0]), [5, 30000, 50000])  # triggers missed by the DUT
+        dut_indices = np.sort(np.append(dut_indices, [7, 7, 40000]))  # several hits per trigger
+        hits = np.zeros(dut_indices.shape[0], dtype=[('trigger_number', 'u2'), ('time_stamp', 'u8')])
+        hits['trigger_number'] = self.raw_data['trigger_id'][dut_indices] % 2 ** 15
+        hits['time_stamp'] = self.raw_data['time_stamp'][dut_indices] + np.arange(hits.shape[0]) % 3
+        dut_file = os.path.join(self.tmp_dir, 'events_dut.h5')
+        with tb.open_file(dut_file, mode='w') as out_file:
+            out_file.create_table(out_file.root, name='Hits', obj=hits)
+
+        in_tlu = ~np.isin(dut_indices, [100, 20000, 20001])
+        for key, kwargs in (('trigger_id', {'dut_field': 'trigger_number', 'n_bits_trig_id': 15}), ('time_stamp', {'max_time_difference': 2})):
+            for chunk_size in (1000, 10 ** 7):
+                output_file = os.path.join(self.tmp_dir, 'events_%s_%d.h5' % (key, chunk_size))
+                summary = build_events(tlu_file, dut_file, output_file=output_file, key=key, dut_node='/Hits', chunk_size=chunk_size, **kwargs)
+                self.assertEqual(summary['n_matched'], np.count_nonzero(in_tlu))
+                self.assertEqual(summary['n_dut_unmatched'], 3)
+                self.assertEqual(summary['n_tlu_unmatched'], 3)
+                self.assertEqual(summary['n_dut_duplicates'], 3)
+                with tb.open_file(output_file, mode='r') as in_file:
+                    events = in_file.root.events[:]
+                    np.testing.assert_array_equal(in_file.root.dut_unmatched[:], np.nonzero(~in_tlu)[0])
+                    np.testing.assert_array_equal(np.sort(in_file.root.tlu_unmatched[:]), np.searchsorted(raw_data['trigger_id'], [5, 30000, 50000]))
+                np.testing.assert_array_equal(events['dut_index'], np.nonzero(in_tlu)[0])
+                np.testing.assert_array_equal(events['trigger_id'], self.raw_data['trigger_id'][dut_indices[in_tlu]])
+                np.testing.assert_array_equal(raw_data['trigger_id'][events['tlu_index']], events['trigger_id'])
+                np.testing.assert_array_equal(events['time_difference'], (np.arange(hits.shape[0]) % 3)[in_tlu])
+
+    def test_fine_time(self):
+        ''' Test the leading edge histograms, pair time differences and coincidence window occupancy '''
+        raw_data = self.raw_data.copy()
+        random = np.random.RandomState(0)
+        for i in range(3):  # CH3 disabled
+            raw_data['le%d' % i] = 60 + random.randint(0, 20, size=raw_data.shape[0])
+        filename = self.write_file('fine_time', raw_data)
+        results = [analyze(filename, chunk_size=chunk_size) for chunk_size in (1000, 10 ** 7)]
+        self.assertEqual(results[0].get_summary(), results[1].get_summary())
+        fine_time = results[0].fine_time
+        np.testing.assert_array_equal(fine_time.le_histograms[1], np.bincount(raw_data['le1'], minlength=256))
+        difference = raw_data['le0'].astype(np.int64) - raw_data['le2']
+        np.testing.assert_array_equal(fine_time.difference_histograms[1], np.bincount(difference + 255, minlength=511))  # pair (0, 2)
+        self.assertEqual(fine_time.difference_histograms[2].sum(), 0)  # pair (0, 3)
+        le = np.stack([raw_data['le%d' % i] for i in range(3)]).astype(np.int64)
+        spread = le.max(axis=0) - le.min(axis=0)
+        np.testing.assert_array_equal(fine_time.spread_histogram, np.bincount(spread, minlength=256))
+        occupancy = fine_time.get_window_occupancy()
+        self.assertAlmostEqual(occupancy[10], np.count_nonzero(spread < 10) / float(spread.shape[0]))
+        self.assertEqual(occupancy[20], 1.0)
+        summary = results[0].get_summary()['fine_time']
+        self.assertEqual(summary['enabled_inputs'], [0, 1, 2])
+        self.assertEqual(summary['spread_max'], spread.max())
+        self.assertEqual(summary['coincidence_window_99'], np.argmax(np.array([np.mean(spread < w) for w in range(32)]) >= 0.99))
+        self.assertAlmostEqual(summary['le0-le2']['mean'], difference.mean() * 1.5625)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,473 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+''' Unit tests of the raw data file layouts (writing and reading back).
+'''
+
+import argparse
+import os
+import functools
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import numpy as np
+import tables as tb
+import yaml
+
+import pytlu
+from pytlu import delta_codec
+from pytlu.data_writer import create_file_writer, create_filters, add_storage_arguments, check_storage_arguments
+from pytlu.data_reader import RawDataReader, ChunkedReader, read_raw_data, read_column
+from pytlu.raw_capture import RawCaptureWriter, RawCaptureReader
+from pytlu.convert import convert
+from pytlu.benchmark import benchmark
+from pytlu.file_rotation import RotatingWriter, load_manifest, get_segment_files
+from pytlu.process_writer import create_writer, shared_memory, SharedMemoryRing
+from pytlu.run_follower import RunFollower
+from pytlu.recover import recover, write_journal, RECOVERED_READOUT
+from pytlu.merge import merge, slice_run, copy_rows, copy_readouts
+from pytlu.export import export, load_npy
+from pytlu.catalogue import RunCatalogue, update_catalogue
+from pytlu.data_index import create_indexes, is_indexed, find_records, read_trigger_range, read_time_range
+
+pytlu_path = os.path.dirname(pytlu.__file__)
+data_folder = os.path.abspath(os.path.join(pytlu_path, '..', 'data'))
+
+
+def load_example_data():
+    with tb.open_file(os.path.join(data_folder, 'tlu_example_data.h5'), mode='r') as in_file:
+        return in_file.root.raw_data[:], in_file.root.meta_data[:]
+
+
+class TestDataStorage(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.raw_data, cls.meta_data = load_example_data()
+        cls.tmp_dir = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir, ignore_errors=True)
+
+    def write_file(self, layout, **writer_kwargs):
+        filename = os.path.join(self.tmp_dir, 'raw_data_%s.h5' % layout)
+        writer = create_file_writer(filename, self.raw_data.dtype, self.meta_data.dtype, layout=layout, **writer_kwargs)
+        self.write_readouts(writer)
+        return filename
+
+    def write_readouts(self, writer, delay=0.0, meta_data=None):
+        for meta in self.meta_data if meta_data is None else meta_data:
+            writer.append((self.raw_data[meta['index_start']:meta['index_stop']], meta['timestamp_start'],
+                           meta['timestamp_stop'], meta['error'], meta['skipped_triggers']))
+            time.sleep(delay)
+        writer.close()
+
+    def test_delta_codec(self):
+        ''' Test lossless encoding including wrap arounds and non monotonic values '''
+        raw_data = np.zeros(10, dtype=self.raw_data.dtype)
+        raw_data['trigger_id'] = np.arange(32760, 32770) % 2 ** 15
+        raw_data['time_stamp'] = [2 ** 64 - 5, 2 ** 64 - 1, 3, 2, 100, 2 ** 63, 0, 5, 5, 5]
+        raw_data['le2'] = np.arange(10)
+        for data in (raw_data, raw_data[:1], raw_data[:0], self.raw_data):
+            decoded = delta_codec.decode_block(delta_codec.encode_block(data), data.dtype)
+            np.testing.assert_array_equal(decoded, data)
+        # Continuous trigger IDs do not need any bit
+        self.assertEqual(delta_codec.encode_block(self.raw_data[:1000])[:delta_codec.block_header_dtype.itemsize].view(delta_codec.block_header_dtype)['trigger_id_bits'][0], 0)
+
+    def test_layouts(self):
+        ''' Test reading back all layouts, full and partial '''
+        for layout, writer_kwargs in (('table', {}), ('delta', {'block_size': 1000}), ('column', {'chunkshape': 4096})):
+            filename = self.write_file(layout, **writer_kwargs)
+            with tb.open_file(filename, mode='r') as in_file:
+                np.testing.assert_array_equal(read_raw_data(in_file), self.raw_data)
+                np.testing.assert_array_equal(in_file.root.meta_data[:], self.meta_data)
+                reader = RawDataReader(in_file)
+                self.assertEqual(len(reader), self.raw_data.shape[0])
+                for start, stop in ((0, 1), (999, 1001), (12345, 23456), (55000, 60000), (10, 10)):
+                    np.testing.assert_array_equal(reader[start:stop], self.raw_data[start:stop])
+                for name in self.raw_data.dtype.names:
+                    np.testing.assert_array_equal(read_column(in_file, name, 100, 20000), self.raw_data[name][100:20000])
+
+    def test_storage_settings(self):
+        ''' Test the compression filters, the check of the command line arguments and the benchmark of the settings '''
+        filters = create_filters(complib='blosc:lz4', complevel=1, shuffle='bit')
+        self.assertEqual((filters.complib, filters.complevel, filters.shuffle, filters.bitshuffle), ('blosc:lz4', 1, False, True))
+        filters = create_filters(complib='zlib', complevel=5, shuffle='byte')
+        self.assertEqual((filters.complib, filters.complevel, filters.shuffle, filters.bitshuffle), ('zlib', 5, True, False))
+        self.assertFalse(create_filters(shuffle='none').shuffle)
+        with self.assertRaises(ValueError):
+            create_filters(complib='zlib', shuffle='bit')
+
+        parser = argparse.ArgumentParser()
+        add_storage_arguments(parser, layouts=['table'])
+        check_storage_arguments(parser, parser.parse_args(['--complib', 'blosc:zstd', '--shuffle', 'bit']))
+        with self.assertRaises(SystemExit):
+            check_storage_arguments(parser, parser.parse_args(['--complib', 'zlib', '--shuffle', 'bit']))
+
+        filename = self.write_file('table')
+        results = benchmark(filename, layouts=['table', 'delta'], complibs=['blosc:lz4', 'zlib'], complevels=[1], shuffles=['byte', 'bit'],
+                            chunkshapes=[None], max_rows=5000, tmp_dir=self.tmp_dir)
+        self.assertEqual([(result['layout'], result['complib'], result['shuffle']) for result in results],
+                         [('table', 'blosc:lz4', 'byte'), ('table', 'blosc:lz4', 'bit'), ('table', 'zlib', 'byte'),
+                          ('delta', 'blosc:lz4', 'byte'), ('delta', 'blosc:lz4', 'bit'), ('delta', 'zlib', 'byte')])  # zlib with bit shuffle is skipped
+        self.assertTrue(all(result['compression_ratio'] > 1 and result['write_speed'] > 0 and result['read_speed'] > 0 for result in results))
+
+    def test_chunked_reader(self):
+        ''' Test chunked iteration with and without read ahead and random access '''
+        filename = self.write_file('delta', block_size=1000)
+        for read_ahead in (0, 2):
+            with ChunkedReader(filename, chunk_size=5000, read_ahead=read_ahead, meta_block_size=100) as reader:
+                self.assertEqual(len(reader), self.meta_data.shape[0])
+                chunks = list(reader)
+                self.assertTrue(all(meta_data['data_length'].sum() == raw_data.shape[0] for meta_data, raw_data in chunks))
+                np.testing.assert_array_equal(np.concatenate([meta_data for meta_data, _ in chunks]), self.meta_data)
+                np.testing.assert_array_equal(np.concatenate([raw_data for _, raw_data in chunks]), self.raw_data)
+                readouts = list(reader.readouts(readout_start=10, readout_stop=20))
+                self.assertEqual(len(readouts), 10)
+                np.testing.assert_array_equal(readouts[0][0], self.raw_data[self.meta_data['index_start'][10]:self.meta_data['index_stop'][10]])
+                raw_data, timestamp_start, _, _, _ = reader.read_readout(-1)
+                np.testing.assert_array_equal(raw_data, self.raw_data[self.meta_data['index_start'][-1]:])
+                self.assertEqual(timestamp_start, self.meta_data['timestamp_start'][-1])
+                readouts = reader.readouts()
+                next(readouts)
+                readouts.close()  # stops reading ahead
+
+    def test_raw_capture(self):
+        ''' Test raw capture (with growing file) and conversion into all layouts '''
+        filename = os.path.join(self.tmp_dir, 'capture.h5')
+        writer = RawCaptureWriter(filename, self.raw_data.dtype, self.meta_data.dtype, preallocate=64 * 1024)
+        writer.set_attrs(kwargs='{}')
+        writer.write_table('clock_samples', np.zeros(3, dtype=[('host_time', 'f8')]))
+        status = np.arange(4.0).view([('timestamp', 'f8')])
+        writer.append_table('status', status[:1])
+        writer.append_table('status', status[1:])
+        self.write_readouts(writer)
+        capture = RawCaptureReader(filename)
+        np.testing.assert_array_equal(capture.read_table('status'), status)
+        np.testing.assert_array_equal(capture.raw_data, self.raw_data)
+        np.testing.assert_array_equal(capture.meta_data, self.meta_data)
+        for layout, jobs in (('table', 1), ('delta', 2), ('column', 1)):
+            output_file = convert(filename, os.path.join(self.tmp_dir, 'converted_%s.h5' % layout), layout=layout, jobs=jobs, chunk_size=10000)
+            with tb.open_file(output_file, mode='r') as in_file:
+                np.testing.assert_array_equal(read_raw_data(in_file), self.raw_data)
+                np.testing.assert_array_equal(in_file.root.meta_data[:], self.meta_data)
+                self.assertEqual(in_file.root.meta_data.attrs.kwargs, '{}')
+                self.assertEqual(in_file.root.clock_samples.nrows, 3)
+                np.testing.assert_array_equal(in_file.root.status[:], status)
+
+    def test_file_rotation(self):
+        ''' Test that the segments of a rotated run are complete files and add up to the run '''
+        filename = os.path.join(self.tmp_dir, 'rotated.h5')
+        writer = RotatingWriter(filename, functools.partial(create_file_writer, data_dtype=self.raw_data.dtype, meta_data_dtype=self.meta_data.dtype),
+                                max_size=20000)
+        writer.set_attrs(kwargs='{}')
+        self.write_readouts(writer)
+        segments = load_manifest(filename)['segments']
+        self.assertGreater(len(segments), 1)
+        self.assertEqual(segments[-1]['index_stop'], self.raw_data.shape[0])
+        for segment, segment_file in zip(segments, get_segment_files(filename)):
+            self.assertTrue(segment['closed'])
+            with tb.open_file(segment_file, mode='r') as in_file:
+                meta_data = in_file.root.meta_data[:]
+                self.assertEqual(meta_data['index_start'][0], 0)
+                self.assertEqual(in_file.root.meta_data.attrs.kwargs, '{}')
+                self.assertEqual(in_file.root.meta_data.attrs.index_offset, segment['index_start'])
+                np.testing.assert_array_equal(read_raw_data(in_file), self.raw_data[segment['index_start']:segment['index_stop']])
+                np.testing.assert_array_equal(meta_data['timestamp_start'], self.meta_data['timestamp_start'][segment['readout_start']:segment['readout_stop']])
+
+    @unittest.skipIf(shared_memory is None, 'Shared memory requires Python >= 3.8')
+    def test_file_rotation_process_writer(self):
+        ''' Test rotation by size with the writer process, the segment file does not exist before the process writes it '''
+        filename = os.path.join(self.tmp_dir, 'rotated_process.h5')
+        writer = RotatingWriter(filename, functools.partial(create_writer, data_dtype=self.raw_data.dtype, meta_data_dtype=self.meta_data.dtype, process=True),
+                                max_size=20000)
+        self.write_readouts(writer)
+        segments = load_manifest(filename)['segments']
+        self.assertGreater(len(segments), 1)
+        self.assertEqual(segments[-1]['index_stop'], self.raw_data.shape[0])
+        for segment, segment_file in zip(segments, get_segment_files(filename)):
+            with tb.open_file(segment_file, mode='r') as in_file:
+                np.testing.assert_array_equal(read_raw_data(in_file), self.raw_data[segment['index_start']:segment['index_stop']])
+
+    @unittest.skipIf(shared_memory is None, 'Shared memory requires Python >= 3.8')
+    def test_process_writer(self):
+        ''' Test the shared memory ring (wrap around, back pressure) and that the writer process writes the same file as the writer thread '''
+        ring = SharedMemoryRing(size=100)
+        try:
+            data = np.arange(40, dtype=np.uint8)
+            self.assertEqual(ring.put(data), (0, 40))
+            self.assertEqual(ring.put(data + 1), (40, 40))
+            waits = []
+
+            def wait():  # called while the ring is full, the consumer releases the first chunk
+                waits.append(ring.free)
+                if len(waits) == 3:
+                    ring.release(40)
+
+            self.assertEqual(ring.put(data + 2, wait=wait), (0, 60))  # 20 bytes padding at the end of the ring
+            self.assertEqual(waits[0], 20)
+            self.assertGreaterEqual(len(waits), 3)
+            np.testing.assert_array_equal(ring.get(0, 40, np.uint8), data + 2)
+            np.testing.assert_array_equal(ring.get(40, 40, np.uint8), data + 1)
+            self.assertIsNone(ring.put(np.zeros(101, dtype=np.uint8)))
+        finally:
+            ring.close()
+
+        clock_samples = np.arange(3.0).view([('host_time', 'f8')])
+        for layout in ('table', 'delta'):
+            filenames = []
+            for process in (False, True):
+                filename = os.path.join(self.tmp_dir, 'writer_%s_%s.h5' % (layout, process))
+                # The ring is smaller than the largest readout (sent inline) and wraps around many times
+                writer = create_writer(filename, self.raw_data.dtype, self.meta_data.dtype, process=process, ring_size=3000, layout=layout)
+                writer.set_attrs(kwargs='{}')
+                writer.write_table('clock_samples', clock_samples)
+                writer.append_table('status', clock_samples)
+                self.write_readouts(writer)
+                filenames.append(filename)
+            with tb.open_file(filenames[0], mode='r') as thread_file, tb.open_file(filenames[1], mode='r') as process_file:
+                np.testing.assert_array_equal(read_raw_data(process_file), self.raw_data)
+                np.testing.assert_array_equal(read_raw_data(process_file), read_raw_data(thread_file))
+                np.testing.assert_array_equal(process_file.root.meta_data[:], thread_file.root.meta_data[:])
+                np.testing.assert_array_equal(process_file.root.clock_samples[:], clock_samples)
+                np.testing.assert_array_equal(process_file.root.status[:], clock_samples)
+                self.assertEqual(process_file.root.meta_data.attrs.kwargs, '{}')
+
+    def test_run_follower(self):
+        ''' Test reading runs while they are written '''
+        for layout, rotate in (('raw', False), ('raw', True), ('table', True)):
+            filename = os.path.join(self.tmp_dir, 'follow_%s_%s.h5' % (layout, rotate))
+            create = functools.partial(create_writer, data_dtype=self.raw_data.dtype, meta_data_dtype=self.meta_data.dtype, layout=layout)
+            writer = RotatingWriter(filename, create, max_duration=0.2) if rotate else create(filename)
+            writer_thread = threading.Thread(target=self.write_readouts, args=(writer, 0.002))
+            writer_thread.start()
+            readouts = list(RunFollower(filename, poll_interval=0.05, timeout=10))
+            writer_thread.join()
+            self.assertEqual(len(readouts), self.meta_data.shape[0])
+            np.testing.assert_array_equal(np.concatenate([readout[0] for readout in readouts]), self.raw_data)
+            np.testing.assert_array_equal([readout[1] for readout in readouts], self.meta_data['timestamp_start'])
+
+        # Single HDF5 file: read when the journal says finished, not as soon as it can be opened
+        filename = os.path.join(self.tmp_dir, 'follow_file.h5')
+        shutil.copy(self.write_file('table'), filename)
+        write_journal(filename, finished=False)
+        follower = RunFollower(filename, poll_interval=0.05, timeout=10)
+        self.assertEqual(follower.poll(), [])
+        self.assertFalse(follower.finished)
+        write_journal(filename, finished=True)
+        self.assertEqual(len(follower.poll()), self.meta_data.shape[0])
+        self.assertTrue(follower.finished)
+
+    def test_recover(self):
+        ''' Test recovery of a file with incomplete meta_data and missing attributes '''
+        for layout in ('table', 'delta', 'column'):
+            filename = self.write_file(layout)
+            with tb.open_file(filename, mode='a') as h5_file:  # meta data of the last 10 readouts not written
+                h5_file.root.meta_data.truncate(self.meta_data.shape[0] - 10)
+            write_journal(filename, config='config', finished=False)
+            report = recover(filename, chunk_size=1000, meta_block_size=50)
+            self.assertFalse(report['run_finished'])
+            self.assertEqual(report['n_records_lost'], 0)
+            self.assertEqual(report['attrs_restored'], ['config'])
+            n_missing = self.raw_data.shape[0] - int(self.meta_data['index_stop'][-11])
+            self.assertEqual(report['n_records_without_meta_data'], n_missing)
+            self.assertEqual(report['n_readouts_rebuilt'], (n_missing + 999) // 1000)
+            with tb.open_file(report['output_file'], mode='r') as in_file:
+                np.testing.assert_array_equal(read_raw_data(in_file), self.raw_data)
+                meta_data = in_file.root.meta_data[:]
+                self.assertEqual(meta_data['index_stop'][-1], self.raw_data.shape[0])
+                self.assertTrue(np.all(meta_data['error'][-report['n_readouts_rebuilt']:] == RECOVERED_READOUT))
+                self.assertEqual(in_file.root.meta_data.attrs.config, 'config')
+
+    def test_recover_capture(self):
+        ''' Test recovery of a raw capture with raw data after the last index entry and an index entry pointing to unwritten pages '''
+        n_words = self.raw_data.shape[0]
+        index_stop = int(self.meta_data['index_stop'][-11])
+        for case in ('raw_data_without_index', 'index_without_raw_data'):
+            filename = os.path.join(self.tmp_dir, 'crashed_%s.h5' % case)
+            writer = RawCaptureWriter(filename, self.raw_data.dtype, self.meta_data.dtype, preallocate=64 * 1024)
+            writer.set_attrs(config='config')
+            self.write_readouts(writer)
+            capture_name = os.path.splitext(filename)[0]
+            with open(capture_name + '.raw', 'r+b') as raw_file:  # preallocated pages at the end were not written
+                raw_file.truncate(n_words * self.raw_data.dtype.itemsize + 64 * 1024)
+            index = self.meta_data.copy()
+            if case == 'raw_data_without_index':  # index of the last 10 readouts not written
+                index = index[:-10]
+            else:  # index entry written, raw data of the readout not
+                index = np.append(index, index[-1:])
+                index[-1]['index_start'], index[-1]['index_stop'], index[-1]['data_length'] = n_words, n_words + 100, 100
+            with open(capture_name + '.idx', 'wb') as idx_file:
+                idx_file.write(index.tobytes())
+
+            report = recover(filename, chunk_size=1000, meta_block_size=50)
+            self.assertEqual(report['layout'], 'raw')
+            self.assertEqual(report['n_records_stored'], n_words)
+            if case == 'raw_data_without_index':
+                self.assertEqual((report['n_readouts_valid'], report['n_readouts_lost']), (self.meta_data.shape[0] - 10, 0))
+                self.assertEqual(report['n_records_without_meta_data'], n_words - index_stop)
+                self.assertEqual(report['n_readouts_rebuilt'], (n_words - index_stop + 999) // 1000)
+            else:
+                self.assertEqual((report['n_readouts_valid'], report['n_readouts_lost'], report['n_records_lost']), (self.meta_data.shape[0], 1, 100))
+                self.assertEqual(report['n_readouts_rebuilt'], 0)
+            with tb.open_file(report['output_file'], mode='r') as in_file:
+                np.testing.assert_array_equal(read_raw_data(in_file), self.raw_data)
+                meta_data = in_file.root.meta_data[:]
+                self.assertEqual(meta_data['index_stop'][-1], n_words)
+                np.testing.assert_array_equal(meta_data[:report['n_readouts_valid']], self.meta_data[:report['n_readouts_valid']])
+                self.assertEqual(in_file.root.meta_data.attrs.config, 'config')
+
+    def test_indexes(self):
+        ''' Test trigger and time range queries with and without index '''
+        time_start, time_stop = self.raw_data['time_stamp'][1000], self.raw_data['time_stamp'][30000]
+        for layout, writer_kwargs in (('table', {}), ('delta', {'block_size': 1000}), ('column', {})):
+            filename = self.write_file(layout, **writer_kwargs)
+            with tb.open_file(filename, mode='a') as h5_file:
+                for indexed in (False, True):
+                    if indexed:
+                        create_indexes(h5_file, block_size=4096, chunk_size=1000)  # chunks of at least one block
+                    self.assertEqual(is_indexed(h5_file), indexed)
+                    np.testing.assert_array_equal(read_trigger_range(h5_file, 2000, 2100), self.raw_data[2000:2100])
+                    np.testing.assert_array_equal(read_time_range(h5_file, time_start, time_stop), self.raw_data[1000:30000])
+                    self.assertEqual(find_records(h5_file, 'trigger_id', 10 ** 6, 10 ** 6 + 1).shape[0], 0)
+                    # Limits outside of the range of the field are clipped
+                    self.assertEqual(find_records(h5_file, 'trigger_id', -1, 2 ** 32).shape[0], self.raw_data.shape[0])
+                    self.assertEqual(find_records(h5_file, 'time_stamp', 0, 2 ** 64).shape[0], self.raw_data.shape[0])
+                    self.assertEqual(find_records(h5_file, 'trigger_id', 2 ** 32, 2 ** 33).shape[0], 0)
+
+    def write_split_files(self, layout, split, **writer_kwargs):
+        filenames = []
+        for name, meta_data in (('a', self.meta_data[:split]), ('b', self.meta_data[split:])):
+            filenames.append(os.path.join(self.tmp_dir, 'split_%s_%s.h5' % (layout, name)))
+            writer = create_file_writer(filenames[-1], self.raw_data.dtype, self.meta_data.dtype, layout=layout, **writer_kwargs)
+            writer.set_attrs(kwargs='{}')
+            writer.write_table('clock_samples', np.array([(meta_data['timestamp_start'][0],), (meta_data['timestamp_stop'][-1],)], dtype=[('timestamp', 'f8')]))
+            writer.append_readouts(self.raw_data[meta_data['index_start'][0]:meta_data['index_stop'][-1]], meta_data)
+            writer.close()
+        return filenames
+
+    def test_merge_slice(self):
+        ''' Test that merging split runs and slicing them gives the original data '''
+        merged_file = os.path.join(self.tmp_dir, 'merged.h5')
+        for layout, writer_kwargs in (('table', {'chunkshape': 1000}), ('delta', {'block_size': 1000}), ('column', {'chunkshape': 4096})):
+            input_files = self.write_split_files(layout, 100, **writer_kwargs)
+            for files in (input_files, [input_files[0], self.write_split_files('table', 100)[1]]):  # same and different layout
+                source = merge(files, merged_file, chunk_size=10000)
+                self.assertEqual([run['readout_stop'] for run in source], [100, self.meta_data.shape[0]])
+                with tb.open_file(merged_file, mode='r') as in_file:
+                    np.testing.assert_array_equal(read_raw_data(in_file), self.raw_data)
+                    np.testing.assert_array_equal(in_file.root.meta_data[:], self.meta_data)
+                    self.assertEqual(in_file.root.meta_data.attrs.kwargs, '{}')
+                    self.assertEqual(in_file.root.clock_samples.nrows, 4)
+            start, stop = 10.0, 20.0
+            source = slice_run(merged_file, os.path.join(self.tmp_dir, 'slice.h5'), start=start, stop=stop)
+            timestamp_start = self.meta_data['timestamp_start'] - self.meta_data['timestamp_start'][0]
+            selected = self.meta_data[(timestamp_start >= start) & (timestamp_start < stop)]
+            self.assertEqual(source['n_readouts'], selected.shape[0])
+            with tb.open_file(os.path.join(self.tmp_dir, 'slice.h5'), mode='r') as in_file:
+                np.testing.assert_array_equal(read_raw_data(in_file), self.raw_data[selected['index_start'][0]:selected['index_stop'][-1]])
+                np.testing.assert_array_equal(in_file.root.meta_data.col('timestamp_start'), selected['timestamp_start'])
+                self.assertEqual(in_file.root.meta_data[0]['index_start'], 0)
+        # Compressed chunks are copied if aligned
+        filename = self.write_file('table', chunkshape=1000)
+        with tb.open_file(filename, mode='r') as in_file:
+            writer = create_file_writer(merged_file, self.raw_data.dtype, self.meta_data.dtype, chunkshape=1000)
+            self.assertEqual(copy_rows(in_file.root.raw_data, writer.data_table, 0, 5500), 5000)
+            self.assertEqual(copy_rows(in_file.root.raw_data, writer.data_table, 5500, 10000, chunk_size=100), 4000)
+            self.assertEqual(copy_rows(in_file.root.raw_data, writer.data_table, 10100, 20000), 0)  # not aligned
+            self.assertEqual(copy_rows(in_file.root.raw_data, writer.data_table, 49900, in_file.root.raw_data.nrows), in_file.root.raw_data.nrows - 50000)
+            np.testing.assert_array_equal(writer.data_table[:], np.concatenate((self.raw_data[:10000], self.raw_data[10100:20000], self.raw_data[49900:])))
+            writer.close()
+        # Delta encoded blocks are copied in blocks of readouts
+        filename = self.write_file('delta', block_size=1000)
+        with tb.open_file(filename, mode='r') as in_file:
+            writer = create_file_writer(merged_file, self.raw_data.dtype, self.meta_data.dtype, layout='delta', block_size=1000)
+            copy_readouts(in_file, writer, 5, self.meta_data.shape[0], chunk_size=10000, meta_block_size=20)
+            writer.close()
+        with tb.open_file(merged_file, mode='r') as in_file:
+            np.testing.assert_array_equal(read_raw_data(in_file), self.raw_data[self.meta_data['index_start'][5]:])
+
+    def test_export(self):
+        ''' Test the streamed export into .npy column files '''
+        filename = self.write_file('delta', block_size=1000)
+        with tb.open_file(filename, mode='a') as h5_file:
+            h5_file.root.meta_data.attrs.kwargs = '{}'
+        files = export(filename, os.path.join(self.tmp_dir, 'export_npy'), chunk_size=10000)
+        self.assertEqual(len(files), len(self.raw_data.dtype.names) + 2)
+        columns, meta_data, attrs = load_npy(os.path.join(self.tmp_dir, 'export_npy'))
+        self.assertEqual(sorted(columns), sorted(self.raw_data.dtype.names))
+        for name in self.raw_data.dtype.names:
+            self.assertIsInstance(columns[name], np.memmap)
+            np.testing.assert_array_equal(columns[name], self.raw_data[name])
+        np.testing.assert_array_equal(meta_data, self.meta_data)
+        self.assertEqual(attrs['kwargs'], '{}')
+
+    def test_export_parquet(self):
+        ''' Test that the Parquet row groups hold complete readouts '''
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            self.skipTest('pyarrow is not installed')
+        files = export(self.write_file('table'), os.path.join(self.tmp_dir, 'export_parquet'), output_format='parquet', chunk_size=10000)
+        raw_data = pq.ParquetFile(files[0])
+        row_group_stop = np.cumsum([raw_data.metadata.row_group(i).num_rows for i in range(raw_data.num_row_groups)])
+        self.assertTrue(np.all(np.isin(row_group_stop, self.meta_data['index_stop'])))
+        table = raw_data.read()
+        for name in self.raw_data.dtype.names:
+            np.testing.assert_array_equal(table.column(name).to_numpy(), self.raw_data[name])
+        self.assertEqual(pq.read_table(files[1]).num_rows, self.meta_data.shape[0])
+
+    def test_catalogue(self):
+        ''' Test building, updating and querying the run catalogue '''
+        folder = os.path.join(self.tmp_dir, 'catalogue')
+        os.makedirs(folder)
+        configs = {'coincidence': yaml.dump({'tlu_master': {'EN_INPUT': 3, 'MAX_DISTANCE': 10, 'THRESHOLD': 2}}),
+                   'single': yaml.dump({'tlu_master': {'EN_INPUT': 1, 'MAX_DISTANCE': 31, 'THRESHOLD': 0}})}
+        meta_data = self.meta_data.copy()
+        meta_data['skipped_triggers'] = np.arange(meta_data.shape[0]) * 3  # counter of the TLU
+        for name, config in configs.items():
+            writer = create_file_writer(os.path.join(folder, name + '.h5'), self.raw_data.dtype, self.meta_data.dtype, layout='delta')
+            writer.set_attrs(config=config)
+            self.write_readouts(writer, meta_data=meta_data)
+        create_writer = functools.partial(create_file_writer, data_dtype=self.raw_data.dtype, meta_data_dtype=self.meta_data.dtype)
+        writer = RotatingWriter(os.path.join(folder, 'rotated.h5'), create_writer, max_size=20000)
+        writer.set_attrs(config=configs['coincidence'])
+        self.write_readouts(writer, meta_data=meta_data)
+        with tb.open_file(os.path.join(folder, 'no_run.h5'), mode='w') as h5_file:
+            h5_file.create_array(h5_file.root, 'histogram', np.zeros(3))
+        duration = self.meta_data['timestamp_stop'][-1] - self.meta_data['timestamp_start'][0]
+        with RunCatalogue(os.path.join(folder, 'runs.sqlite')) as catalogue:
+            self.assertEqual(catalogue.scan(folder), 3)
+            runs = catalogue.query(inputs=['CH1', 'CH0'], min_triggers=self.raw_data.shape[0])
+            self.assertEqual([run['run_name'] for run in runs], ['coincidence', 'rotated'])
+            self.assertGreater(runs[1]['n_segments'], 1)
+            for run in runs:
+                self.assertEqual(run['n_triggers'], self.raw_data.shape[0])
+                self.assertEqual(run['n_readouts'], self.meta_data.shape[0])
+                self.assertEqual(run['skipped_triggers'], meta_data['skipped_triggers'][-1])
+                self.assertEqual(run['input_enable'], 'CH0,CH1')
+                self.assertEqual(run['coincidence_window'], 10)
+                self.assertEqual(run['last_trigger_id'], self.raw_data['trigger_id'][-1])
+                self.assertAlmostEqual(run['duration'], duration)
+                self.assertAlmostEqual(run['trigger_rate'], self.raw_data.shape[0] / duration)
+            self.assertEqual(len(catalogue.query(min_triggers=self.raw_data.shape[0] + 1)), 0)
+            self.assertEqual([run['run_name'] for run in catalogue.query(config={'THRESHOLD': 0})], ['single'])
+            self.assertEqual(len(catalogue.query(config={'coincidence_window': 10}, name='rot*', min_duration=duration / 2)), 1)
+            os.remove(os.path.join(folder, 'single.h5'))
+            catalogue.scan(folder)
+            self.assertEqual(len(catalogue), 2)
+        update_catalogue(os.path.join(folder, 'coincidence.h5'))
+        with RunCatalogue(os.path.join(folder, 'run_catalogue.sqlite')) as catalogue:
+            self.assertEqual([run['layout'] for run in catalogue.query()], ['delta'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -22,6 +22,8 @@ import unittest
 import threading
 import subprocess
 import sys
+import shutil
+import tempfile
 try:
     from queue import Queue, Empty  # Python3
 except ImportError:
@@ -130,9 +132,11 @@ class TestEudaq(unittest.TestCase):
             cls.no_eudaq_install = False
         except ImportError:
             cls.no_eudaq_install = True
+        cls.output_folder = tempfile.mkdtemp()
 
     @classmethod
     def tearDownClass(cls):
+        shutil.rmtree(cls.output_folder)
         os.remove(os.path.join(data_folder, 'tlu_example_data_out.h5'))
         os.remove(os.path.join(data_folder, 'tlu_example_data_snd.h5'))
 
@@ -199,12 +203,13 @@ class TestEudaq(unittest.TestCase):
             '''
             raw_data_table_snd.append(np.array([data]))
             self.n_calls += 1
+            self.eudaq_scalers = scan.eudaq_scalers
 
         raw_data_file = os.path.join(data_folder, 'tlu_example_data.h5')
         raw_data_file_out = os.path.join(data_folder, 'tlu_example_data_out.h5')
         raw_data_file_snd = os.path.join(data_folder, 'tlu_example_data_snd.h5')
 
-        scan = tlu_eudaq.EudaqScan()
+        scan = tlu_eudaq.EudaqScan(output_folder=self.output_folder)
 
         h5_file_snd = tb.open_file(raw_data_file_snd, mode='w')
         raw_data_table_snd = h5_file_snd.create_table(h5_file_snd.root, name='raw_data',
@@ -212,6 +217,8 @@ class TestEudaq(unittest.TestCase):
                                                       filters=tb.Filters(complib='blosc', complevel=5))
 
         scan.set_callback(SendEvent)
+        scan.scalers.interval = 0.
+        self.assertNotIn('scalers', scan.subscribers)
 
         # Create storage structures and variables that are not created since we fake readout
         scan.h5_file = tb.open_file(raw_data_file_out, mode='w')
@@ -244,6 +251,29 @@ class TestEudaq(unittest.TestCase):
         self.assertTrue(data_equal, msg=error_msg)
 
         self.assertEqual(scan.event_counter, self.n_calls)
+        with tb.open_file(raw_data_file) as in_file:
+            raw_data = in_file.root.raw_data[:]
+        np.testing.assert_array_equal(scan.scalers.counts, [np.count_nonzero(raw_data['le%d' % i]) for i in range(4)])
+        # The scalers sent with the events of the last readout include the readout
+        self.assertEqual(self.eudaq_scalers, ', '.join('%d' % np.count_nonzero(raw_data['le%d' % i]) for i in range(4)))
+
+    def test_replay_scalers(self):
+        ''' Test the software input scalers of replayed data. '''
+        raw_data_file = os.path.join(data_folder, 'tlu_example_data.h5')
+        raw_data_file_scalers = os.path.join(data_folder, 'tlu_example_data_scalers.h5')
+        with tb.open_file(raw_data_file) as in_file:
+            raw_data, meta_data = in_file.root.raw_data[:], in_file.root.meta_data[:]
+        raw_data['le1'] = raw_data['trigger_id'] % 3  # input fired in 2 of 3 triggers
+        raw_data['le2'] = 50
+        with tb.open_file(raw_data_file_scalers, mode='w') as out_file:
+            out_file.create_table(out_file.root, name='raw_data', obj=raw_data)
+            out_file.create_table(out_file.root, name='meta_data', obj=meta_data)
+        try:
+            replayed = list(tlu_eudaq.replay_tlu_data(raw_data_file_scalers, real_time=False, scaler_interval=0.))
+        finally:
+            os.remove(raw_data_file_scalers)
+        self.assertEqual(len(replayed), raw_data.shape[0])
+        self.assertEqual(replayed[-1][3], '0, %d, %d, 0' % (np.count_nonzero(raw_data['le1']), raw_data.shape[0]))
 
 
 if __name__ == '__main__':
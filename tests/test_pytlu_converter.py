@@ -0,0 +1,90 @@
+''' Script to check the interpretation of the pytlu online monitor converter
+
+    The readouts are serialized by pytlu_sender as sent during data taking.
+'''
+
+import os
+import unittest
+
+import numpy as np
+import tables as tb
+from zmq.utils import jsonapi
+
+import pytlu
+from pytlu.online_monitor import pytlu_sender
+from pytlu.online_monitor.pytlu_converter import PyTLU
+
+pytlu_path = os.path.dirname(pytlu.__file__)
+data_folder = os.path.abspath(os.path.join(pytlu_path, '..', 'data'))
+
+
+class FakeSocket(object):
+    ''' Collects the messages of pytlu_sender as received by the converter. '''
+
+    def __init__(self):
+        self.messages = []
+
+    def send_json(self, obj, flags=0):
+        self.messages.append(jsonapi.dumps(obj))
+
+    def send(self, data, flags=0):
+        self.messages.append(np.ascontiguousarray(data).tobytes())
+
+
+class TestConverter(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with tb.open_file(os.path.join(data_folder, 'tlu_example_data.h5')) as in_file:
+            cls.raw_data, cls.meta_data = in_file.root.raw_data[:], in_file.root.meta_data[:]
+        random = np.random.RandomState(0)
+        for i in range(3):  # CH3 disabled
+            cls.raw_data['le%d' % i] = 60 + random.randint(0, 20, size=cls.raw_data.shape[0])
+
+    def setUp(self):
+        self.converter = PyTLU(frontend='tcp://127.0.0.1:8600', backend='tcp://127.0.0.1:8700', kind='pytlu_converter', name='TLU_Converter')
+        self.converter.setup_interpretation()
+
+    def convert(self, n_readouts):
+        ''' Sends the first readouts through the converter, returns the last interpreted meta data '''
+        socket = FakeSocket()
+        for meta in self.meta_data[:n_readouts]:
+            raw_data = self.raw_data[meta['index_start']:meta['index_stop']]
+            pytlu_sender.send_data(socket, (raw_data, float(meta['timestamp_start']), float(meta['timestamp_stop']), int(meta['error']),
+                                            int(meta['skipped_triggers'])), len_raw_data=raw_data.shape[0])
+        # One more readout, its meta data carries the histograms of the readouts before
+        socket.messages.append(jsonapi.dumps({'name': 'ReadoutData', 'data_length': 0, 'timestamp_start': 1e9, 'timestamp_stop': 1e9 + 1.,
+                                              'skipped_triggers': 0, 'readout_error': 0}))
+        result = None
+        for message in socket.messages:
+            data = self.converter.deserialize_data(message)
+            self.assertIsNotNone(data)
+            interpreted = self.converter.interpret_data([('TLU', data)])
+            if interpreted is not None:
+                result = interpreted[0]
+        return result
+
+    def test_fine_time(self):
+        ''' Test that the fine time histograms are filled with the raw data of the readouts '''
+        n_readouts = 10
+        result = self.convert(n_readouts)
+        raw_data = self.raw_data[:self.meta_data['index_stop'][n_readouts - 1]]
+        np.testing.assert_array_equal(result['fine_time']['le_histograms'][0], np.bincount(raw_data['le0'], minlength=256))
+        self.assertGreater(result['fine_time']['spread_histogram'].sum(), 0)
+        self.assertGreater(result['fine_time']['window_occupancy'].max(), 0)
+
+    def test_scalers(self):
+        ''' Test the input scalers of the converter, they are sent to the receiver with the meta data '''
+        n_readouts = 10
+        result = self.convert(n_readouts)
+        raw_data = self.raw_data[:self.meta_data['index_stop'][n_readouts - 1]]
+        scalers = [np.count_nonzero(raw_data['le%d' % i]) for i in range(4)]
+        np.testing.assert_array_equal(self.converter.scalers.counts, scalers)
+        np.testing.assert_array_equal(result['scalers'], scalers)
+        self.assertEqual(scalers[3], 0)
+        self.converter.handle_command(['RESET'])
+        self.assertFalse(self.converter.scalers.counts.any())
+
+
+if __name__ == '__main__':
+    unittest.main()
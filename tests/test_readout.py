@@ -0,0 +1,242 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+''' Unit tests of the host side of the readout, no hardware or simulation needed.
+'''
+
+import os
+import shutil
+import tempfile
+import functools
+import threading
+import time
+import unittest
+try:
+    from unittest import mock  # Python3
+except ImportError:
+    import mock  # Python2
+
+import numpy as np
+import tables as tb
+
+from pytlu.catalogue import get_catalogue_name
+from pytlu.data_stream import DataStream
+from pytlu.data_writer import create_file_writer
+from pytlu.fifo_readout import Subscriber
+from pytlu.file_rotation import RotatingWriter
+from pytlu.merge import merge
+from pytlu.recover import load_journal, write_journal
+from pytlu.time_sync import ClockCorrelation, FPGA_CLOCK, to_host_time
+from pytlu.tlu import Tlu
+
+
+class FailingWriter(object):
+    ''' Writer whose file cannot be closed (e.g. disk full). '''
+
+    def close(self):
+        raise IOError('No space left on device')
+
+
+class TestReadout(unittest.TestCase):
+
+    def setUp(self):
+        self.output_folder = tempfile.mkdtemp()
+        self.tlu = Tlu(output_folder=self.output_folder, data_file='run')
+
+    def tearDown(self):
+        self.tlu.logger.removeHandler(self.tlu.fh)
+        self.tlu.fh.close()
+        shutil.rmtree(self.output_folder)
+
+    def test_clock_correlation(self):
+        ''' Test the clock model fit with offset, drift and outliers and the conversion to host time '''
+        frequency = FPGA_CLOCK * (1 + 20e-6)  # TLU clock 20 ppm fast
+        host_time_start = 1.6e9
+        time_stamp = np.arange(1000, dtype=np.uint64) * np.uint64(4000000) + np.uint64(2 ** 40)  # 0.1 s sampling
+        host_time = host_time_start + (time_stamp - time_stamp[0]).astype(np.float64) / frequency
+        rng = np.random.RandomState(0)
+        uncertainty = np.full(time_stamp.shape[0], 10e-6)
+        jitter = rng.uniform(-10e-6, 10e-6, time_stamp.shape[0])
+        outliers = rng.choice(time_stamp.shape[0], 20, replace=False)
+        uncertainty[outliers], jitter[outliers] = 10e-3, 5e-3  # e.g. the readout thread was not scheduled
+
+        clock = ClockCorrelation()
+        for sample in zip(host_time + jitter, time_stamp, uncertainty):
+            clock.add_sample(*sample)
+        parameters = clock.get_parameters()
+        self.assertEqual(parameters['n_samples'], time_stamp.shape[0])
+        self.assertEqual(parameters['time_stamp_ref'], time_stamp[0])
+        self.assertAlmostEqual(parameters['frequency'] / frequency, 1.0, delta=1e-7)
+        self.assertAlmostEqual(parameters['host_time_ref'], host_time_start, delta=20e-6)
+        np.testing.assert_allclose(clock.to_host_time(time_stamp), host_time, rtol=0, atol=20e-6)
+        np.testing.assert_allclose(to_host_time(time_stamp[-1], parameters), host_time[-1], rtol=0, atol=20e-6)
+
+        # Sample limit: thinned out, the time range is kept
+        clock = ClockCorrelation(max_samples=100)
+        for sample in zip(host_time, time_stamp, uncertainty):
+            clock.add_sample(*sample)
+        samples = clock.samples
+        self.assertLessEqual(samples.shape[0], 100)
+        self.assertEqual(samples['time_stamp'][0], time_stamp[0])
+        self.assertEqual(samples['time_stamp'][-1], time_stamp[-1])
+        self.assertAlmostEqual(clock.get_parameters()['frequency'] / frequency, 1.0, delta=1e-9)
+
+        # A single sample uses the nominal frequency
+        clock = ClockCorrelation()
+        clock.add_sample(host_time_start, 0, 1e-6)
+        self.assertEqual(clock.to_host_time(FPGA_CLOCK), host_time_start + 1.0)
+        with self.assertRaises(ValueError):
+            to_host_time(0, ClockCorrelation().get_parameters())
+
+    def test_data_stream(self):
+        ''' Test the bounded buffer with drop counting, end of data, timeout and close of stream() '''
+        closed = []
+        data_stream = DataStream(maxsize=3, on_close=closed.append)
+        for i in range(5):
+            data_stream.put(i)
+        self.assertEqual(data_stream.dropped, 2)
+        data_stream.stop()  # buffer full: the oldest readout makes room for the end marker
+        self.assertEqual(list(data_stream), [1, 2])
+        self.assertEqual(data_stream.dropped, 3)
+        self.assertTrue(data_stream.closed)
+        self.assertEqual(closed, [data_stream])
+        data_stream.put(5)  # ignored after close
+        self.assertIsNone(data_stream.get(timeout=0.01))
+
+        data_stream = DataStream(timeout=0.05)
+        start = time.time()
+        self.assertEqual(list(data_stream), [])
+        self.assertLess(time.time() - start, 1.0)
+
+        # Consumer in another thread, close() ends the iteration without the buffered data
+        data_stream = DataStream(maxsize=100)
+        received = []
+
+        def consume():
+            for data_tuple in data_stream:
+                received.append(data_tuple)
+                if data_tuple == 2:
+                    data_stream.close()
+
+        consumer = threading.Thread(target=consume)
+        consumer.start()
+        for i in range(10):
+            data_stream.put(i)
+        consumer.join(5.0)
+        self.assertFalse(consumer.is_alive())
+        self.assertEqual(received, [0, 1, 2])
+
+    def test_async_data_stream(self):
+        ''' Test the asyncio stream fed from another thread '''
+        import asyncio
+        from pytlu.async_data_stream import AsyncDataStream
+
+        async def consume():
+            data_stream = AsyncDataStream(maxsize=2)
+            producer = threading.Thread(target=lambda: [data_stream.put(i) for i in range(3)] + [data_stream.stop()])
+            await asyncio.sleep(0)
+            producer.start()
+            producer.join()
+            await asyncio.sleep(0.01)
+            received = [data_tuple async for data_tuple in data_stream]
+            timeout_stream = AsyncDataStream(timeout=0.01)
+            return received, data_stream.dropped, [data_tuple async for data_tuple in timeout_stream]
+
+        received, dropped, timed_out = asyncio.run(consume())
+        self.assertEqual(received, [1])  # 2 buffered, 1 dropped, 1 removed for the end marker
+        self.assertEqual(dropped, 2)
+        self.assertEqual(timed_out, [])
+
+    def test_subscribers(self):
+        ''' Test that a slow subscriber drops data and lags without blocking the others '''
+        stored = []
+        slow_started, release = threading.Event(), threading.Event()
+
+        def slow_callback(data_tuple):
+            slow_started.set()
+            release.wait(5.0)
+
+        hdf5 = Subscriber('hdf5', stored.append)
+        slow = Subscriber('slow', slow_callback, maxsize=2)
+        readouts = [(np.arange(i), float(i), float(i + 1), 0, 0) for i in range(5)]
+        for subscriber in (hdf5, slow):
+            subscriber.start()
+        try:
+            for subscriber in (hdf5, slow):  # fan-out as in FifoReadout.readout()
+                subscriber.put(readouts[0])
+            self.assertTrue(slow_started.wait(5.0))
+            for readout in readouts[1:]:
+                for subscriber in (hdf5, slow):
+                    subscriber.put(readout)
+            start = time.time()
+            while hdf5.processed < len(readouts) and time.time() - start < 5.0:
+                time.sleep(0.01)
+            self.assertEqual(hdf5.processed, len(readouts))  # while the slow subscriber is blocked
+            self.assertEqual((hdf5.lag, hdf5.lag_time, hdf5.dropped), (0, 0.0, 0))
+            self.assertEqual((slow.processed, slow.lag, slow.dropped), (0, 2, 2))
+            self.assertEqual(slow.lag_time, 3.0)  # readouts 1 and 2 wait, the readout 0 started at 0 s
+        finally:
+            release.set()
+            for subscriber in (hdf5, slow):
+                subscriber.stop()
+        self.assertEqual([readout[1] for readout in stored], [readout[1] for readout in readouts])
+        self.assertEqual((slow.processed, slow.lag, slow.lag_time), (3, 0, 0.0))
+
+    def test_close_data_file(self):
+        ''' Test that the run is marked as finished only if the data file was closed without error '''
+        data_file = self.tlu.data_file
+        write_journal(data_file, finished=False)
+        self.tlu.writer = FailingWriter()
+        with self.assertLogs(level='ERROR'):
+            self.tlu.close_data_file()
+        self.assertFalse(load_journal(data_file)['finished'])
+        self.assertFalse(os.path.exists(get_catalogue_name(self.output_folder)))
+
+        self.tlu.writer = create_file_writer(data_file, self.tlu.data_dtype, self.tlu.meta_data_dtype)
+        self.tlu.close_data_file()
+        self.assertTrue(load_journal(data_file)['finished'])
+        self.assertTrue(os.path.exists(get_catalogue_name(self.output_folder)))
+
+    def test_read_status(self):
+        ''' Test the trigger rates of the status samples and the status table, also split into the segments of a rotated run '''
+        registers = [{'time_stamp': 100, 'trigger_id': 2 ** 32 - 10, 'skipped_triggers': 5, 'timeout_counter': 0, 'lost_data_counter': 0, 'tx_state': 0x21},
+                     {'time_stamp': 200, 'trigger_id': 90, 'skipped_triggers': 55, 'timeout_counter': 1, 'lost_data_counter': 2, 'tx_state': 0x654321},
+                     {'time_stamp': 300, 'trigger_id': 90, 'skipped_triggers': 55, 'timeout_counter': 1, 'lost_data_counter': 2, 'tx_state': 0}]
+        data_file = self.tlu.data_file
+        self.tlu.writer = create_file_writer(data_file, self.tlu.data_dtype, self.tlu.meta_data_dtype)
+        with mock.patch.object(self.tlu['tlu_master'], 'get_status', side_effect=registers):
+            samples = [self.tlu.read_status().copy() for _ in registers]
+        self.tlu.writer.close()
+
+        self.assertEqual((samples[0]['trigger_rate'], samples[0]['accepted_trigger_rate']), (0.0, 0.0))  # no previous sample
+        interval = samples[1]['timestamp'] - samples[0]['timestamp']
+        self.assertAlmostEqual(samples[1]['accepted_trigger_rate'], 100 / interval)  # trigger ID wraps around
+        self.assertAlmostEqual(samples[1]['trigger_rate'], 150 / interval)
+        self.assertEqual((samples[2]['trigger_rate'], samples[2]['accepted_trigger_rate']), (0.0, 0.0))
+        self.assertEqual(list(samples[1]['tx_state']), [1, 2, 3, 4, 5, 6])
+        self.assertEqual(self.tlu.last_status['time_stamp'], 300)
+        with tb.open_file(data_file, mode='r') as in_file:
+            np.testing.assert_array_equal(in_file.root.status[:], np.array(samples, dtype=self.tlu.status_dtype))
+            self.assertTrue(in_file.root.status.attrs.appended)
+
+        # Rotated run (new segment after every readout): each segment has its samples, merge concatenates them
+        rotated_file = os.path.join(self.output_folder, 'rotated.h5')
+        self.tlu.writer = RotatingWriter(rotated_file, functools.partial(create_file_writer, data_dtype=self.tlu.data_dtype,
+                                                                         meta_data_dtype=self.tlu.meta_data_dtype), max_size=1)
+        with mock.patch.object(self.tlu['tlu_master'], 'get_status', side_effect=registers):
+            for i, _ in enumerate(registers):
+                self.tlu.store_data((np.zeros(1, dtype=self.tlu.data_dtype), float(i), float(i), 0, 0))
+                self.tlu.read_status()
+        self.tlu.writer.close()
+        merged_file = os.path.join(self.output_folder, 'merged.h5')
+        merge([rotated_file], merged_file)
+        with tb.open_file(merged_file, mode='r') as in_file:
+            np.testing.assert_array_equal(in_file.root.status.col('time_stamp'), [100, 200, 300])
+
+
+if __name__ == '__main__':
+    unittest.main()
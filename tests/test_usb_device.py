@@ -0,0 +1,117 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+''' Unit tests of the USB device access (TluDevice) with a fake USB device, no hardware needed.
+'''
+
+import errno
+import threading
+import time
+import unittest
+
+import usb.core
+
+from pytlu.ZestSC1 import TluDevice, TransferStats
+
+
+class FakeUsbDevice(object):
+    ''' Fake pyusb device, bulk reads block until release() is called. '''
+
+    def __init__(self):
+        self.read_started = threading.Event()
+        self._release = threading.Event()
+
+    def release(self):
+        self._release.set()
+
+    def set_configuration(self):
+        pass
+
+    def ctrl_transfer(self, bmRequestType, bRequest, wValue=0, wIndex=0, data_or_wLength=None, timeout=None):
+        if bmRequestType & 0x80:  # device to host
+            return [0, wValue & 0xff]
+        return len(data_or_wLength)
+
+    def read(self, endpoint, length, timeout=None):
+        self.read_started.set()
+        self._release.wait(5.0)
+        return [0] * length
+
+    def write(self, endpoint, data, timeout=None):
+        return len(data)
+
+
+class TestUsbDevice(unittest.TestCase):
+
+    def start_bulk_read(self, tlu_device):
+        thread = threading.Thread(target=tlu_device.read_data, args=(16,))
+        thread.start()
+        self.assertTrue(tlu_device.dev.read_started.wait(5.0))
+        return thread
+
+    def test_endpoint_locks(self):
+        ''' Test that register access is not blocked by a pending bulk read but configuration is '''
+        tlu_device = TluDevice(device=FakeUsbDevice())
+        bulk_read = self.start_bulk_read(tlu_device)
+        try:
+            start = time.time()
+            self.assertEqual(list(tlu_device.read_register(0x10, 3)), [0x10, 0x11, 0x12])
+            tlu_device.write_register(0x10, [1, 2])
+            self.assertLess(time.time() - start, 1.0)
+
+            configured = threading.Event()
+            configure = threading.Thread(target=lambda: (tlu_device.close_board(), configured.set()))
+            configure.start()
+            self.assertFalse(configured.wait(0.2))  # waits for the bulk read (all locks)
+        finally:
+            tlu_device.dev.release()
+            bulk_read.join()
+        configure.join()
+        self.assertTrue(configured.is_set())
+
+    def test_transfer_stats(self):
+        ''' Test counting of calls, bytes, errors, timeouts and the latency histogram '''
+        stats = TransferStats()
+        with stats.measure('read_data') as transfer:
+            transfer['n_bytes'] = 100
+        with stats.measure('read_data', 20):
+            pass
+        with self.assertRaises(usb.core.USBError):
+            with stats.measure('read_data', 50):
+                raise usb.core.USBError('Operation timed out', errno=errno.ETIMEDOUT)
+        with self.assertRaises(ValueError):
+            with stats.measure('read_data', 50):
+                raise ValueError()
+        stat = stats.get_stats()['requests']['read_data']
+        self.assertEqual((stat['calls'], stat['bytes'], stat['errors'], stat['timeouts']), (4, 120, 2, 1))
+
+        stats.reset()
+        for duration in (0.5e-6, 1e-6, 3e-6, 3e-6, 1e-3, 100.0):
+            stats.add('read_register', duration, n_bytes=2)
+        stat = stats.get_stats()['requests']['read_register']
+        latency_hist = [0] * TransferStats.N_LATENCY_BINS
+        latency_hist[0], latency_hist[1], latency_hist[2], latency_hist[10], latency_hist[-1] = 1, 1, 2, 1, 1  # 1 ms: [512, 1024) us
+        self.assertEqual(stat['latency_hist'], latency_hist)
+        self.assertEqual((stat['calls'], stat['bytes'], stat['max_time']), (6, 12, 100.0))
+        self.assertEqual(TransferStats.percentile_time(stat['latency_hist'], 0.5), 4e-6)
+
+        tlu_device = TluDevice(device=FakeUsbDevice())
+        tlu_device.read_register(0, 4)  # one call per register access
+        stat = tlu_device.get_transfer_stats()['requests']['read_register']
+        self.assertEqual((stat['calls'], stat['bytes']), (1, 4))
+        # Signal and firmware requests on the control endpoint are counted as well
+        tlu_device.set_signal_direction(1)
+        tlu_device.set_signal(1)
+        tlu_device.get_signal()
+        tlu_device.get_firmware_version()
+        requests = tlu_device.get_transfer_stats()['requests']
+        for request in ('set_signal_direction', 'set_signal', 'get_signal', 'get_firmware_version'):
+            self.assertEqual(requests[request]['calls'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,6 +4,10 @@ import tables as tb
 
 from basil.utils.sim.utils import cocotb_compile_and_run, cocotb_compile_clean
 
+from pytlu.data_reader import RawDataReader, get_layout
+
+layout_nodes = ('/raw_data_delta', '/raw_data_blocks', '/raw_data_columns', '/raw_data_index')  # raw data storage, compared as /raw_data
+
 
 def nan_equal(first_array, second_array):
     ''' Compares two arrays and test for equality.
@@ -168,6 +172,7 @@ def compare_h5_files(first_file, second_file, node_names=None, ignore_nodes=None
     '''Takes two hdf5 files and check for equality of all nodes.
     Returns true if the node data is equal and the number of nodes is the number of expected nodes.
     It also returns an error string containing the names of the nodes that are not equal.
+    The raw data of pytlu raw data files is compared as node raw_data independent of the raw data layout.
 
     Parameters
     ----------
@@ -205,10 +210,19 @@ def compare_h5_files(first_file, second_file, node_names=None, ignore_nodes=None
 
             def walk_nodes(f, n, g="/"):
                 for item in f.get_node(f.root, g):
+                    if item._v_pathname in layout_nodes:
+                        continue
                     if isinstance(item, tb.group.Group):
                         walk_nodes(f=f, n=n, g=item._v_pathname)
                     else:
                         n.append(item._v_pathname)
+                if g == "/" and "/meta_data" in n and "/raw_data" not in n:
+                    n.append("/raw_data")
+
+            def get_node(f, node_name):
+                if node_name == "/raw_data" and "/meta_data" in f and get_layout(f) != 'table':
+                    return RawDataReader(f)
+                return f.get_node(f.root, node_name)
 
             fist_file_nodes = []
             walk_nodes(f=first_h5_file, n=fist_file_nodes)  # get node names
@@ -245,14 +259,15 @@ def compare_h5_files(first_file, second_file, node_names=None, ignore_nodes=None
                         error_msg += 'File %s is missing nodes: %s\n' % (second_file, ', '.join(missing_second_file_nodes))
                 common_nodes = (set(fist_file_nodes) & set(second_file_nodes)) & set(node_names)
             for node_name in common_nodes:  # loop over all nodes and compare each node, do not abort if one node is wrong
-                nrows = first_h5_file.get_node(first_h5_file.root, node_name).nrows
+                first_node, second_node = get_node(first_h5_file, node_name), get_node(second_h5_file, node_name)
+                nrows = len(first_node)
                 index_start = 0
                 while index_start < nrows:
                     # reduce memory footprint by taken array dimension into account
-                    read_nrows = max(1, int(chunk_size / np.prod(first_h5_file.get_node(first_h5_file.root, node_name).shape[1:])))
+                    read_nrows = max(1, int(chunk_size / np.prod(getattr(first_node, 'shape', (nrows,))[1:])))
                     index_stop = index_start + read_nrows
-                    first_file_data = first_h5_file.get_node(first_h5_file.root, node_name).read(index_start, index_stop)
-                    second_file_data = second_h5_file.get_node(second_h5_file.root, node_name).read(index_start, index_stop)
+                    first_file_data = first_node.read(index_start, index_stop)
+                    second_file_data = second_node.read(index_start, index_stop)
                     if exact:
                         if not nan_equal(first_array=first_file_data, second_array=second_file_data):
                             checks_passed = False